@@ -1,29 +1,107 @@
 #!/usr/bin/env python3
 
+import time
+_import_start = time.monotonic() # startup timing, see _startup below
 from importlib import import_module
 import os
-from flask import Flask, render_template, Response, redirect, request, url_for, send_from_directory
-import time
-from datetime import datetime, timedelta
-from threading import Thread
+import sys
+import atexit
+import signal
+from flask import Flask, render_template, Response, redirect, request, url_for, send_from_directory, send_file, jsonify, abort
+from werkzeug.security import safe_join
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from threading import Thread, Lock
+from collections import OrderedDict
+
+# simulated hardware (SIMULATE=1): run off-device, e.g. on a laptop or in CI
+if os.environ.get('SIMULATE'):
+    from drv import simulate
+    print('Simulated hardware:', ', '.join(simulate.install(force = True)))
+
+# hardware is set up on first use; a failing device is degraded and retried in the background instead of stopping the app
+from fnc.hardware import HardwareRegistry, DeviceUnavailable
+hardware = HardwareRegistry()
+
+def _aht20():
+    from drv.aht20driver import AHT20 # temp/hum sensor driver
+    return AHT20()
+
+def _ir_leds():
+    from drv.LEDdriver import IReyes # LED driver
+    return IReyes()
+
+def _source_camera():
+    # camera backend class; the backend module imports its camera library (picamera, cv2, ...)
+    if os.environ.get('CAMERA'):
+        return import_module('livecamera.camera_' + os.environ['CAMERA']).Camera
+    from livecamera.camera_dummy import Camera
+    return Camera
 
-# import temp/hum sensor driver
-from drv.aht20driver import AHT20
-aht20sens = AHT20()
+hardware.register('aht20', _aht20)
+hardware.register('ir', _ir_leds)
+hardware.register('camera', _source_camera)
+aht20sens = hardware.lazy('aht20')
+redeyes = hardware.lazy('ir')
 
-# import LED driver
-from drv.LEDdriver import IReyes
-redeyes = IReyes()
+def _serving_process() -> bool:
+    # the debug reloader (app.run(debug = True) below) imports this module in a watcher process as well;
+    # background threads owning the sensor and the media files only run in the process serving requests
+    return __name__ != '__main__' or os.environ.get('SERVER') == 'asgi' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
 
-# import timelapse module
+# background sampler owning the sensor; pages read its cached readings
+from fnc.sensorsampler import SensorSampler
+sensorsampler = SensorSampler(aht20sens, interval = 10.0, max_age = 30.0)
+if _serving_process():
+    sensorsampler.start()
+
+# import timelapse module (shares the IR LED driver with the live page)
 from fnc.timelapse import Timelapse
 timelapse_c = Timelapse()
+timelapse_c.set_eyes(lambda: hardware.get('ir'))
 
-# import camera driver
-if os.environ.get('CAMERA'):
-    Camera = import_module('livecamera.camera_' + os.environ['CAMERA']).Camera
-else:
-    from livecamera.camera_dummy import Camera
+# disk space: optional quotas (oldest files evicted first), free space reserve and background tmp cleanup
+from fnc.storage import StorageManager, FrameStager
+from fnc.framestore import FrameReader
+def _quota(name):
+    return float(os.environ[name]) * 2**30 if os.environ.get(name) else None
+# cached clips (a cache, evicted first) are bounded even without a movie quota
+storage = StorageManager('static/', quotas = {'mov/clips': _quota('CLIP_QUOTA_GB') or 2**30, 'mov': _quota('MOV_QUOTA_GB'), 'tmp': _quota('TMP_QUOTA_GB')},
+                         min_free = int(os.environ.get('MIN_FREE_MB', 200)) * 2**20)
+storage.add_stale('tmp', ('timelapse_', 'preview_'))
+timelapse_c.set_storage(storage, stage_dir = os.environ.get('STAGE_DIR', FrameStager.default_stage_dir()))
+def _recover_runs():
+    # movies of runs interrupted by a crash; their frames are protected before the janitor first runs
+    timelapse_c.recover_runs()
+    storage.start()
+if _serving_process():
+    Thread(target = _recover_runs, daemon = True).start()
+
+# power bank capacity (mAh) and base current of Pi and camera (mA) for the projected runtime with IR light
+timelapse_c.set_power(float(os.environ['BATTERY_MAH']) if os.environ.get('BATTERY_MAH') else None,
+                      float(os.environ.get('BASE_CURRENT_MA', 0)))
+
+# the frame broker owns the camera; live stream and (shared mode) timelapse subscribe to it
+from livecamera.broker import FrameBroker
+from livecamera.camera_broker import Camera
+framebroker = FrameBroker(lambda resolution = None: hardware.get('camera').frames(resolution))
+Camera.broker = framebroker
+timelapse_c.set_broker(framebroker)
+
+# metrics for /metrics; gauges are read at scrape time
+from fnc.metrics import REGISTRY, RateMeter, gauge, counter
+from livecamera.base_camera import VIEWERS, VIEWER_FPS
+gauge('nightowl_broker_subscribers', 'Frame broker subscribers (live stream and shared timelapse)').set_function(lambda: len(framebroker.subscribers))
+gauge('nightowl_disk_free_bytes', 'Free space on the media card').set_function(storage.free)
+gauge('nightowl_timelapse_running', 'Timelapse capturing or encoding (1) or idle (0)').set_function(lambda: int(timelapse_c.status))
+gauge('nightowl_timelapse_frames', 'Frames stored in the current/last timelapse run').set_function(lambda: timelapse_c.frame_stats['stored'])
+gauge('nightowl_ir_led_on', 'IR LEDs switched on (live page or timelapse)').set_function(lambda: getattr(hardware.peek('ir'), 'status', 0))
+
+# scaled live stream variants (e.g. /video_feed?w=320&q=50), encoded once per frame
+from livecamera.variants import VariantCache
+streamvariants = VariantCache()
+snapshotvariants = VariantCache() # same for /snapshot.jpg; the first few sizes asked for stay cached
 
 # Raspberry Pi camera module (requires picamera package)
 # from camera_pi import Camera
@@ -32,18 +110,97 @@ app = Flask(__name__)
 app.config['MOV_FOLDER'] = 'static/mov/'
 #app.config['TMP_FOLDER'] = 'static/tmp/'
 app.config['AHT20_FOLDER'] = 'static/aht20/'
+app.config['CLIP_FOLDER'] = 'static/mov/clips/'
+app.config['FILES_PER_PAGE'] = 20
+
+# cached listings of the media folders (file browser and /api/files)
+from fnc.fileindex import MediaIndex
+from fnc.clips import read_index, clip_window, extract_clip
+mediaindex = {'mov': MediaIndex(app.config['MOV_FOLDER']), 'aht20': MediaIndex(app.config['AHT20_FOLDER'], probe_ext = ())}
+media_folders = {'mov': app.config['MOV_FOLDER'], 'aht20': app.config['AHT20_FOLDER']}
+
+# continuous temperature/humidity log fed by the sensor sampler
+from fnc.sensorlog import SensorLog
+sensorlog = SensorLog(app.config['AHT20_FOLDER'])
+sensorsampler.add_listener(sensorlog.append)
+atexit.register(sensorlog.close) # up to flush_every samples are still buffered
 
-app.config['LIVESTREAM'] = 0 # livestream status lock
-# (will use time.time(); if difference to current time >10sec the thread has been terminated by the module; not elegant, but will do the job)
+# live status pushed to all open pages (/events): run state, stored frames, sensor readings, disk usage
+from fnc.events import EventHub
+from livecamera.jpegutil import scale_jpeg
+events = EventHub()
+PHASE_TEXT = {'waiting': 'wartet auf den Start', 'capturing': 'Aufnahme läuft', 'encoding': 'Film wird erstellt', 'idle': 'bereit'}
+
+def _run_event():
+    return {'running': timelapse_c.status, 'phase': timelapse_c.phase, 'phase_text': PHASE_TEXT[timelapse_c.phase],
+            'run': timelapse_c.tl_timestamp, 'storagemsg': timelapse_c.storage_message}
+
+def _on_timelapse(kind):
+    if kind == 'frame':
+        stats = timelapse_c.frame_stats
+        events.publish('frame', dict(stats, thumb = '/timelapse/last.jpg?n={}'.format(stats['stored'])))
+    else:
+        events.publish('run', _run_event())
+
+def _on_reading(reading):
+    if reading is not None:
+        events.publish('sensor', {'temp': round(reading.temperature, 1), 'hum': round(reading.humidity, 1),
+                                  'time': time.strftime('%H:%M:%S', time.localtime(reading.timestamp))})
+
+timelapse_c.add_listener(_on_timelapse)
+sensorsampler.add_listener(_on_reading)
+events.add_periodic('storage', lambda: {'free_mb': storage.free() // 2**20, 'mov_mb': storage.usage('mov') // 2**20}, 30.0)
+events.publish('run', _run_event())
+
+def _process_age():
+    """Seconds since this process was started and since system boot (Linux /proc; None elsewhere)."""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19]) # field 22: start time after boot
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK'), uptime
+    except (OSError, ValueError, IndexError):
+        return None, None
+
+# startup timing: interpreter start, app import and first served page (start page and /metrics)
+_startup = {'import': time.monotonic() - _import_start, 'interpreter': None, 'first_page': None, 'boot': None}
+_age, _ = _process_age()
+if _age is not None:
+    _startup['interpreter'] = _age - _startup['import']
+STARTUP_SECONDS = gauge('nightowl_startup_seconds', 'Startup phases: interpreter start, app import, process start to first page', ('phase',))
+for _phase in ('interpreter', 'import', 'first_page'):
+    STARTUP_SECONDS.labels(_phase).set_function(lambda phase = _phase: _startup[phase])
+
+@app.after_request
+def first_page(response):
+    """Record the time to the first served page once."""
+    if _startup['first_page'] is None:
+        age, uptime = _process_age()
+        _startup['first_page'] = age if age is not None else time.monotonic() - _import_start
+        _startup['boot'] = uptime
+        print('First page served {:.2f} s after process start'.format(_startup['first_page']))
+    return response
 
 @app.route('/')
 def index():
     """Start page."""
-    aht20sens.measure()
+    try:
+        if request.args.get('refresh'):
+            reading = sensorsampler.refresh() # forced, coalesced with concurrent requests
+        elif sensorsampler.reading is not None:
+            reading = sensorsampler.latest() # cached; measures only if older than max_age
+        else:
+            reading = None # first measurement still running in the sampler, do not hold up the page
+    except RuntimeError: # sensor degraded (DeviceUnavailable) or failing
+        reading = sensorsampler.reading
     templateData = {
         'nowtime': time.ctime(),
-        'temp': round(aht20sens.temperature, 1),
-        'hum': round(aht20sens.humidity, 1)
+        'temp': round(reading.temperature, 1) if reading else None,
+        'hum': round(reading.humidity, 1) if reading else None,
+        'sensortime': time.strftime('%H:%M:%S', time.localtime(reading.timestamp)) if reading else None,
+        'hardware': hardware.status,
+        'startup': _startup
     }
     return render_template('index.html', content = 'landing.html', **templateData)
 
@@ -59,7 +216,14 @@ def tlpage():
         'lapse_interval_data': (lapse_interval[0].strftime('%Y-%m-%dT%H:%M'), lapse_interval[1], lapse_interval[2]),
         'lapse_interval_text': ('Start', 'Aufnahmedauer (in Stunden)', 'Zeitkompressionsfaktor'),
         'camstatus': timelapse_c.status,
-        'livestatus': ((time.time() - app.config['LIVESTREAM']) < 12), # time-based lock for livestream thread (not a good solution, but ok for now)
+        'capstats': timelapse_c.capture_stats,
+        'framestats': timelapse_c.frame_stats,
+        'phasetext': PHASE_TEXT[timelapse_c.phase],
+        'timingstats': timelapse_c.timing_stats,
+        'irstats': timelapse_c.ir_stats,
+        'storagemsg': timelapse_c.storage_message,
+        'storagefree': storage.free(),
+        'livestatus': framebroker.active and not timelapse_c.cam_settings['shared_camera'], # live stream holds the camera (unless it can be shared)
         'preview_img': None,
         'camresolution_options': {'1920x1080 (FullHD 16:9)':'1920x1080',
                                     '1440x1080 (4:3)':'1440x1080',
@@ -84,7 +248,13 @@ def tlpage():
                 camiso = int(request.form.get('camiso')),
                 ir_light = (request.form.get('ir_light') == 'True'),
                 tmp_dir = request.form.get('tmp_dir'),
-                mov_dir = request.form.get('mov_dir')
+                mov_dir = request.form.get('mov_dir'),
+                encode_mode = request.form.get('encode_mode', 'stream'),
+                frame_store = request.form.get('frame_store', 'container'),
+                keep_warm = min(3600.0, max(0.0, request.form.get('keep_warm', 60.0, type = float))), # blank or invalid: default
+                shared_camera = (request.form.get('shared_camera') == 'True'),
+                capture_mode = request.form.get('capture_mode', 'interval'),
+                motion_threshold = min(100.0, max(0.1, request.form.get('motion_threshold', 2.0, type = float))) # % of pixels
                 )
             #new_cam_settings = {k:request.form.get(k) for k in timelapse_c.cam_settings}
             #timelapse_c.set_cam_params(**new_cam_settings)
@@ -124,16 +294,14 @@ def tlpage():
             #except:
             #    templateData['preview_img'] = None
         elif 'abort' in request.form:
-            # abort timelapse
+            # abort timelapse; the page follows the end of the run (and of the encode) through /events
             timelapse_c.stop()
-            time.sleep(1)
             templateData['camstatus'] = timelapse_c.status
             #lapse_thread.join(timeout=10)
         elif 'lapse_start' in request.form:
-            # start timelapse
+            # start timelapse; a refused run (e.g. no space) is reported through /events
             lapse_thread.start()
-            time.sleep(1)
-            templateData['camstatus'] = timelapse_c.status
+            templateData['camstatus'] = True
             #lapse_thread.join(timeout=1)
     else:
         # whatever
@@ -176,55 +344,374 @@ def tlpage():
 # Filebrowser
 @app.route('/download/<filename>')
 def download(filename):
-    return send_from_directory(app.config['MOV_FOLDER'], filename)
+    folder = request.args.get('folder', 'mov')
+    if folder not in media_folders:
+        abort(404)
+    return send_from_directory(media_folders[folder], filename)
 
 @app.route('/delete/<filename>', methods=['POST'])
 def delete(filename):
-    file_path = os.path.join(app.config['MOV_FOLDER'], filename)
+    folder = request.args.get('folder', 'mov')
+    file_path = safe_join(media_folders.get(folder, app.config['MOV_FOLDER']), filename)
+    if folder not in media_folders or file_path is None or not os.path.isfile(file_path):
+        abort(404)
     os.remove(file_path)
+    mediaindex[folder].notify(filename)
     return redirect(url_for('filebrowser'))
 
 @app.route('/filebrowser', methods = ['GET', 'POST'])
 def filebrowser():
-    """File download page."""
-    moviefiles = sorted(os.listdir(app.config['MOV_FOLDER']))
-    sensorfiles = sorted(os.listdir(app.config['AHT20_FOLDER']))
+    """File download page (movies paginated and sortable)."""
+    sort = request.args.get('sort', 'mtime')
+    order = request.args.get('order', 'desc')
+    page = max(request.args.get('page', 1, type = int), 1)
+    per_page = app.config['FILES_PER_PAGE']
+    moviefiles, total = mediaindex['mov'].list(sort, order == 'desc', (page - 1) * per_page, per_page)
+    sensorfiles, _ = mediaindex['aht20'].list('name', False)
+    runs = {f['name']: _run_id(f['name']) for f in moviefiles}
+    posters = {run: timelapse_c.thumbs_dir(run) + '/poster.jpg' for run in runs.values()
+               if run and os.path.isfile('static/' + timelapse_c.thumbs_dir(run) + '/poster.jpg')}
     templateData = {
-        'nowtime': time.ctime()
+        'runs': runs,
+        'posters': posters,
+        'nowtime': time.ctime(),
+        'sort': sort,
+        'order': order,
+        'page': page,
+        'pages': max((total + per_page - 1) // per_page, 1)
     }
     return render_template('index.html', content = 'filebrowser.html', moviefiles = moviefiles, sensorfiles = sensorfiles, **templateData)
 
+def _run_id(filename):
+    """Run timestamp of a timelapse movie file name (None for other files)."""
+    m = re.fullmatch(r'zeitraffer_([0-9-]+)(_partial)?\.mp4', filename)
+    return m.group(1) if m else None
+
+@app.route('/run/<run>')
+def run_detail(run):
+    """Timelapse run page: poster and sprite sheet to scrub through the night without downloading the movie."""
+    if not re.fullmatch(r'[0-9-]+', run):
+        abort(404)
+    thumbs = timelapse_c.thumbs_dir(run)
+    try:
+        with open('static/' + thumbs + '/index.json') as f:
+            thumbindex = json.load(f)
+    except (OSError, ValueError):
+        thumbindex = None
+    container = 'static/' + timelapse_c.frames_file(run)
+    frames = os.path.isfile(container)
+    if thumbindex is None and frames and not (timelapse_c.status and run == timelapse_c.tl_timestamp):
+        _build_thumbnails(run, container, 'static/' + thumbs) # e.g. run interrupted before the first tiles were saved
+    movies = [f for f in ('zeitraffer_' + run + '.mp4', 'zeitraffer_' + run + '_partial.mp4', 'zeitraffer_' + run + '_frames.csv')
+              if os.path.isfile(os.path.join(app.config['MOV_FOLDER'], f))]
+    clipindex = read_index(os.path.join(app.config['MOV_FOLDER'], 'zeitraffer_' + run + '_index.json'))
+    templateData = {
+        'nowtime': time.ctime(),
+        'run': run,
+        'thumbs': thumbs,
+        'thumbindex': thumbindex,
+        'thumbbuild': run in _thumb_builds,
+        'frames': frames,
+        'movies': movies,
+        'clipindex': clipindex
+    }
+    return render_template('index.html', content = 'run.html', **templateData)
+
+_thumb_builds = set() # runs whose thumbnails are being built from the frame container
+
+def _build_thumbnails(run, container, outdir):
+    """Build the sprite sheet of a run from its frame container in the background (once at a time)."""
+    def build():
+        try:
+            from fnc.thumbnails import build_from_container # requires PIL
+            build_from_container(container, outdir)
+        except (ImportError, OSError, ValueError) as e:
+            print('thumbnails of run {}: {}'.format(run, e))
+        finally:
+            _thumb_builds.discard(run)
+    if run not in _thumb_builds:
+        _thumb_builds.add(run)
+        Thread(target = build, daemon = True).start()
+
+_frame_readers = OrderedDict() # path -> open FrameReader, most recently used last
+_frame_readers_lock = Lock()
+
+def _read_frame(path, number, keep = 4):
+    """Frame from a container; readers are kept open between requests, and a container still being
+    written is only rescanned from its new tail."""
+    with _frame_readers_lock: # readers are closed here, so reads happen under the lock too
+        reader = _frame_readers.pop(path, None)
+        try:
+            st = os.stat(path)
+        except OSError:
+            if reader is not None:
+                reader.close() # removed (e.g. by the tmp janitor): release the file
+            raise
+        if reader is not None and reader.inode != st.st_ino:
+            reader.close() # replaced by a new file of the same name
+            reader = None
+        if reader is None:
+            reader = FrameReader(path)
+        elif st.st_size != reader.size:
+            reader.refresh()
+        _frame_readers[path] = reader
+        while len(_frame_readers) > keep:
+            _frame_readers.popitem(last = False)[1].close()
+        return reader.frame(number)
+
+@app.route('/run/<run>/frame/<int:number>.jpg')
+def run_frame(run, number):
+    """Single stored frame of a run, read from its frame container (optional width w)."""
+    if not re.fullmatch(r'[0-9-]+', run):
+        abort(404)
+    width = request.args.get('w', type = int)
+    etag = '{}-{}-{}'.format(run, number, width or 0)
+    if request.if_none_match.contains(etag):
+        response = Response(status = 304)
+    else:
+        try:
+            frame = _read_frame('static/' + timelapse_c.frames_file(run), number)
+        except (OSError, ValueError, KeyError):
+            abort(404)
+        if width:
+            frame = scale_jpeg(frame, width = min(max(width, 16), 1920), quality = 80)
+        response = Response(frame, mimetype = 'image/jpeg')
+    response.set_etag(etag)
+    response.cache_control.max_age = 86400 # stored frames never change
+    return response
+
+def _clip_time(value, run_start):
+    """Parse 'HH:MM' (the first such time after the run start) or a full time (see _parse_time) into epoch seconds."""
+    if value and re.fullmatch(r'\d{1,2}:\d{2}', value):
+        start = datetime.fromtimestamp(run_start)
+        h, m = (int(v) for v in value.split(':'))
+        try:
+            t = start.replace(hour = h, minute = m, second = 0)
+        except ValueError:
+            return None
+        if t.timestamp() < run_start - 60:
+            t += timedelta(days = 1) # run crossed midnight
+        return t.timestamp()
+    return _parse_time(value)
+
+@app.route('/clip/<filename>')
+def clip(filename):
+    """Cut a wall-clock window out of a timelapse movie without re-encoding: ?at=HH:MM&minutes=10 (window centered
+    on 'at') or ?start=&end=. The clip is cut at the surrounding keyframes, cached and served with range support."""
+    run = _run_id(filename)
+    movie = safe_join(app.config['MOV_FOLDER'], filename)
+    clipindex = read_index(os.path.join(app.config['MOV_FOLDER'], 'zeitraffer_' + run + '_index.json')) if run else None
+    if clipindex is None or movie is None or not os.path.isfile(movie) or not clipindex['keyframes']:
+        abort(404)
+    run_start = clipindex['keyframes'][0][2]
+    at = _clip_time(request.args.get('at'), run_start)
+    if at is not None:
+        half = 30 * request.args.get('minutes', 10.0, type = float)
+        start, end = at - half, at + half
+    else:
+        start = _clip_time(request.args.get('start'), run_start)
+        end = _clip_time(request.args.get('end'), run_start)
+    if start is None or end is None:
+        abort(400)
+    window = clip_window(clipindex, start, end)
+    if window is None:
+        abort(416) # window does not overlap the run
+    os.makedirs(app.config['CLIP_FOLDER'], exist_ok = True)
+    storage.enforce('mov/clips') # make room for the new clip (oldest clips first)
+    clipname = '{}_clip_{}_{}.mp4'.format(filename[:-4], *(('%.3f' % v if v is not None else 'end') for v in window))
+    clipfile = os.path.join(app.config['CLIP_FOLDER'], clipname)
+    if not extract_clip(movie, clipfile, *window):
+        abort(500)
+    # conditional = True answers Range requests, so players can seek without fetching the whole clip
+    return send_file(clipfile, mimetype = 'video/mp4', conditional = True,
+                     download_name = clipname, as_attachment = request.args.get('download') is not None)
+
+@app.template_filter('datetimeformat')
+def datetimeformat(value, fmt = '%Y-%m-%d %H:%M'):
+    return datetime.fromtimestamp(value).strftime(fmt)
+
+@app.route('/api/files')
+def api_files():
+    """JSON file listing: ?folder=mov|aht20&sort=name|mtime|size|duration&order=asc|desc&offset=&limit="""
+    folder = request.args.get('folder', 'mov')
+    if folder not in mediaindex:
+        abort(404)
+    entries, total = mediaindex[folder].list(request.args.get('sort', 'mtime'), request.args.get('order', 'desc') == 'desc',
+                                             max(request.args.get('offset', 0, type = int), 0), request.args.get('limit', None, type = int))
+    return jsonify({'folder': folder, 'total': total, 'files': entries})
+
+def _parse_time(value):
+    """Parse epoch seconds or 'YYYY-MM-DDTHH:MM' into epoch seconds (None if missing/invalid)."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M').timestamp()
+    except ValueError:
+        return None
+
+@app.route('/sensorlog')
+def sensorlog_export():
+    """Sensor log export for a time window: ?start=&end= (or ?hours=), res=raw|minute|hour|day|auto, fmt=csv|json."""
+    end = _parse_time(request.args.get('end')) or time.time()
+    start = _parse_time(request.args.get('start'))
+    if start is None:
+        start = end - 3600 * request.args.get('hours', 24.0, type = float)
+    res = request.args.get('res', 'auto')
+    if res not in ('raw', 'minute', 'hour', 'day'):
+        res = sensorlog.pick_resolution(start, end)
+    fields = sensorlog.fields(res)
+    filename = 'aht20_{}_{}_{}'.format(res, datetime.fromtimestamp(start).strftime('%Y-%m-%d-%H-%M'), datetime.fromtimestamp(end).strftime('%Y-%m-%d-%H-%M'))
+
+    if request.args.get('fmt') == 'json':
+        def gen_json():
+            yield '{"resolution": "%s", "fields": %s, "data": [' % (res, json.dumps(fields))
+            for i, rec in enumerate(sensorlog.iter_query(start, end, res)):
+                yield (',' if i else '') + json.dumps(rec)
+            yield ']}'
+        return Response(gen_json(), mimetype = 'application/json',
+                        headers = {'Content-Disposition': 'attachment; filename=' + filename + '.json'})
+
+    def gen_csv():
+        yield ','.join(fields) + '\n'
+        for rec in sensorlog.iter_query(start, end, res):
+            yield datetime.fromtimestamp(rec[0]).isoformat() + ',' + ','.join(str(v) for v in rec[1:]) + '\n'
+    return Response(gen_csv(), mimetype = 'text/csv',
+                    headers = {'Content-Disposition': 'attachment; filename=' + filename + '.csv'})
+
+@app.route('/events')
+def event_stream():
+    """Server-sent events with the live status (topics run, frame, sensor, storage); one stream per tab, shared state."""
+    return Response(events.stream(), mimetype = 'text/event-stream',
+                    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+_last_thumb = (None, None) # (etag, jpeg) of the last timelapse frame thumbnail
+
+@app.route('/timelapse/last.jpg')
+def timelapse_last():
+    """Thumbnail of the last stored timelapse frame (scaled once per frame, 304 for repeated requests)."""
+    global _last_thumb
+    count, frame = timelapse_c.last_frame
+    if frame is None:
+        abort(404)
+    etag = '{}-{}'.format(timelapse_c.tl_timestamp, count)
+    if request.if_none_match.contains(etag):
+        response = Response(status = 304)
+    else:
+        if _last_thumb[0] != etag:
+            _last_thumb = (etag, scale_jpeg(frame, width = 320, quality = 70))
+        response = Response(_last_thumb[1], mimetype = 'image/jpeg')
+    response.set_etag(etag)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of the hot-path metrics (recording starts with the first scrape)."""
+    return Response(REGISTRY.render(), mimetype = 'text/plain; version=0.0.4')
+
 # Live Video Feed
-def gen(camera):
+def gen(camera, variant = None):
     """Video streaming generator function."""
-    yield b'--frame\r\n'
-    while True:
-        frame = camera.get_frame()
-        yield b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n--frame\r\n'
+    if variant:
+        streamvariants.subscribe(variant)
+    VIEWERS.inc()
+    rate = RateMeter(VIEWER_FPS)
+    try:
+        yield b'--frame\r\n'
+        while True:
+            frame = camera.get_frame()
+            if variant:
+                frame = streamvariants.get(variant, camera.frame_id, frame)
+            rate.tick()
+            yield b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n--frame\r\n'
+    finally:
+        camera.close()
+        VIEWERS.dec()
+        if variant:
+            streamvariants.unsubscribe(variant)
 
 @app.route('/video_feed')
 def video_feed():
-    """Video streaming route. Link this URL in the src attribute of an img tag."""
-    return Response(gen(Camera()), mimetype='multipart/x-mixed-replace; boundary=frame')
+    """Video streaming route. Link this URL in the src attribute of an img tag.
+    Optional query parameters w (width in pixels) and q (JPEG quality) select a scaled variant,
+    fps caps the frame rate of this viewer (e.g. fps=2 over a slow link); the camera runs only as fast as its viewers ask."""
+    variant = streamvariants.key(request.args.get('w', type = int), request.args.get('q', type = int))
+    fps = request.args.get('fps', type = float)
+    return Response(gen(Camera(fps if fps and fps > 0 else None), variant), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+SNAPSHOTS = counter('nightowl_snapshot_requests', 'Snapshot requests: served from memory, camera started for it, or not modified', ('result',))
+_snapshot_tag = '{:x}'.format(int(time.time())) # keeps ETags unique across restarts (frame ids start at 1 again)
+
+@app.route('/snapshot.jpg')
+def snapshot():
+    """Latest live frame as a single JPEG for polling clients (home automation, scripts).
+    max_age: seconds a frame in memory may be old (default 10), otherwise the camera is started for one frame and
+    idles down again; w and q: width and JPEG quality as for /video_feed. ETag/Last-Modified answer repeated polls
+    with 304 Not Modified."""
+    max_age = max(request.args.get('max_age', 10.0, type = float), 0.0)
+    variant = streamvariants.key(request.args.get('w', type = int), request.args.get('q', type = int))
+    event = Camera.event
+    frame_id, frame = event.latest
+    if frame is None or time.time() - event.updated > max_age:
+        if timelapse_c.status and not timelapse_c.cam_settings['shared_camera']:
+            abort(503) # the timelapse holds the camera
+        camera = Camera()
+        camera.frame_id = frame_id # a frame newer than the stale one; concurrent pollers share it
+        try:
+            frame = camera.get_frame(timeout = 10)
+        finally:
+            camera.close()
+        if frame is None:
+            abort(503)
+        frame_id = camera.frame_id
+        result = 'captured'
+    else:
+        result = 'fresh'
+    modified = datetime.fromtimestamp(int(event.updated), timezone.utc)
+    etag = '{}-{}-{}'.format(_snapshot_tag, frame_id, '{}x{}'.format(*variant) if variant else 'full')
+    if request.if_none_match.contains(etag) or (not request.if_none_match and request.if_modified_since is not None
+                                               and modified.timestamp() <= request.if_modified_since.timestamp()):
+        response = Response(status = 304)
+        result = 'not_modified'
+    else:
+        if variant:
+            if variant not in snapshotvariants.variants and len(snapshotvariants.variants) < 8:
+                snapshotvariants.subscribe(variant)
+            frame = snapshotvariants.get(variant, frame_id, frame)
+        response = Response(frame, mimetype = 'image/jpeg')
+    SNAPSHOTS.labels(result).inc()
+    response.set_etag(etag)
+    response.last_modified = modified
+    response.cache_control.public = True
+    response.cache_control.max_age = max(int(max_age - (time.time() - event.updated)), 0)
+    return response
 
 @app.route('/livepage', methods = ['GET', 'POST'])
 def livepage():
     """Video streaming page."""
     templateData = {
         'nowtime': time.ctime(),
-        'IRstate': bool(redeyes.status),
-        'camstatus': timelapse_c.status
+        'IRstate': False,
+        'IRerror': None,
+        'camstatus': timelapse_c.status,
+        'camshared': timelapse_c.cam_settings['shared_camera'],
+        'campath': getattr(hardware.peek('camera'), 'capture_path', None), # backends that report it (v4l2): 'mjpeg' or 'rgb'
+        'camsize': getattr(hardware.peek('camera'), 'capture_size', None),
+        'camnote': getattr(hardware.peek('camera'), 'passthrough_unavailable', None)
     }
     
-    app.config['LIVESTREAM'] = time.time() # update livestream status
-    
-    if request.method == 'POST':
-        if request.form.get('IRled_state') == 'IRon':
-            redeyes.turn_on()
-            templateData['IRstate'] = bool(redeyes.status)
-        elif request.form.get('IRled_state') == 'IRoff':
-            redeyes.turn_off()
-            templateData['IRstate'] = bool(redeyes.status)
+    try:
+        if request.method == 'POST':
+            if request.form.get('IRled_state') == 'IRon':
+                redeyes.turn_on()
+            elif request.form.get('IRled_state') == 'IRoff':
+                redeyes.turn_off()
+        templateData['IRstate'] = bool(redeyes.status)
+    except DeviceUnavailable as e:
+        templateData['IRerror'] = e.error
     return render_template('index.html', content = 'livepage.html', **templateData)
 
 #@app.route("/toggle_lights/", methods = ['POST'])
@@ -237,6 +724,7 @@ def livepage():
 def poweroff():
     if request.method == 'POST':
         if request.form.get('poweroff') == 'poweroff_yes':
+            sensorlog.close()
             os.system('sudo systemctl poweroff')
             return redirect('/goodnight')
         else:
@@ -249,4 +737,12 @@ def goodnight():
 
 
 if __name__ == '__main__':
-    app.run(host = '0.0.0.0', port = 80, debug = True, threaded = True)
+    if os.environ.get('SERVER') == 'asgi':
+        # asyncio server: live stream viewers are coroutines, other routes run in a bounded thread pool
+        import uvicorn
+        from asgi import DashboardASGI
+        uvicorn.run(DashboardASGI(app, Camera, streamvariants, events = events), host = '0.0.0.0', port = 80)
+    else:
+        # systemctl stop sends SIGTERM; exit normally so the atexit handlers run
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        app.run(host = '0.0.0.0', port = 80, debug = True, threaded = True)
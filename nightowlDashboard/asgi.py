@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""ASGI server mode for the dashboard.
+
+The live stream (/video_feed) is served natively on the asyncio event loop: a
+single bridge thread reads frames from the camera and every viewer is a
+coroutine, so additional viewers do not cost an OS thread each. The status
+event stream (/events) is served the same way, one coroutine per open tab. All other
+routes are handed to the Flask app, which runs in a small bounded thread pool;
+this is also where the blocking hardware calls (AHT20, PiCamera) end up.
+
+Selected by starting app.py with SERVER=asgi (requires uvicorn), or run
+directly with `uvicorn --factory asgi:create_app`.
+"""
+
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from fnc.metrics import RateMeter
+from livecamera.base_camera import VIEWERS, VIEWER_FPS
+
+EXECUTOR_WORKERS = int(os.environ.get('ASGI_WORKERS', 4))
+
+
+class AsyncFrameHub:
+    """ Delivers camera frames to asyncio viewers.
+
+    One bridge thread waits for frames from the (threaded) camera and publishes them on the event loop;
+    viewers await a frame newer than the one they have, like CameraEvent does for threads. The bridge
+    asks the camera for the highest frame rate of its viewers.
+    """
+    def __init__(self, camera_class) -> None:
+        self._camera_class = camera_class
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock() # guards viewers, caps and the bridge thread
+        self._event = None
+        self.latest = (0, None)
+        self.viewers = 0
+        self._caps = [] # fps cap per viewer (None: uncapped)
+
+    @property
+    def fps(self) -> float:
+        if not self._caps or None in self._caps:
+            return None
+        return max(self._caps)
+
+    def subscribe(self, fps: float = None) -> None:
+        with self._lock:
+            self.viewers += 1
+            self._caps.append(fps)
+            if self._thread is None:
+                self._loop = asyncio.get_running_loop()
+                if self._event is None:
+                    self._event = asyncio.Event()
+                self._start_bridge()
+
+    def unsubscribe(self, fps: float = None) -> None:
+        with self._lock:
+            self.viewers -= 1
+            self._caps.remove(fps)
+
+    def _start_bridge(self, delay: float = 0) -> None:
+        # caller holds the lock
+        self._thread = threading.Thread(target = self._bridge, args = (delay,), daemon = True)
+        self._thread.start()
+
+    async def wait(self, after_id: int = 0, timeout: float = 1.0):
+        """ Returns (frame_id, frame) of a frame newer than after_id, or (after_id, None) on timeout. """
+        if self.latest[0] <= after_id:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return after_id, None
+        return self.latest
+
+    def _publish(self, frame_id: int, frame: bytes) -> None:
+        # runs on the event loop
+        self.latest = (frame_id, frame)
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    def _bridge(self, delay: float = 0) -> None:
+        clean_exit = False
+        camera = None
+        try:
+            time.sleep(delay)
+            camera = self._camera_class(self.fps)
+            while True:
+                with self._lock:
+                    if self.viewers <= 0:
+                        break
+                    camera.fps = self.fps
+                frame = camera.get_frame()
+                self._loop.call_soon_threadsafe(self._publish, camera.frame_id, frame)
+            clean_exit = True
+        finally:
+            if camera is not None:
+                camera.close()
+            with self._lock:
+                self._thread = None
+                if self.viewers > 0:
+                    # subscribed while we were shutting down (or the camera failed: retry after a pause)
+                    self._start_bridge(0 if clean_exit else 1.0)
+
+
+class AsyncEvents:
+    """ Wakes the /events coroutines when the event hub (fnc.events.EventHub) publishes. """
+    def __init__(self, hub) -> None:
+        self.hub = hub
+        self._loop = None
+        self._event = None
+        hub.add_listener(self._published)
+
+    def wakeup(self) -> asyncio.Event:
+        """ Event set by the next publish; grab it before reading the changes, so none is missed. """
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+        return self._event
+
+    def _published(self) -> None:
+        # runs in the publishing thread
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self) -> None:
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+
+class DashboardASGI:
+    """ ASGI application: native /video_feed and /events, everything else through the Flask (WSGI) app. """
+    def __init__(self, wsgi_app, camera_class, variants, workers: int = EXECUTOR_WORKERS, events = None) -> None:
+        self.wsgi_app = wsgi_app
+        self.variants = variants
+        self.hub = AsyncFrameHub(camera_class)
+        self.events = AsyncEvents(events) if events is not None else None
+        self.executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'nightowl-io')
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self.executor.shutdown(wait = False)
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        elif scope['type'] == 'http':
+            if scope['path'] == '/video_feed':
+                await self._video_feed(scope, receive, send)
+            elif scope['path'] == '/events' and self.events is not None:
+                await self._events(scope, receive, send)
+            else:
+                await self._wsgi(scope, receive, send)
+
+    async def _video_feed(self, scope, receive, send) -> None:
+        loop = asyncio.get_running_loop()
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        try:
+            variant = self.variants.key(*(int(query[k][0]) if k in query else None for k in ('w', 'q')))
+        except ValueError:
+            variant = None
+        try:
+            fps = float(query['fps'][0]) if 'fps' in query else None
+        except ValueError:
+            fps = None
+        fps = fps if fps and fps > 0 else None
+
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        self.hub.subscribe(fps)
+        if variant:
+            self.variants.subscribe(variant)
+        VIEWERS.inc()
+        rate = RateMeter(VIEWER_FPS)
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame')]})
+            await send({'type': 'http.response.body', 'body': b'--frame\r\n', 'more_body': True})
+            frame_id = 0
+            next_due = loop.time()
+            while not disconnected.done():
+                if fps:
+                    # per-viewer rate cap; other viewers may ask the camera for more
+                    await asyncio.sleep(max(next_due - loop.time(), 0))
+                    next_due = max(next_due + 1 / fps, loop.time())
+                frame_id, frame = await self.hub.wait(frame_id)
+                if frame is None:
+                    continue
+                if variant:
+                    # scaling is CPU work; keep it off the event loop
+                    frame = await loop.run_in_executor(self.executor, self.variants.get, variant, frame_id, frame)
+                await send({'type': 'http.response.body',
+                            'body': b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n--frame\r\n',
+                            'more_body': True})
+                rate.tick()
+        finally:
+            VIEWERS.dec()
+            disconnected.cancel()
+            self.hub.unsubscribe(fps)
+            if variant:
+                self.variants.unsubscribe(variant)
+
+    async def _events(self, scope, receive, send) -> None:
+        hub = self.events.hub
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        hub.connect()
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                    (b'x-accel-buffering', b'no')]})
+            await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+            seq = 0
+            while not disconnected.done():
+                wakeup = self.events.wakeup()
+                seq, chunk = hub.changes(seq)
+                if not chunk:
+                    waiter = asyncio.ensure_future(wakeup.wait())
+                    done, _ = await asyncio.wait((waiter, disconnected), timeout = hub.keepalive,
+                                                 return_when = asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                    if done:
+                        continue
+                    chunk = b': keepalive\n\n'
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            disconnected.cancel()
+            hub.disconnect()
+
+    @staticmethod
+    async def _wait_disconnect(receive) -> None:
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def _wsgi(self, scope, receive, send) -> None:
+        loop = asyncio.get_running_loop()
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        response = {}
+        def start_response(status, headers, exc_info = None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return lambda data: None
+
+        # the Flask app (and the blocking hardware calls it makes) runs in the bounded executor
+        result = await loop.run_in_executor(self.executor, self.wsgi_app, self._environ(scope, body), start_response)
+        chunks = iter(result)
+        done = object()
+        try:
+            chunk = await loop.run_in_executor(self.executor, next, chunks, done)
+            await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+            while chunk is not done:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(self.executor, next, chunks, done)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+
+    @staticmethod
+    def _environ(scope, body: bytes) -> dict:
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'].encode('utf8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                environ[name] = value
+            else:
+                key = 'HTTP_' + name
+                environ[key] = environ[key] + ',' + value if key in environ else value
+        return environ
+
+
+def create_app() -> DashboardASGI:
+    """ Factory for `uvicorn --factory asgi:create_app`; imports (and initializes) the Flask app. """
+    import app as dashboard
+    return DashboardASGI(dashboard.app, dashboard.Camera, dashboard.streamvariants, events = dashboard.events)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""AHT20 driver latency benchmark.
+
+Measures the latency per measurement of drv.aht20driver.AHT20 against a
+FakeSMBus with a Raspberry Pi bus/sensor timing model, next to a replica of
+the previous driver's access pattern (new SMBus handle per transaction,
+status check before triggering, fixed 20 ms busy polls, separate status and
+data reads).
+
+Run from the nightowlDashboard folder:
+    python3 -m bench.bench_aht20 [--n 20]
+"""
+
+import argparse
+import os
+import time
+
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from drv import aht20driver
+from drv.aht20driver import AHT20, AHT20_ADDRESS, AHT20_TRIGGER, AHT20_BUSY, TRIG_DATA01
+from drv import fake_smbus
+from drv.fake_smbus import FakeSMBus
+
+
+class LegacyAccess:
+    """Access pattern of the previous driver's measure()."""
+    def busywait(self):
+        while True:
+            with FakeSMBus() as sens:
+                status = sens.read_byte(AHT20_ADDRESS)
+            if not status & AHT20_BUSY:
+                return
+            time.sleep(0.02)
+
+    def measure(self):
+        self.busywait()
+        with FakeSMBus() as sens:
+            sens.write_i2c_block_data(AHT20_ADDRESS, AHT20_TRIGGER, TRIG_DATA01)
+        self.busywait()
+        with FakeSMBus() as sens:
+            return sens.read_i2c_block_data(AHT20_ADDRESS, 0x00, 6)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def bench(label, measure, n):
+    FakeSMBus.opens = 0
+    FakeSMBus.transactions = 0
+    lat = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        measure()
+        lat.append(time.perf_counter() - t0)
+    print('{:<24} {:>9.1f} {:>9.1f} {:>9.1f} {:>11.1f} {:>10.1f}'.format(
+        label, 1e3 * sum(lat) / n, 1e3 * percentile(lat, 50), 1e3 * percentile(lat, 99),
+        FakeSMBus.opens / n, FakeSMBus.transactions / n))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=20, help='measurements per variant')
+    args = parser.parse_args()
+
+    print('{:<24} {:>9} {:>9} {:>9} {:>11} {:>10}'.format(
+        'variant (per call)', 'mean [ms]', 'p50 [ms]', 'p99 [ms]', 'bus opens', 'i2c xfers'))
+    legacy = LegacyAccess()
+    bench('before (per-op SMBus)', legacy.measure, args.n)
+
+    sensor = AHT20(bus=FakeSMBus())
+    bench('after: measure()', sensor.measure, args.n)
+    bench('after: measure_n(4)', lambda: sensor.measure_n(4), max(args.n // 4, 1))
+    print('conversion time modelled as {:.0f} ms, driver waits {:.0f} ms before the first read'.format(
+        1e3 * fake_smbus.CONVERSION_TIME, 1e3 * aht20driver.AHT20_MEASURE_TIME))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Live stream fan-out benchmark.
+
+Runs the camera_dummy backend at a fixed frame rate and attaches 1, 10 and
+100 simulated viewers that pull frames via BaseCamera.get_frame() like the
+/video_feed generator does. Reports the camera thread's cost per published
+frame, the delivery latency and the frames skipped per viewer.
+
+Run from the nightowlDashboard folder:
+    python3 -m bench.bench_fanout [--fps 30] [--seconds 5] [--viewers 1 10 100]
+"""
+
+import argparse
+import os
+import threading
+import time
+
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from livecamera.base_camera import BaseCamera, CameraEvent
+from livecamera.camera_dummy import Camera
+
+
+class TimedEvent(CameraEvent):
+    """CameraEvent that records publish times and the cost of set()."""
+    def __init__(self):
+        super(TimedEvent, self).__init__()
+        self.published = {}
+        self.set_cost = []
+
+    def set(self, frame):
+        t0 = time.perf_counter()
+        super(TimedEvent, self).set(frame)
+        t1 = time.perf_counter()
+        self.published[self.frame_id] = t0
+        self.set_cost.append(t1 - t0)
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def run(viewers, fps, seconds):
+    event = TimedEvent()
+    BaseCamera.event = event
+    Camera.fps = fps
+    stop = threading.Event()
+    latencies = []
+    delivered = []
+    skipped = []
+    lock = threading.Lock()
+
+    def viewer():
+        camera = Camera()
+        lat = []
+        n = 0
+        while not stop.is_set():
+            camera.get_frame()
+            lat.append(time.perf_counter() - event.published.get(camera.frame_id, time.perf_counter()))
+            n += 1
+        camera.close()
+        with lock:
+            latencies.extend(lat)
+            delivered.append(n)
+            skipped.append(camera.skipped)
+
+    threads = [threading.Thread(target=viewer) for _ in range(viewers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    # let the camera thread stop at its next frame
+    BaseCamera.last_access = 0
+    while BaseCamera.thread is not None:
+        time.sleep(0.01)
+
+    return {
+        'viewers': viewers,
+        'frames': event.frame_id,
+        'set_us': 1e6 * sum(event.set_cost) / max(len(event.set_cost), 1),
+        'lat_p50_ms': 1e3 * percentile(latencies, 50),
+        'lat_p99_ms': 1e3 * percentile(latencies, 99),
+        'delivered': sum(delivered) / max(len(delivered), 1),
+        'skipped': sum(skipped) / max(len(skipped), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--viewers', type=int, nargs='+', default=[1, 10, 100])
+    args = parser.parse_args()
+
+    print('{:>8} {:>8} {:>10} {:>10} {:>10} {:>12} {:>10}'.format(
+        'viewers', 'frames', 'set [us]', 'p50 [ms]', 'p99 [ms]', 'frames/view', 'skipped'))
+    for n in args.viewers:
+        r = run(n, args.fps, args.seconds)
+        print('{viewers:>8} {frames:>8} {set_us:>10.1f} {lat_p50_ms:>10.2f} {lat_p99_ms:>10.2f} '
+              '{delivered:>12.1f} {skipped:>10.1f}'.format(**r))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""Hardware-free benchmark suite.
+
+Runs the dashboard on simulated hardware (drv.simulate: fake PiCamera, GPIO
+and SMBus with latency models) in a scratch working directory and measures:
+
+  startup   fresh process (simulated hardware) until the first page is served
+  routes    request latency and throughput of the main pages (Flask test client)
+  stream    /video_feed fan-out to several viewers (camera_pi backend)
+  capture   timelapse fast capture loop (deadline lateness, capture duration)
+            and cold/warm still captures of the slow path (CameraSession)
+  encode    stream encoder and parallel re-encode throughput (needs ffmpeg)
+  frames    storing a run as single JPEG files vs. one frame container
+            (append, random read, tmp cleanup)
+
+Every section reports latency percentiles, throughput and the peak of
+Python memory allocations (tracemalloc); the process max RSS is printed at
+the end. --json writes all results for comparison between commits.
+
+Run from the nightowlDashboard folder:
+    python3 -m bench.bench_suite [--sections startup routes stream capture encode frames]
+        [--requests 50] [--viewers 1 5 20] [--seconds 5] [--json out.json]
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+DASHBOARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, DASHBOARD)
+
+from drv import simulate
+
+ROUTES = ('/', '/timelapse', '/filebrowser', '/api/files', '/livepage', '/metrics', '/sensorlog?hours=1')
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def summary(values, scale=1e3):
+    return {'p50': scale * percentile(values, 50), 'p95': scale * percentile(values, 95),
+            'p99': scale * percentile(values, 99), 'max': scale * max(values) if values else float('nan')}
+
+
+def measured(fn, *args):
+    """Run fn and add the peak of Python allocations during the run (MB) to its result."""
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    for r in (result if isinstance(result, list) else [result]):
+        r['peak_mb'] = peak / 2**20
+    return result
+
+
+STARTUP_SCRIPT = '''
+import app
+app.app.test_client().get('/')
+print(app._startup['interpreter'] or 0, app._startup['import'], app._startup['first_page'])
+import os
+os._exit(0)
+'''
+
+
+def bench_startup(runs):
+    """Cold starts in a new interpreter each (same working directory, SIMULATE=1)."""
+    env = dict(os.environ, SIMULATE='1', PYTHONPATH=DASHBOARD)
+    phases = {'interpreter': [], 'app import': [], 'first page': []}
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], env=env, capture_output=True, text=True, check=True).stdout
+        interpreter, imported, first_page = (float(v) for v in out.splitlines()[-1].split())
+        phases['interpreter'].append(interpreter)
+        phases['app import'].append(imported)
+        phases['first page'].append(first_page)
+    return [dict(name=name, rate=len(values) / sum(values), **summary(values)) for name, values in phases.items()]
+
+
+def bench_routes(app, requests):
+    client = app.app.test_client()
+    results = []
+    for route in ROUTES:
+        client.get(route)  # warm-up (templates, caches)
+        lat = []
+        t0 = time.perf_counter()
+        for _ in range(requests):
+            t = time.perf_counter()
+            client.get(route).close()
+            lat.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - t0
+        results.append(dict(name=route, rate=requests / elapsed, **summary(lat)))
+    return results
+
+
+def bench_stream(app, viewers, seconds):
+    results = []
+    for n in viewers:
+        stop = threading.Event()
+        intervals = []
+        lock = threading.Lock()
+
+        def viewer():
+            response = app.app.test_client().get('/video_feed', buffered=False)
+            chunks = iter(response.response)
+            local, last = [], None
+            try:
+                while not stop.is_set():
+                    next(chunks)
+                    now = time.perf_counter()
+                    if last is not None:
+                        local.append(now - last)
+                    last = now
+            finally:
+                response.close()
+            with lock:
+                intervals.extend(local)
+
+        threads = [threading.Thread(target=viewer) for _ in range(n)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        # frames per second and viewer once streaming (the camera warm-up is not counted)
+        rate = len(intervals) / sum(intervals) if intervals else 0.0
+        results.append(dict(name='{} viewers'.format(n), rate=rate, **summary(intervals)))
+    return results
+
+
+def bench_capture(app, seconds):
+    from fnc.camsession import CameraSession
+    timelapse = app.timelapse_c
+    timelapse.set_cam_params(encode_mode='stream' if shutil.which('ffmpeg') else 'batch')
+    timelapse.set_interval(datetime.now(), seconds / 3600, 2.4)  # one frame every 0.1 s
+    timelapse.start()
+    stats = timelapse.timing_stats
+    results = [{'name': 'fast loop lateness', 'rate': stats['frames'] / seconds, 'p50': 1e3 * stats['late_mean'],
+                'p95': 1e3 * stats['late_p95'], 'p99': float('nan'), 'max': 1e3 * stats['late_max']},
+               {'name': 'fast loop capture', 'rate': stats['frames'] / seconds, 'p50': 1e3 * stats['capture_mean'],
+                'p95': float('nan'), 'p99': float('nan'), 'max': 1e3 * stats['capture_max']}]
+    for keep_warm, name in ((0, 'still, cold open'), (60, 'still, warm')):
+        lat = []
+        with CameraSession('854x480', keep_warm=keep_warm) as session:
+            for _ in range(10):
+                lat.append(session.capture(io.BytesIO(), format='jpeg'))
+                session.idle(1)
+        results.append(dict(name=name, rate=len(lat) / sum(lat), **summary(lat)))
+    return results
+
+
+def bench_encode(frames):
+    if not shutil.which('ffmpeg'):
+        print('encode: ffmpeg not found, skipped')
+        return []
+    from drv.fake_picamera import fake_jpeg
+    from fnc.encoder import StreamEncoder
+    from fnc.reencode import reencode
+    results = []
+    encoder = StreamEncoder('static/tmp/bench_stream.mp4')
+    encoder.open()
+    lat = []
+    t0 = time.perf_counter()
+    for i in range(frames):
+        t = time.perf_counter()
+        encoder.write(fake_jpeg((854, 480), i))
+        lat.append(time.perf_counter() - t)
+    encoder.close()
+    results.append(dict(name='stream encoder', rate=frames / (time.perf_counter() - t0), **summary(lat)))
+    for i in range(frames):
+        with open('static/tmp/timelapse_2000-01-01-00-00-00_frame_{:06d}.jpg'.format(i), 'wb') as f:
+            f.write(fake_jpeg((854, 480), i))
+    report = reencode('static/tmp', '2000-01-01-00-00-00', 'static/tmp/bench_reencode.mp4', quality='fast', segment_frames=96)
+    results.append({'name': 're-encode ({} jobs)'.format(report['jobs']), 'rate': report['fps'],
+                    'p50': float('nan'), 'p95': float('nan'), 'p99': float('nan'), 'max': 1e3 * report['total_time']})
+    return results
+
+
+def bench_frames(frames):
+    import random
+    from drv.fake_picamera import fake_jpeg
+    from fnc.framestore import FrameWriter, FrameReader
+    data = [fake_jpeg((854, 480), i % 24) for i in range(frames)]
+    results = []
+    # single files, as written by the batch mode before containers
+    lat = []
+    t0 = time.perf_counter()
+    for i, frame in enumerate(data):
+        t = time.perf_counter()
+        with open('static/tmp/timelapse_2000-01-01-00-00-01_frame_{:06d}.jpg'.format(i), 'wb') as f:
+            f.write(frame)
+        lat.append(time.perf_counter() - t)
+    results.append(dict(name='files, store', rate=frames / (time.perf_counter() - t0), **summary(lat)))
+    lat = []
+    for i in random.sample(range(frames), min(frames, 200)):
+        t = time.perf_counter()
+        with open('static/tmp/timelapse_2000-01-01-00-00-01_frame_{:06d}.jpg'.format(i), 'rb') as f:
+            f.read()
+        lat.append(time.perf_counter() - t)
+    results.append(dict(name='files, random read', rate=len(lat) / sum(lat), **summary(lat)))
+    t = time.perf_counter()
+    for f in sorted(glob.glob('static/tmp/timelapse_2000-01-01-00-00-01*')):
+        os.remove(f)
+    t = time.perf_counter() - t
+    results.append({'name': 'files, clear tmp', 'rate': frames / t, 'p50': float('nan'), 'p95': float('nan'),
+                    'p99': float('nan'), 'max': 1e3 * t})
+    # one container per run
+    lat = []
+    writer = FrameWriter('static/tmp/timelapse_2000-01-01-00-00-02.frames')
+    t0 = time.perf_counter()
+    for i, frame in enumerate(data):
+        t = time.perf_counter()
+        writer.append(i, frame)
+        lat.append(time.perf_counter() - t)
+    writer.close()
+    results.append(dict(name='container, store', rate=frames / (time.perf_counter() - t0), **summary(lat)))
+    lat = []
+    for _ in range(20):
+        t = time.perf_counter()
+        FrameReader('static/tmp/timelapse_2000-01-01-00-00-02.frames').close()  # loads the index
+        lat.append(time.perf_counter() - t)
+    results.append(dict(name='container, open', rate=len(lat) / sum(lat), **summary(lat)))
+    lat = []
+    with FrameReader('static/tmp/timelapse_2000-01-01-00-00-02.frames') as reader:
+        for i in random.sample(range(frames), min(frames, 200)):
+            t = time.perf_counter()
+            reader.read(i)
+            lat.append(time.perf_counter() - t)
+    results.append(dict(name='container, random read', rate=len(lat) / sum(lat), **summary(lat)))
+    t = time.perf_counter()
+    for f in sorted(glob.glob('static/tmp/timelapse_2000-01-01-00-00-02*')):
+        os.remove(f)
+    t = time.perf_counter() - t
+    results.append({'name': 'container, clear tmp', 'rate': frames / t, 'p50': float('nan'), 'p95': float('nan'),
+                    'p99': float('nan'), 'max': 1e3 * t})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sections', nargs='+', default=['startup', 'routes', 'stream', 'capture', 'encode', 'frames'])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--viewers', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--frames', type=int, default=240)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    # scratch working directory: the app keeps its media below ./static
+    workdir = tempfile.mkdtemp(prefix='nightowl_bench_')
+    for folder in ('mov', 'tmp', 'aht20'):
+        os.makedirs(os.path.join(workdir, 'static', folder))
+    os.chdir(workdir)
+    os.environ['CAMERA'] = 'pi'
+    os.environ['STAGE_DIR'] = os.path.join(workdir, 'stage')
+    simulate.install(force=True)
+    import app
+    app.REGISTRY.render()  # record metrics like a scraped unit would
+
+    results = {}
+    try:
+        if 'startup' in args.sections:
+            results['startup'] = measured(bench_startup, 5)
+        if 'routes' in args.sections:
+            results['routes'] = measured(bench_routes, app, args.requests)
+        if 'stream' in args.sections:
+            results['stream'] = measured(bench_stream, app, args.viewers, args.seconds)
+        if 'capture' in args.sections:
+            results['capture'] = measured(bench_capture, app, args.seconds)
+        if 'encode' in args.sections:
+            results['encode'] = measured(bench_encode, args.frames)
+        if 'frames' in args.sections:
+            results['frames'] = measured(bench_frames, 10 * args.frames)
+    finally:
+        os.chdir(DASHBOARD)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print('{:<8} {:<22} {:>10} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'section', 'case', 'rate [1/s]', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]', 'max [ms]', 'peak [MB]'))
+    for section, rows in results.items():
+        for r in rows:
+            print('{:<8} {name:<22} {rate:>10.1f} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f} {max:>9.2f} {peak_mb:>9.1f}'.format(section, **r))
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('max RSS {:.1f} MB'.format(maxrss))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'results': results, 'maxrss_mb': maxrss}, f, indent=1)
+    os._exit(0)  # camera and sampler threads are not meant to be stopped
+
+
+if __name__ == '__main__':
+    main()
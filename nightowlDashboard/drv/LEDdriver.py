@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
 import RPi.GPIO as GPIO
+from time import monotonic
 
 
 IR_LED_PINS = (13,15)
+IR_LED_CURRENT_MA = 140 # per LED string
 
 class IReyes:
     def __init__(self) -> None:
@@ -11,21 +13,36 @@ class IReyes:
         for p in IR_LED_PINS:
             GPIO.setup(p, GPIO.OUT)
         self._state = 0
+        self._on_since = None # monotonic time the LEDs were switched on
+        self._on_time = 0.0 # accumulated LED-on seconds
+        self._switches = 0
 
     def toggle(self) -> None:
         for p in IR_LED_PINS:
             GPIO.output(p, not GPIO.input(p))
             self._state = self._state & GPIO.input(p)
+        self._account(GPIO.input(IR_LED_PINS[0]))
 
     def turn_on(self) -> None:
         self._state = 1
         for p in IR_LED_PINS:
             GPIO.output(p, 1)
+        self._account(True)
 
     def turn_off(self) -> None:
         self._state = 0
         for p in IR_LED_PINS:
             GPIO.output(p, 0)
+        self._account(False)
+
+    def _account(self, on: bool) -> None:
+        # keep track of the LED-on time for the energy estimate
+        if on and self._on_since is None:
+            self._on_since = monotonic()
+            self._switches += 1
+        elif not on and self._on_since is not None:
+            self._on_time += monotonic() - self._on_since
+            self._on_since = None
 
     def cleanup(self) -> None:
         GPIO.cleanup()
@@ -33,3 +50,17 @@ class IReyes:
     @property
     def status(self):
         return self._state
+
+    @property
+    def on_seconds(self) -> float:
+        """ Total time the LEDs have been switched on (seconds). """
+        return self._on_time + (monotonic() - self._on_since if self._on_since is not None else 0.0)
+
+    @property
+    def switches(self) -> int:
+        return self._switches
+
+    @property
+    def current_ma(self) -> float:
+        """ Current drawn while the LEDs are on (mA). """
+        return IR_LED_CURRENT_MA * len(IR_LED_PINS)
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
-from smbus2 import SMBus
 from time import time, sleep
+from threading import Lock
+from fnc.metrics import histogram
+
+I2C_SECONDS = histogram('nightowl_i2c_transaction_seconds', 'AHT20 I2C transaction time', (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1), ('op',))
 
 # NOTE: smbus functions require a register byte which is referred to as command byte in the sensor datasheet and here;
 #       data blocks can be read from register byte 0x00 (or any byte as it appears, although it seems preferable to avoid reading a command byte)
@@ -17,6 +20,10 @@ AHT20_RESET     = 0xBA  # soft reset command
 AHT20_CAL       = 0x08  # calibration status byte; only used for cross-check in driver
 AHT20_BUSY      = 0x80  # busy status byte; only used for cross-check in driver
 
+AHT20_MEASURE_TIME = 0.08   # conversion time after trigger as per data sheet (s)
+AHT20_POLL_TIME    = 0.005  # status poll interval once the conversion time has passed (s)
+AHT20_TIMEOUT      = 1.0    # give up if the sensor stays busy for this long (s)
+
 
 # data bytes
 # see AHT20 data sheet for reference
@@ -25,73 +32,108 @@ TRIG_DATA01 = [0x33, 0x00]
 
 
 class AHT20:
-    def __init__(self, i2cbus: int = I2C_BUS_NUMBER) -> None:
-        sleep(0.04) # wait for sensor self-init
-        #self.i2cdevice = SMBus(i2cbus) # establish i2c bus connection
+    def __init__(self, i2cbus: int = I2C_BUS_NUMBER, bus = None) -> None:
+        """ Opens the I2C bus once and keeps the handle; bus can be passed in (e.g. drv.fake_smbus.FakeSMBus). """
+        own_bus = bus is None
+        if own_bus:
+            from smbus2 import SMBus
+            bus = SMBus(i2cbus)
+        self._bus = bus # persistent bus handle, shared by all transactions
+        self._lock = Lock() # one transaction sequence at a time
         self._buffer = [0] * 6
-        self.reset() # reset sensor
-        if not self.calibrate(): # check calibration state
-            raise RuntimeError("AHT20: calibration failed")
+        try:
+            sleep(0.04) # wait for sensor self-init
+            self.reset() # reset sensor
+            if not self.calibrate(): # check calibration state
+                raise RuntimeError("AHT20: calibration failed")
+        except BaseException:
+            if own_bus:
+                bus.close() # do not leak the /dev/i2c handle on every retry of a missing sensor
+            raise
         self._temp = None
         self._hum = None
-    
+
+    def close(self) -> None:
+        """ Release the bus handle. """
+        with self._lock:
+            self._bus.close()
+
     def reset(self) -> None:
         """ Soft reset sensor. """
-        self._buffer[0] = AHT20_RESET
-        with SMBus(I2C_BUS_NUMBER) as sens:
-            sens.write_byte(AHT20_ADDRESS, self._buffer[0])
+        with self._lock:
+            self._bus.write_byte(AHT20_ADDRESS, AHT20_RESET)
         sleep(0.02)
-    
+
     def calibrate(self) -> bool:
         """ Manually intialize sensor and check calibration status. """
-        self._buffer[0] = AHT20_INIT
-        self._buffer[1:3] = INIT_DATA01
-        self._busywait()
-        with SMBus(I2C_BUS_NUMBER) as sens: # ask sensor to initialize
-            sens.write_i2c_block_data(AHT20_ADDRESS, self._buffer[0], self._buffer[1:3])
-        sleep(0.01)
-        self._busywait()
-        if not self.status & AHT20_CAL: # compute calibration status
-            return False
-        return True
-
-    def _busywait(self) -> None:
-        """ Internal helper function to wait for sensor action. """
-        self._now = time()
-        while self.status & AHT20_BUSY: # check if busy
-            sleep(0.02)
-            if (time() - self._now) > 10:
-                raise RuntimeError("AHT20: aborted - received busy signal for 10 seconds")
+        with self._lock:
+            self._busywait()
+            self._bus.write_i2c_block_data(AHT20_ADDRESS, AHT20_INIT, INIT_DATA01) # ask sensor to initialize
+            sleep(0.01)
+            status = self._busywait()
+        return bool(status & AHT20_CAL) # compute calibration status
+
+    def _busywait(self, timeout: float = AHT20_TIMEOUT) -> int:
+        """ Internal helper function to wait for sensor action; returns the last status byte. """
+        t0 = time()
+        status = self._bus.read_byte(AHT20_ADDRESS)
+        while status & AHT20_BUSY: # check if busy
+            if (time() - t0) > timeout:
+                raise RuntimeError("AHT20: aborted - received busy signal for {} seconds".format(timeout))
+            sleep(AHT20_POLL_TIME)
+            status = self._bus.read_byte(AHT20_ADDRESS)
+        return status
 
     @property
     def status(self) -> int:
         """ Obtains status byte from sensor. """
-        with SMBus(I2C_BUS_NUMBER) as sens:
-            self._buffer[5] = sens.read_byte(AHT20_ADDRESS)
+        with self._lock:
+            self._buffer[5] = self._bus.read_byte(AHT20_ADDRESS)
         return self._buffer[5]
 
     @property
     def temperature(self) -> int:
         #self.measure()
         return self._temp
-    
+
     @property
     def humidity(self) -> int:
         #self.measure()
         return self._hum
-    
-    def measure(self) -> None:
-        self._buffer[0] = AHT20_TRIGGER
-        self._buffer[1:3] = TRIG_DATA01
-        self._busywait()
-        with SMBus(I2C_BUS_NUMBER) as sens:
-            sens.write_i2c_block_data(AHT20_ADDRESS, self._buffer[0], self._buffer[1:3])
-        self._busywait()
-        with SMBus(I2C_BUS_NUMBER) as sens:
-            self._buffer = sens.read_i2c_block_data(AHT20_ADDRESS, 0x00, 6) # read six bytes (1 status byte + 5 data bytes)
-        self._hum = ((
+
+    def _read_measurement(self) -> tuple:
+        """ Trigger a measurement and return (temperature, humidity). Caller holds the lock. """
+        t0 = time()
+        self._bus.write_i2c_block_data(AHT20_ADDRESS, AHT20_TRIGGER, TRIG_DATA01)
+        I2C_SECONDS.labels('trigger').observe(time() - t0)
+        sleep(AHT20_MEASURE_TIME) # conversion time as per data sheet, no point in polling earlier
+        t0 = time()
+        # status and data in one transaction: read six bytes (1 status byte + 5 data bytes)
+        self._buffer = self._bus.read_i2c_block_data(AHT20_ADDRESS, 0x00, 6)
+        I2C_SECONDS.labels('read').observe(time() - t0)
+        while self._buffer[0] & AHT20_BUSY: # conversion not finished yet, poll briefly
+            if (time() - t0) > AHT20_TIMEOUT:
+                raise RuntimeError("AHT20: aborted - measurement not ready after {} seconds".format(AHT20_TIMEOUT))
+            sleep(AHT20_POLL_TIME)
+            t1 = time()
+            self._buffer = self._bus.read_i2c_block_data(AHT20_ADDRESS, 0x00, 6)
+            I2C_SECONDS.labels('read').observe(time() - t1)
+        hum = ((
             (self._buffer[1] << 12) | (self._buffer[2] << 4) | (self._buffer[3] >> 4) # stitch humidity data bytes together
             ) / 2**20) * 100 # convert humidity data; refer to data sheet for details
-        self._temp = ((
+        temp = ((
             ((self._buffer[3] & 0xF) << 16) | (self._buffer[4] << 8) | self._buffer[5] # stitch temperature data bytes together
-            ) / 2**20) * 200 - 50 # convert temperature data; refer to data sheet for details
\ No newline at end of file
+            ) / 2**20) * 200 - 50 # convert temperature data; refer to data sheet for details
+        return temp, hum
+
+    def measure(self) -> None:
+        with self._lock:
+            self._temp, self._hum = self._read_measurement()
+
+    def measure_n(self, n: int = 4) -> tuple:
+        """ Take n measurements back to back (one bus lock) and store their average; returns (temperature, humidity). """
+        with self._lock:
+            values = [self._read_measurement() for _ in range(max(n, 1))]
+        self._temp = sum(v[0] for v in values) / len(values)
+        self._hum = sum(v[1] for v in values) / len(values)
+        return self._temp, self._hum
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+""" RPi.GPIO stand-in (module interface) for running off-device; see drv.simulate.
+
+Pin levels are kept in memory; every call costs PIN_TIME like a GPIO register access through the
+Python binding. Outputs and level changes are counted for benchmarks.
+"""
+
+from time import sleep
+
+PIN_TIME = 0.000005 # one GPIO call (s)
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+HIGH = 1
+LOW = 0
+
+latency = True
+mode = None
+pins = {} # pin -> level
+outputs = 0
+changes = 0
+
+def _delay() -> None:
+    if latency:
+        sleep(PIN_TIME)
+
+def setmode(m: int) -> None:
+    global mode
+    mode = m
+
+def setwarnings(flag: bool) -> None:
+    pass
+
+def setup(pin: int, direction: int, initial: int = LOW) -> None:
+    _delay()
+    pins[pin] = initial
+
+def output(pin: int, value) -> None:
+    global outputs, changes
+    _delay()
+    outputs += 1
+    value = 1 if value else 0
+    if pins.get(pin) != value:
+        changes += 1
+    pins[pin] = value
+
+def input(pin: int) -> int:
+    _delay()
+    return pins.get(pin, LOW)
+
+def cleanup(pin = None) -> None:
+    if pin is None:
+        pins.clear()
+    else:
+        pins.pop(pin, None)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import io
+import os
+from time import sleep, monotonic
+
+# timing model of a Raspberry Pi camera module (v2) on a Pi 3/4
+OPEN_TIME         = 0.35   # sensor init when PiCamera() is created (s)
+STILL_BASE_TIME   = 0.12   # mode switch and exposure of a still capture (s)
+STILL_PIXEL_TIME  = 0.08   # still capture JPEG encoding per megapixel (s)
+VIDEO_FRAME_TIME  = 1 / 30 # video port frame interval (s)
+AGC_SETTLE_TIME   = 0.6    # auto exposure adapting to a change of illumination (s)
+
+
+class FakePiCamera:
+    """ PiCamera stand-in with a capture latency model; implements the subset of the picamera API used here.
+
+    Frames are generated JPEGs at the configured resolution (with PIL; otherwise the livecamera sample
+    images). YUV captures return a flat luminance that follows illumination() (e.g. the fake IR LEDs)
+    with an auto exposure delay, so IR lead time calibration can be exercised.
+    Opens and captures are counted class-wide.
+    """
+    latency = True
+    opens = 0
+    captures = 0
+    illumination = staticmethod(lambda: 0.0) # 0..1, set by drv.simulate
+
+    def __init__(self, resolution = None, framerate = 30, **kwargs) -> None:
+        self.resolution = resolution or (640, 480)
+        self.framerate = framerate
+        self.iso = 0
+        self.exposure_speed = 33000
+        self.shutter_speed = 0
+        self.exposure_mode = 'auto'
+        self.awb_mode = 'auto'
+        self.awb_gains = (1.5, 1.2)
+        self.closed = False
+        self._agc = (FakePiCamera.illumination(),) * 2 + (monotonic(),) # (from, to, since) of the exposure ramp
+        FakePiCamera.opens += 1
+        self._delay(OPEN_TIME)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.closed = True
+
+    def start_preview(self, **kwargs) -> None:
+        pass
+
+    def stop_preview(self) -> None:
+        pass
+
+    def _delay(self, seconds: float) -> None:
+        if FakePiCamera.latency:
+            sleep(seconds)
+
+    def _size(self, resize = None) -> tuple:
+        res = resize or self.resolution
+        if isinstance(res, str):
+            w, h = res.lower().split('x')
+            return int(w), int(h)
+        return int(res[0]), int(res[1])
+
+    def _level(self, now: float) -> float:
+        # illumination the auto exposure has adapted to so far (linear ramp over AGC_SETTLE_TIME)
+        start, target, since = self._agc
+        if self.exposure_mode != 'auto' or not FakePiCamera.latency:
+            return target
+        return start + (target - start) * min((now - since) / AGC_SETTLE_TIME, 1.0)
+
+    def _brightness(self) -> float:
+        now = monotonic()
+        light = FakePiCamera.illumination()
+        if light != self._agc[1]:
+            self._agc = (self._level(now), light, now)
+        return 40 + 120 * self._level(now)
+
+    def capture(self, output, format = 'jpeg', use_video_port = False, resize = None, **kwargs) -> None:
+        w, h = self._size(resize)
+        if use_video_port:
+            self._delay(VIDEO_FRAME_TIME)
+        else:
+            self._delay(STILL_BASE_TIME + STILL_PIXEL_TIME * w * h / 1e6)
+        FakePiCamera.captures += 1
+        if format == 'yuv':
+            y = bytes([int(self._brightness())]) * (w * h)
+            data = y + bytes([128]) * (w * h // 2)
+        else:
+            data = fake_jpeg((w, h), FakePiCamera.captures)
+        if isinstance(output, str):
+            with open(output, 'wb') as f:
+                f.write(data)
+        else:
+            output.write(data)
+
+    def capture_continuous(self, output, format = 'jpeg', use_video_port = False, **kwargs):
+        while not self.closed:
+            self.capture(output, format, use_video_port, **kwargs)
+            yield output
+
+
+_jpeg_cache = {}
+
+def fake_jpeg(size: tuple, n: int = 0) -> bytes:
+    """ One of a few distinct JPEGs of the given size (cached), with a realistic file size. """
+    key = (size, n % 4)
+    if key not in _jpeg_cache:
+        try:
+            from PIL import Image, ImageDraw
+        except ImportError:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'livecamera', str(n % 3 + 1) + '.jpg'), 'rb') as f:
+                return f.read()
+        img = Image.effect_noise(size, 24).convert('RGB') # sensor noise of a dark scene
+        draw = ImageDraw.Draw(img)
+        x = (n % 4) * size[0] // 5
+        draw.ellipse((x, size[1] // 3, x + size[0] // 6, size[1] // 3 + size[0] // 6), fill = (180, 180, 180))
+        out = io.BytesIO()
+        img.save(out, format = 'jpeg', quality = 85)
+        _jpeg_cache[key] = out.getvalue()
+    return _jpeg_cache[key]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+from time import time, sleep
+
+# timing model of a Raspberry Pi I2C bus at 100 kHz with an AHT20 attached
+OPEN_TIME        = 0.0005  # opening /dev/i2c-N and setting up the handle (s)
+TRANSACTION_TIME = 0.0003  # fixed cost of one I2C transaction (s)
+BYTE_TIME        = 0.0001  # per transferred byte (s)
+CONVERSION_TIME  = 0.075   # AHT20 measurement duration after trigger (s)
+
+
+class FakeAHT20:
+    """ State of the emulated sensor; shared by all bus handles of one bus number. """
+    def __init__(self, temperature: float = 21.5, humidity: float = 45.0) -> None:
+        self.temperature = temperature
+        self.humidity = humidity
+        self.busy_until = 0
+        self.calibrated = False
+        self.measurements = 0
+
+    def status(self) -> int:
+        busy = 0x80 if time() < self.busy_until else 0
+        return busy | (0x08 if self.calibrated else 0) | 0x10
+
+    def data(self) -> list:
+        hum = round(self.humidity / 100 * 2**20)
+        temp = round((self.temperature + 50) / 200 * 2**20)
+        return [self.status(),
+                (hum >> 12) & 0xFF, (hum >> 4) & 0xFF,
+                ((hum & 0xF) << 4) | ((temp >> 16) & 0xF),
+                (temp >> 8) & 0xFF, temp & 0xFF, 0]
+
+
+class FakeSMBus:
+    """ SMBus stand-in that emulates an AHT20 at address 0x38, including bus and conversion latencies.
+
+    Implements the subset of the smbus2.SMBus API used by drv.aht20driver. Opens and transactions are
+    counted (class-wide) so benchmarks can compare access patterns.
+    """
+    devices = {} # bus number -> FakeAHT20
+    latency = True
+    opens = 0
+    transactions = 0
+
+    def __init__(self, bus: int = 1) -> None:
+        if bus not in FakeSMBus.devices:
+            FakeSMBus.devices[bus] = FakeAHT20()
+        self.sensor = FakeSMBus.devices[bus]
+        FakeSMBus.opens += 1
+        self._delay(OPEN_TIME)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        pass
+
+    def _delay(self, seconds: float) -> None:
+        if FakeSMBus.latency:
+            sleep(seconds)
+
+    def _transaction(self, nbytes: int) -> None:
+        FakeSMBus.transactions += 1
+        self._delay(TRANSACTION_TIME + nbytes * BYTE_TIME)
+
+    def write_byte(self, addr: int, value: int) -> None:
+        self._transaction(2)
+        if value == 0xBA: # soft reset
+            self.sensor.calibrated = False
+
+    def write_i2c_block_data(self, addr: int, cmd: int, data: list) -> None:
+        self._transaction(2 + len(data))
+        if cmd in (0xBE, 0xE1): # initialize
+            self.sensor.calibrated = True
+            self.sensor.busy_until = time() + (0.01 if FakeSMBus.latency else 0)
+        elif cmd == 0xAC: # trigger measurement
+            self.sensor.measurements += 1
+            self.sensor.busy_until = time() + (CONVERSION_TIME if FakeSMBus.latency else 0)
+
+    def read_byte(self, addr: int) -> int:
+        self._transaction(2)
+        return self.sensor.status()
+
+    def read_i2c_block_data(self, addr: int, cmd: int, length: int) -> list:
+        self._transaction(2 + length)
+        return self.sensor.data()[:length]
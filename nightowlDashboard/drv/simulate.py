@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+""" Simulated hardware for running the dashboard off-device (laptop, CI, benchmarks).
+
+install() registers stand-ins for picamera, RPi.GPIO and smbus2 in sys.modules, so the unchanged
+drivers import them: drv.fake_picamera, drv.fake_gpio and drv.fake_smbus, each with a latency model.
+The fake camera sees the IR LEDs (pins of drv.LEDdriver) as illumination.
+Started with SIMULATE=1, app.py installs them before importing any driver.
+"""
+
+import sys
+import types
+
+def install(latency: bool = True, force: bool = False) -> list:
+    """ Install the stand-ins; real modules that are importable are kept unless force. Returns the simulated module names. """
+    from drv import fake_picamera, fake_gpio, fake_smbus
+    fake_picamera.FakePiCamera.latency = latency
+    fake_gpio.latency = latency
+    fake_smbus.FakeSMBus.latency = latency
+
+    installed = []
+    def available(name: str) -> bool:
+        if force:
+            return False
+        try:
+            __import__(name)
+            return True
+        except (ImportError, RuntimeError): # RPi.GPIO raises RuntimeError off-device
+            return False
+
+    if not available('picamera'):
+        sys.modules['picamera'] = types.ModuleType('picamera')
+        sys.modules['picamera'].PiCamera = fake_picamera.FakePiCamera
+        installed.append('picamera')
+    if not available('RPi.GPIO'):
+        rpi = types.ModuleType('RPi')
+        rpi.GPIO = fake_gpio
+        sys.modules['RPi'] = rpi
+        sys.modules['RPi.GPIO'] = fake_gpio
+        installed.append('RPi.GPIO')
+    if not available('smbus2'):
+        sys.modules['smbus2'] = types.ModuleType('smbus2')
+        sys.modules['smbus2'].SMBus = fake_smbus.FakeSMBus
+        installed.append('smbus2')
+
+    from drv.LEDdriver import IR_LED_PINS
+    fake_picamera.FakePiCamera.illumination = staticmethod(lambda: sum(fake_gpio.pins.get(p, 0) for p in IR_LED_PINS) / len(IR_LED_PINS))
+    return installed
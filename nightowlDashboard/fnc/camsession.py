@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+from time import monotonic
+from collections import deque
+
+class CameraSession:
+    """ Keeps a PiCamera open between timelapse frames.
+
+    Opening the sensor costs init and warm-up time (plus the AGC settle time if the exposure is fixed),
+    so the camera stays open and idle as long as the next frame is due within keep_warm seconds.
+    For longer intervals the camera is released between frames and reopened on demand.
+    """
+    def __init__(self, resolution: str, setup = None, keep_warm: float = 60.0, history: int = 100) -> None:
+        self._resolution = resolution
+        self._setup = setup # called with the opened camera, e.g. to fix exposure
+        self._keep_warm = keep_warm
+        self._camera = None
+        self._latencies = deque(maxlen = history)
+        self._opens = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def open(self):
+        if self._camera is None:
+            from picamera import PiCamera # imported on first use, off-device the app starts without it
+            self._camera = PiCamera(resolution = self._resolution)
+            self._opens += 1
+            if self._setup:
+                self._setup(self._camera)
+        return self._camera
+
+    def capture(self, output, **kwargs) -> float:
+        """ Capture one still into output; returns capture latency in seconds (including a cold open). """
+        t0 = monotonic()
+        self.open().capture(output, **kwargs)
+        latency = monotonic() - t0
+        self._latencies.append(latency)
+        return latency
+
+    def idle(self, next_frame_in: float) -> None:
+        """ Called between frames; releases the sensor if the next frame is too far away. """
+        if next_frame_in > self._keep_warm:
+            self.close()
+
+    def close(self) -> None:
+        if self._camera is not None:
+            self._camera.close()
+            self._camera = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._camera is not None
+
+    @property
+    def last_latency(self) -> float:
+        return self._latencies[-1] if self._latencies else None
+
+    @property
+    def stats(self) -> dict:
+        lat = sorted(self._latencies)
+        return {
+            'frames': len(lat),
+            'opens': self._opens,
+            'warm': self.is_open,
+            'last': self.last_latency,
+            'mean': sum(lat) / len(lat) if lat else None,
+            'max': lat[-1] if lat else None
+        }
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import bisect
+import subprocess
+from datetime import datetime
+
+KEYFRAME_INTERVAL = 24 # frames between forced keyframes (1 s of movie at 24 fps)
+
+def write_index(path: str, framerate: int, frame_log: list, first_frame: int = 0, gop: int = KEYFRAME_INTERVAL) -> None:
+    """ Write the keyframe/time index of a movie: capture time of every keyframe and its position in the stream.
+
+    frame_log holds (frame counter, 'YYYY-mm-dd HH:MM:SS', score) of the stored frames; frames before
+    first_frame are not part of this movie (e.g. after a fallback to batch encoding).
+    """
+    keyframes = []
+    frames = 0
+    end_time = None
+    for counter, capture_time, _ in frame_log:
+        frame = counter - first_frame
+        if frame < 0:
+            continue
+        frames += 1
+        end_time = datetime.strptime(capture_time, '%Y-%m-%d %H:%M:%S').timestamp()
+        if frame % gop == 0:
+            keyframes.append([frame, round(frame / framerate, 3), end_time])
+    index = {'framerate': framerate, 'gop': gop, 'frames': frames, 'end_time': end_time, 'keyframes': keyframes}
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(path + '.tmp', path)
+
+def read_index(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def clip_window(index: dict, t_start: float, t_end: float) -> tuple:
+    """ Movie positions (seconds) for a wall-clock window, widened to the surrounding keyframes.
+    Returns (start, duration) with duration None meaning "until the end", or None if the window is outside the movie. """
+    keyframes = index['keyframes']
+    if not keyframes or t_start > t_end or t_end < keyframes[0][2] or t_start > index['end_time']:
+        return None
+    times = [k[2] for k in keyframes]
+    i = max(bisect.bisect_right(times, t_start) - 1, 0) # last keyframe captured at or before t_start
+    j = max(bisect.bisect_left(times, t_end), i + 1) # first keyframe captured at or after t_end (at least one GOP)
+    start = keyframes[i][1]
+    duration = round(keyframes[j][1] - start, 3) if j < len(keyframes) else None
+    return start, duration
+
+def extract_clip(movie: str, outfile: str, start: float, duration: float = None) -> bool:
+    """ Cut a clip by stream copy (no re-encoding); start should be a keyframe position. """
+    if os.path.isfile(outfile):
+        return True # cached
+    cmd = ['ffmpeg', '-loglevel', 'error', '-y', '-ss', str(start), '-i', movie]
+    if duration is not None:
+        cmd += ['-t', str(duration)]
+    cmd += ['-c', 'copy', '-movflags', '+faststart', outfile + '.tmp.mp4']
+    try:
+        ok = subprocess.run(cmd, timeout = 300).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        ok = False
+    if ok:
+        os.replace(outfile + '.tmp.mp4', outfile)
+    elif os.path.isfile(outfile + '.tmp.mp4'):
+        os.remove(outfile + '.tmp.mp4')
+    return ok
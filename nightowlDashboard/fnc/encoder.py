@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import os
+import subprocess
+from time import monotonic
+from fnc.clips import KEYFRAME_INTERVAL
+from fnc.metrics import histogram
+
+ENCODE_SECONDS = histogram('nightowl_encode_seconds', 'Time to hand one frame to the stream encoder (mode=stream) or to encode a whole run (mode=batch)',
+                           (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60, 300, 900), ('mode',))
+
+def pipe_command(outfile: str, framerate: int = 24, preset: str = 'ultrafast', gop: int = KEYFRAME_INTERVAL) -> list:
+    """ ffmpeg command that encodes JPEG frames read from stdin (image2pipe) into a fragmented MP4. """
+    return ['ffmpeg', '-loglevel', 'error', '-y',
+            '-f', 'image2pipe', '-framerate', str(framerate), '-c:v', 'mjpeg', '-i', '-',
+            '-c:v', 'libx264', '-preset', preset, '-pix_fmt', 'yuv420p',
+            '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4', outfile]
+
+def encode_frames(frames, outfile: str, framerate: int = 24, preset: str = 'ultrafast', gop: int = KEYFRAME_INTERVAL) -> bool:
+    """ Encode an iterable of JPEG frames (e.g. read from a frame container) into outfile in one go. """
+    proc = subprocess.Popen(pipe_command(outfile, framerate, preset, gop), stdin = subprocess.PIPE)
+    written = 0
+    try:
+        for frame in frames:
+            proc.stdin.write(frame)
+            written += 1
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        retcode = proc.wait()
+    return retcode == 0 and written > 0 and os.path.isfile(outfile)
+
+class StreamEncoder:
+    """ Long-running ffmpeg process that encodes JPEG frames as they are captured.
+
+    Frames are piped into ffmpeg (image2pipe) and written as fragmented MP4, so the file on disk
+    is playable up to the last completed fragment even if the run is interrupted.
+    """
+    def __init__(self, outfile: str, framerate: int = 24, preset: str = 'ultrafast', gop: int = KEYFRAME_INTERVAL) -> None:
+        self._outfile = outfile
+        self._framerate = framerate
+        self._preset = preset
+        self._gop = gop # fixed keyframe interval, see fnc.clips
+        self._proc = None
+        self._frames = 0
+
+    def open(self) -> None:
+        if self._proc is None:
+            self._proc = subprocess.Popen(pipe_command(self._outfile, self._framerate, self._preset, self._gop), stdin = subprocess.PIPE)
+            self._frames = 0
+
+    def write(self, frame: bytes) -> bool:
+        """ Feed one JPEG frame to the encoder; returns False if the encoder has gone away. """
+        if self._proc is None:
+            self.open()
+        t0 = monotonic()
+        try:
+            self._proc.stdin.write(frame)
+        except (BrokenPipeError, ValueError):
+            return False
+        ENCODE_SECONDS.labels('stream').observe(monotonic() - t0) # blocks while ffmpeg is behind
+        self._frames += 1
+        return True
+
+    def close(self, timeout: float = 60) -> bool:
+        """ Flush remaining frames and wait for ffmpeg to finalize the file. """
+        if self._proc is None:
+            return False
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            retcode = self._proc.wait(timeout = timeout)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            retcode = self._proc.wait()
+        self._proc = None
+        return retcode == 0 and self._frames > 0 and os.path.isfile(self._outfile)
+
+    @property
+    def frames(self) -> int:
+        return self._frames
+
+    @property
+    def running(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import json
+from time import monotonic
+from threading import Thread, Condition
+from fnc.metrics import gauge
+
+EVENT_CLIENTS = gauge('nightowl_event_clients', 'Open /events streams (browser tabs)')
+
+class EventHub:
+    """ Live status for all open pages as server-sent events (/events).
+
+    publish() keeps only the latest message per topic, serialized once; every stream sends the topics
+    that changed since its own last send. A slow or background tab therefore gets the newest state
+    instead of a backlog, and a publish costs the same for one tab or fifty. A new stream starts with
+    the latest message of every topic. Periodic sources (e.g. disk usage) are polled by one thread, and
+    only while a stream is open. Listeners (e.g. the asyncio server) are told after every publish.
+    """
+    def __init__(self, keepalive: float = 15.0) -> None:
+        self.keepalive = keepalive # comment line sent on idle streams, so proxies keep them open
+        self._cond = Condition()
+        self._seq = 0
+        self._latest = {} # topic -> (seq, encoded event)
+        self._periodic = [] # [topic, function, interval, next due]
+        self._listeners = []
+        self._thread = None
+        self.clients = 0
+
+    def publish(self, topic: str, data) -> None:
+        message = 'event: {}\ndata: {}\n\n'.format(topic, json.dumps(data, separators = (',', ':'))).encode()
+        with self._cond:
+            self._seq += 1
+            self._latest[topic] = (self._seq, message)
+            self._cond.notify_all()
+        for callback in self._listeners:
+            callback()
+
+    def add_periodic(self, topic: str, function, interval: float) -> None:
+        """ Publish function() under topic every interval seconds while streams are open. """
+        self._periodic.append([topic, function, interval, 0])
+
+    def add_listener(self, callback) -> None:
+        """ callback() is invoked (in the publishing thread) after every publish. """
+        self._listeners.append(callback)
+
+    def changes(self, seq: int = 0) -> tuple:
+        """ (current sequence number, events published after seq) without blocking. """
+        with self._cond:
+            return self._seq, self._collect(seq)
+
+    def _collect(self, seq: int) -> bytes:
+        # caller holds the lock
+        return b''.join(m for s, m in sorted(self._latest.values()) if s > seq)
+
+    def connect(self) -> None:
+        with self._cond:
+            self.clients += 1
+            if self._thread is None and self._periodic:
+                self._thread = Thread(target = self._poll, daemon = True)
+                self._thread.start()
+            self._cond.notify_all()
+        EVENT_CLIENTS.inc()
+
+    def disconnect(self) -> None:
+        with self._cond:
+            self.clients -= 1
+        EVENT_CLIENTS.dec()
+
+    def stream(self):
+        """ Event stream generator for one client (threaded server). """
+        self.connect()
+        try:
+            seq = 0
+            yield b'retry: 3000\n\n' # reconnect delay for EventSource
+            while True:
+                with self._cond:
+                    if self._cond.wait_for(lambda: self._seq > seq, self.keepalive):
+                        chunk = self._collect(seq)
+                        seq = self._seq
+                    else:
+                        chunk = b': keepalive\n\n'
+                yield chunk
+        finally:
+            self.disconnect()
+
+    def _poll(self) -> None:
+        while True:
+            with self._cond:
+                if self.clients <= 0:
+                    self._thread = None
+                    return
+            now = monotonic()
+            for source in self._periodic:
+                topic, function, interval, due = source
+                if now >= due:
+                    source[3] = now + interval
+                    try:
+                        self.publish(topic, function())
+                    except Exception as e: # a failing source must not end the stream
+                        print('events: {} failed: {}'.format(topic, e))
+            delay = min(s[3] for s in self._periodic) - monotonic()
+            with self._cond:
+                self._cond.wait_for(lambda: self.clients <= 0, max(delay, 0.1))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import subprocess
+from time import time
+from queue import Queue
+from threading import Thread, Lock
+
+class MediaIndex:
+    """ Cached listing of a media folder with size, mtime and (for movies) duration and frame count.
+
+    The folder is only rescanned when its directory mtime changes (files created, deleted or renamed)
+    or the last scan is older than max_age (files growing in place). Movie metadata is probed with
+    ffprobe in a background thread and persisted in a hidden cache file, so it survives restarts.
+    """
+    CACHE_FILE = '.mediaindex.json'
+    SORT_KEYS = ('name', 'mtime', 'size', 'duration')
+
+    def __init__(self, folder: str, probe_ext: tuple = ('.mp4',), max_age: float = 30.0) -> None:
+        self._folder = folder
+        self._probe_ext = probe_ext
+        self._max_age = max_age
+        self._entries = {}
+        self._dir_mtime = None
+        self._scanned = 0
+        self._lock = Lock()
+        self._probe_queue = Queue()
+        self._prober = None
+        self._load_cache()
+
+    def refresh(self, force: bool = False) -> None:
+        try:
+            dir_mtime = os.stat(self._folder).st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                self._entries = {}
+            return
+        if not force and dir_mtime == self._dir_mtime and (time() - self._scanned) < self._max_age:
+            return
+        entries = {}
+        with os.scandir(self._folder) as it:
+            for e in it:
+                if e.name.startswith('.') or not e.is_file():
+                    continue
+                st = e.stat()
+                old = self._entries.get(e.name)
+                if old and old['size'] == st.st_size and old['mtime'] == st.st_mtime:
+                    entries[e.name] = old # unchanged, keep probed metadata
+                else:
+                    entries[e.name] = {'name': e.name, 'size': st.st_size, 'mtime': st.st_mtime, 'duration': None, 'frames': None}
+                    if e.name.endswith(self._probe_ext):
+                        self._probe_queue.put(e.name)
+        with self._lock:
+            self._entries = entries
+            self._dir_mtime = dir_mtime
+            self._scanned = time()
+        if not self._probe_queue.empty():
+            self._start_prober()
+
+    def notify(self, name: str = None) -> None:
+        """ Signal that a file was created, changed or deleted (forces a rescan on next access). """
+        self._dir_mtime = None
+
+    def list(self, sort: str = 'mtime', reverse: bool = True, offset: int = 0, limit: int = None) -> tuple:
+        """ Returns (entries, total) for one page of the sorted listing. """
+        self.refresh()
+        sort = sort if sort in self.SORT_KEYS else 'mtime'
+        with self._lock:
+            entries = list(self._entries.values())
+        entries.sort(key = lambda e: (e[sort] is not None, e[sort] or 0) if sort != 'name' else e['name'], reverse = reverse)
+        end = None if limit is None else offset + limit
+        return entries[offset:end], len(entries)
+
+    def get(self, name: str) -> dict:
+        self.refresh()
+        return self._entries.get(name)
+
+    def _start_prober(self) -> None:
+        # checked and started under the lock: concurrent refreshes start one worker writing the cache file
+        with self._lock:
+            if self._prober is None or not self._prober.is_alive():
+                self._prober = Thread(target = self._probe_worker, daemon = True)
+                self._prober.start()
+
+    def _probe_worker(self) -> None:
+        while True:
+            with self._lock:
+                if self._probe_queue.empty():
+                    self._prober = None # names queued from now on start a new worker
+                    return
+            name = self._probe_queue.get()
+            entry = self._entries.get(name)
+            if entry is None:
+                continue
+            entry['duration'], entry['frames'] = self.probe(os.path.join(self._folder, name))
+            self._save_cache()
+
+    @staticmethod
+    def probe(path: str) -> tuple:
+        """ (duration in seconds, frame count) of a movie via ffprobe; (None, None) if unavailable. """
+        cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+               '-show_entries', 'stream=nb_read_packets,duration:format=duration', '-of', 'json', path]
+        try:
+            info = json.loads(subprocess.run(cmd, capture_output = True, timeout = 120).stdout or b'{}')
+        except (OSError, subprocess.TimeoutExpired, ValueError):
+            return None, None
+        stream = (info.get('streams') or [{}])[0]
+        duration = stream.get('duration') or info.get('format', {}).get('duration')
+        frames = stream.get('nb_read_packets')
+        return (round(float(duration), 2) if duration else None), (int(frames) if frames else None)
+
+    def _load_cache(self) -> None:
+        try:
+            with open(os.path.join(self._folder, self.CACHE_FILE)) as f:
+                self._entries = {e['name']: e for e in json.load(f)}
+        except (OSError, ValueError, KeyError, TypeError):
+            self._entries = {}
+
+    def _save_cache(self) -> None:
+        with self._lock:
+            entries = [e for e in self._entries.values() if e['duration'] is not None or e['frames'] is not None]
+        try:
+            with open(os.path.join(self._folder, self.CACHE_FILE + '.tmp'), 'w') as f:
+                json.dump(entries, f)
+            os.replace(os.path.join(self._folder, self.CACHE_FILE + '.tmp'), os.path.join(self._folder, self.CACHE_FILE))
+        except OSError:
+            pass
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import struct
+from time import time
+from bisect import bisect_left, bisect_right
+
+# container layout:
+#   header   MAGIC
+#   records  RECORD (tag, frame number, capture time, length) + JPEG data, appended as frames arrive
+#   index    ENTRY (frame number, capture time, data offset, length) per frame, written by close()
+#   trailer  TRAILER (index offset, frame count, INDEX_MAGIC)
+# A container without a valid trailer (interrupted run) is read by scanning the record headers;
+# a torn last record is ignored, and recover() truncates it and appends the index.
+MAGIC = b'NOWLFRM1'
+INDEX_MAGIC = b'NOWLIDX1'
+RECORD_TAG = b'FRAM'
+RECORD = struct.Struct('<4sIdI')
+ENTRY = struct.Struct('<IdQI')
+TRAILER = struct.Struct('<QI8s')
+
+SUFFIX = '.frames'
+CONTAINER_PATTERN = re.compile(r'timelapse_([0-9-]+)\.frames$')
+
+class FrameWriter:
+    """ Appends the JPEG frames of one run to a single container file instead of one file per frame.
+
+    Every record is handed to the OS as soon as it is appended, so a crash of the app loses nothing,
+    and the kernel writes the file back to the card in large sequential chunks. sync_every forces a
+    sync every N frames to bound the loss on a power cut (off by default: a sync blocks the capture
+    loop on a slow card). close() appends the offset/time index for random access.
+    """
+    def __init__(self, path: str, sync_every: int = None) -> None:
+        self.path = path
+        self._sync_every = sync_every
+        self._f = None
+        self._index = [] # (frame number, capture time, data offset, length)
+        self._pos = 0
+
+    def open(self) -> None:
+        self._f = open(self.path, 'wb')
+        self._f.write(MAGIC)
+        self._f.flush()
+        self._pos = len(MAGIC)
+
+    def append(self, number: int, frame: bytes, capture_time: float = None) -> None:
+        if self._f is None:
+            self.open()
+        capture_time = time() if capture_time is None else capture_time
+        self._f.write(RECORD.pack(RECORD_TAG, number, capture_time, len(frame)))
+        self._f.write(frame)
+        self._f.flush()
+        self._index.append((number, capture_time, self._pos + RECORD.size, len(frame)))
+        self._pos += RECORD.size + len(frame)
+        if self._sync_every and len(self._index) % self._sync_every == 0:
+            os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        """ Append the index and sync; the container is complete afterwards. """
+        if self._f is None:
+            return
+        _write_index(self._f, self._index, self._pos)
+        self._f.close()
+        self._f = None
+
+    @property
+    def frames(self) -> int:
+        return len(self._index)
+
+    @property
+    def size(self) -> int:
+        return self._pos
+
+class FrameReader:
+    """ Random access to the frames of a container, complete or still being written.
+
+    Frames are read with pread, so one reader may be shared between threads (refresh() excepted).
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        try:
+            st = os.fstat(self._fd)
+            self.inode, self.size = st.st_ino, st.st_size
+            self.index, self.complete, self.end = _load_index(self._fd, self.size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self.numbers = [e[0] for e in self.index]
+        self.times = [e[1] for e in self.index]
+
+    def refresh(self) -> bool:
+        """ Pick up what was appended to a container that is still being written: only the new tail is
+        scanned (or the index loaded, once the writer has closed it). Returns True if frames were added. """
+        if self.complete:
+            return False
+        size = os.fstat(self._fd).st_size
+        if size == self.size:
+            return False
+        index, complete, end = _load_index(self._fd, size, self.end)
+        count = len(self.index)
+        self.size, self.complete, self.end = size, complete, end
+        if complete:
+            self.index = index
+            self.numbers = [e[0] for e in index]
+            self.times = [e[1] for e in index]
+        else:
+            self.index.extend(index)
+            self.numbers.extend(e[0] for e in index)
+            self.times.extend(e[1] for e in index)
+        return len(self.index) > count
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __enter__(self) -> 'FrameReader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def read(self, i: int) -> bytes:
+        """ JPEG data of the i-th stored frame. """
+        _, _, offset, length = self.index[i]
+        return os.pread(self._fd, length, offset)
+
+    def frame(self, number: int) -> bytes:
+        """ JPEG data of a frame by its frame number (KeyError if it was not stored). """
+        i = bisect_left(self.numbers, number)
+        if i == len(self.numbers) or self.numbers[i] != number:
+            raise KeyError(number)
+        return self.read(i)
+
+    def at_time(self, t: float) -> int:
+        """ Position of the last frame captured at or before epoch time t (the first frame if t is earlier). """
+        return max(bisect_right(self.times, t) - 1, 0)
+
+    def frames(self, start: int = 0, stop: int = None):
+        """ JPEG data of the stored frames start..stop-1, in capture order. """
+        for i in range(start, len(self.index) if stop is None else min(stop, len(self.index))):
+            yield self.read(i)
+
+def recover(path: str) -> int:
+    """ Complete the container of an interrupted run: drop a torn last record and append the index.
+    Returns the number of frames, or -1 if the file is not a container. """
+    try:
+        with FrameReader(path) as reader:
+            index, complete, end = reader.index, reader.complete, reader.end
+    except ValueError:
+        return -1
+    if not complete:
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+            f.seek(end)
+            _write_index(f, index, end)
+    return len(index)
+
+def find_containers(folder: str) -> dict:
+    """ Run timestamp -> container path of all frame containers in folder. """
+    runs = {}
+    for name in os.listdir(folder):
+        m = CONTAINER_PATTERN.match(name)
+        if m:
+            runs[m.group(1)] = os.path.join(folder, name)
+    return runs
+
+def _write_index(f, index: list, index_offset: int) -> None:
+    f.write(b''.join(ENTRY.pack(*entry) for entry in index))
+    f.write(TRAILER.pack(index_offset, len(index), INDEX_MAGIC))
+    f.flush()
+    os.fsync(f.fileno())
+
+def _load_index(fd: int, size: int, scan_from: int = len(MAGIC)) -> tuple:
+    # (index, complete, end of the frame records); without a trailer only the records from scan_from on are listed
+    if os.pread(fd, len(MAGIC), 0) != MAGIC:
+        raise ValueError('not a frame container')
+    if size >= len(MAGIC) + TRAILER.size:
+        index_offset, count, magic = TRAILER.unpack(os.pread(fd, TRAILER.size, size - TRAILER.size))
+        if magic == INDEX_MAGIC and index_offset + count * ENTRY.size + TRAILER.size == size:
+            data = os.pread(fd, count * ENTRY.size, index_offset)
+            return list(ENTRY.iter_unpack(data)), True, index_offset
+    # no index (run interrupted or still running): walk the record headers
+    index = []
+    pos = scan_from
+    while pos + RECORD.size <= size:
+        tag, number, capture_time, length = RECORD.unpack(os.pread(fd, RECORD.size, pos))
+        if tag != RECORD_TAG or pos + RECORD.size + length > size:
+            break
+        index.append((number, capture_time, pos + RECORD.size, length))
+        pos += RECORD.size + length
+    return index, False, pos
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+from time import time, monotonic
+from threading import Thread, Lock, Event
+from fnc.metrics import gauge
+
+DEVICE_UP = gauge('nightowl_device_up', 'Hardware device available (1), degraded (0) or not used yet (-1)', ('device',))
+
+class DeviceUnavailable(RuntimeError):
+    """ A device failed to initialize and is retried in the background. """
+    def __init__(self, name: str, error: str) -> None:
+        super().__init__('{} unavailable: {}'.format(name, error))
+        self.device = name
+        self.error = error
+
+class _Device:
+    def __init__(self, name: str, factory, retry: float, max_retry: float) -> None:
+        self.name = name
+        self.factory = factory
+        self.retry = retry
+        self.max_retry = max_retry
+        self.instance = None
+        self.error = None
+        self.failures = 0
+        self.next_retry = None # monotonic time of the next background attempt
+        self.init_seconds = None
+        self.since = None # epoch time of the last state change
+        self.lock = Lock()
+
+    @property
+    def state(self) -> str:
+        if self.instance is not None:
+            return 'ok'
+        return 'degraded' if self.error is not None else 'idle'
+
+class HardwareRegistry:
+    """ Hardware drivers created on first use instead of at import time.
+
+    register() takes a factory (e.g. the driver class); the device is built by the first get(), so the
+    dashboard serves pages before any sensor has been reset or any GPIO pin set up. Heavy or
+    hardware-only modules are imported inside the factories. A failing device is marked degraded
+    instead of taking the app down: get() raises DeviceUnavailable at once and a background thread
+    retries the factory with exponential backoff until it succeeds.
+    """
+    def __init__(self) -> None:
+        self._devices = {}
+        self._wake = Event()
+        self._thread = None
+
+    def register(self, name: str, factory, retry: float = 10.0, max_retry: float = 300.0) -> None:
+        self._devices[name] = _Device(name, factory, retry, max_retry)
+        DEVICE_UP.labels(name).set_function(lambda: {'ok': 1, 'degraded': 0, 'idle': -1}[self._devices[name].state])
+
+    def get(self, name: str):
+        """ The device instance, created now if this is its first use; raises DeviceUnavailable while degraded. """
+        dev = self._devices[name]
+        if dev.instance is None:
+            with dev.lock:
+                if dev.instance is None:
+                    if dev.error is not None:
+                        raise DeviceUnavailable(name, dev.error)
+                    self._create(dev)
+                    if dev.instance is None:
+                        raise DeviceUnavailable(name, dev.error)
+        return dev.instance
+
+    def peek(self, name: str):
+        """ The device instance if it exists, without creating it (None otherwise). """
+        return self._devices[name].instance
+
+    def lazy(self, name: str) -> 'LazyDevice':
+        """ Stand-in that resolves the device on attribute access, for code that keeps a driver reference. """
+        return LazyDevice(self, name)
+
+    def _create(self, dev: _Device) -> None:
+        # caller holds dev.lock
+        t0 = monotonic()
+        try:
+            instance = dev.factory()
+        except Exception as e: # ImportError, OSError (I2C), RuntimeError (GPIO, calibration), ...
+            dev.failures += 1
+            dev.error = '{}: {}'.format(type(e).__name__, e)
+            dev.next_retry = monotonic() + min(dev.retry * 2 ** (dev.failures - 1), dev.max_retry)
+            dev.since = time()
+            print('hardware: {} degraded ({}), retry in {:.0f} s'.format(dev.name, dev.error, dev.next_retry - monotonic()))
+            self._start_retry()
+            return
+        dev.instance = instance
+        dev.init_seconds = monotonic() - t0
+        if dev.error is not None:
+            print('hardware: {} recovered after {} failures'.format(dev.name, dev.failures))
+        dev.error = None
+        dev.next_retry = None
+        dev.since = time()
+
+    def _start_retry(self) -> None:
+        if self._thread is None:
+            self._thread = Thread(target = self._retry_loop, daemon = True)
+            self._thread.start()
+        self._wake.set()
+
+    def _retry_loop(self) -> None:
+        while True:
+            self._wake.clear()
+            pending = [d for d in self._devices.values() if d.instance is None and d.next_retry is not None]
+            now = monotonic()
+            for dev in pending:
+                if dev.next_retry <= now:
+                    with dev.lock:
+                        if dev.instance is None:
+                            self._create(dev)
+            pending = [d.next_retry for d in self._devices.values() if d.instance is None and d.next_retry is not None]
+            self._wake.wait(max(min(pending) - monotonic(), 0.1) if pending else None)
+
+    def retry_now(self, name: str) -> None:
+        """ Let the background thread retry a degraded device at once (e.g. after fixing the wiring). """
+        dev = self._devices[name]
+        if dev.instance is None and dev.error is not None:
+            dev.next_retry = monotonic()
+            self._start_retry()
+
+    @property
+    def status(self) -> dict:
+        """ Per device: state ('ok', 'degraded' or 'idle' = not used yet), error, failures, seconds to the next retry and init time. """
+        now = monotonic()
+        return {name: {
+                    'state': dev.state,
+                    'error': dev.error,
+                    'failures': dev.failures,
+                    'retry_in': round(max(dev.next_retry - now, 0), 1) if dev.next_retry is not None else None,
+                    'init_seconds': round(dev.init_seconds, 3) if dev.init_seconds is not None else None,
+                    'since': dev.since
+                } for name, dev in self._devices.items()}
+
+class LazyDevice:
+    """ Forwards attribute access to the registry device (created on first use, DeviceUnavailable while degraded). """
+    def __init__(self, registry: HardwareRegistry, name: str) -> None:
+        self._registry = registry
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(self._registry.get(self._name), attr)
+
+    @property
+    def available(self) -> bool:
+        """ True if the device is (or can now be) created; never raises. """
+        try:
+            self._registry.get(self._name)
+            return True
+        except DeviceUnavailable:
+            return False
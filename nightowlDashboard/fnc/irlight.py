@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+from time import sleep, monotonic
+
+class ExposureLight:
+    """ Switches the IR LEDs (drv.LEDdriver.IReyes) only around camera exposures.
+
+    arm() switches the LEDs on and waits the warm-up lead time, so the exposure sees a settled
+    illumination; release() switches them off again if the next exposure is far enough away
+    (strobing), otherwise they stay on. The lead time can be measured with calibrate().
+    Energy is accounted from the LED-on time of the driver.
+    """
+    def __init__(self, eyes, lead_time: float = 1.0, min_off: float = 0.2) -> None:
+        self._eyes = eyes
+        self.lead_time = lead_time # LED on -> exposure
+        self._min_off = min_off # shorter dark periods are not worth switching
+        self._armed_at = None
+        self._start = monotonic()
+        self._on_start = eyes.on_seconds
+        self.calibrated = False
+
+    def arm(self) -> None:
+        """ LEDs on; returns once they have been on for the lead time. """
+        if self._armed_at is None:
+            self._eyes.turn_on()
+            self._armed_at = monotonic()
+        remaining = self._armed_at + self.lead_time - monotonic()
+        if remaining > 0:
+            sleep(remaining)
+
+    def release(self, next_exposure_in: float = None) -> None:
+        """ LEDs off unless the next exposure (seconds from now) is too close for a dark period. """
+        if next_exposure_in is not None and next_exposure_in < self.lead_time + self._min_off:
+            return
+        self.off()
+
+    def off(self) -> None:
+        if self._armed_at is not None:
+            self._eyes.turn_off()
+            self._armed_at = None
+
+    def calibrate(self, measure, max_time: float = 3.0, tolerance: float = 0.02, min_lead: float = 0.05) -> float:
+        """ Measure the lead time: switch the LEDs on and sample the mean image brightness (measure())
+        until it is stable, i.e. the camera has adapted to the illumination. """
+        self.off()
+        t0 = monotonic()
+        self._eyes.turn_on()
+        self._armed_at = t0
+        samples = [] # (seconds since LED on, brightness)
+        while monotonic() - t0 < max_time:
+            samples.append((monotonic() - t0, measure()))
+            if len(samples) >= 3 and all(abs(v - samples[-1][1]) <= tolerance * max(samples[-1][1], 1) for _, v in samples[-3:]):
+                self.lead_time = max(samples[-3][0], min_lead) # first sample of the stable run
+                self.calibrated = True
+                break
+        self.off()
+        return self.lead_time
+
+    def energy(self, battery_mah: float = None, base_current_ma: float = 0.0) -> dict:
+        """ LED-on time and charge since this controller was created; with battery_mah also the projected
+        runtime at the current LED duty cycle plus a constant base current (Pi and camera). """
+        elapsed = monotonic() - self._start
+        on = self._eyes.on_seconds - self._on_start
+        duty = on / elapsed if elapsed > 0 else 0.0
+        current = duty * self._eyes.current_ma + base_current_ma
+        return {
+            'on_seconds': round(on, 1),
+            'duty': round(duty, 4),
+            'mah': round(on * self._eyes.current_ma / 3600, 2),
+            'avg_current_ma': round(current, 1),
+            'runtime_hours': round(battery_mah / current, 1) if battery_mah and current > 0 else None
+        }
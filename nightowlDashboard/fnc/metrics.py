@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+""" Minimal Prometheus-style metrics (text exposition format 0.0.4), no dependencies.
+
+Metrics are declared once at module level where they are used:
+
+    CAPTURE_SECONDS = histogram('nightowl_timelapse_capture_seconds', 'Still capture duration', LATENCY_BUCKETS)
+    CAPTURE_SECONDS.observe(0.42)
+
+Recording stays off until /metrics is scraped for the first time, so an unscraped unit only pays for
+one attribute check per observation. Gauges can be backed by a function evaluated at scrape time.
+"""
+
+import bisect
+from time import monotonic
+from threading import Lock
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (8e3, 16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6)
+FPS_BUCKETS = (0.5, 1, 2, 5, 10, 15, 20, 25, 30)
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics = {}
+        self.enabled = False # switched on by the first scrape
+
+    def register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        self.enabled = True
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def _labels(names: tuple, values: tuple, extra: str = None) -> str:
+    pairs = ['{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _num(value: float) -> str:
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def samples(self) -> list:
+        lines = []
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.samples(self.name, _labels(self.labelnames, values), self.labelnames, values))
+        return lines
+
+class _CounterChild:
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        if REGISTRY.enabled:
+            self.value += amount
+
+    def samples(self, name, labels, *_) -> list:
+        return ['{}_total{} {}'.format(name, labels, _num(self.value))]
+
+class Counter(_Metric):
+    kind = 'counter'
+    _child = _CounterChild
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+class _GaugeChild:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set_function(self, function) -> None:
+        self.function = function
+
+    def samples(self, name, labels, *_) -> list:
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception: # a failing source must not break the scrape
+                return []
+        return ['{}{} {}'.format(name, labels, _num(value or 0))]
+
+class Gauge(_Metric):
+    kind = 'gauge'
+    _child = _GaugeChild
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set_function(self, function) -> None:
+        self.labels().set_function(function)
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple) -> None:
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self._sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value: float) -> None:
+        if not REGISTRY.enabled:
+            return
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def samples(self, name, labels, labelnames, values) -> list:
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(name, _labels(labelnames, values, 'le="{}"'.format(_num(bound))), cumulative))
+        lines.append('{}_sum{} {}'.format(name, labels, _num(total)))
+        lines.append('{}_count{} {}'.format(name, labels, cumulative))
+        return lines
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS, labelnames: tuple = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._bucket_bounds = tuple(sorted(buckets))
+
+    def _child(self):
+        return _HistogramChild(self._bucket_bounds)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+class RateMeter:
+    """ Observes the rate of tick() calls (e.g. frames sent to one stream viewer) into a histogram once per window. """
+    def __init__(self, hist: Histogram, window: float = 5.0) -> None:
+        self._hist = hist
+        self._window = window
+        self._count = 0
+        self._since = monotonic()
+
+    def tick(self) -> None:
+        self._count += 1
+        now = monotonic()
+        if now - self._since >= self._window:
+            self._hist.observe(self._count / (now - self._since))
+            self._count = 0
+            self._since = now
+
+def counter(name: str, help: str, labelnames: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+def gauge(name: str, help: str, labelnames: tuple = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+def histogram(name: str, help: str, buckets: tuple = LATENCY_BUCKETS, labelnames: tuple = ()) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, buckets, labelnames))
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import io
+import numpy as np
+from PIL import Image
+
+class ChangeDetector:
+    """ Cheap change score between consecutive timelapse frames.
+
+    Frames are decoded straight to a small luminance image (the JPEG decoder scales by 1/8 for free),
+    the global brightness is removed (IR/auto exposure flicker) and the score is the percentage of
+    pixels that changed by more than pixel_delta grey levels.
+    """
+    def __init__(self, size: tuple = (80, 60), pixel_delta: int = 12) -> None:
+        self._size = size
+        self._pixel_delta = pixel_delta
+        self._ref = None
+
+    def luminance(self, frame: bytes) -> np.ndarray:
+        img = Image.open(io.BytesIO(frame))
+        img.draft('L', self._size) # decode at reduced size
+        lum = np.asarray(img.convert('L').resize(self._size), dtype = np.float32)
+        return lum - lum.mean()
+
+    def score(self, frame: bytes) -> float:
+        """ Change score (0..100) against the previous frame; the first frame scores 100. """
+        lum = self.luminance(frame)
+        if self._ref is None:
+            score = 100.0
+        else:
+            score = float(np.count_nonzero(np.abs(lum - self._ref) > self._pixel_delta)) * 100 / lum.size
+        self._ref = lum
+        return score
+
+    def reset(self) -> None:
+        self._ref = None
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+""" Parallel segmented re-encode of a captured timelapse frame sequence.
+
+The timelapse_<ts>_frame_%06d.jpg sequence (or the timelapse_<ts>.frames container, see fnc.framestore) is split into segments of whole GOPs, the segments are
+encoded by a pool of ffmpeg processes and joined without re-encoding by the concat demuxer.
+Meant for archive-quality encodes, e.g. after copying the tmp frames of a night to a bigger machine:
+
+    python3 -m fnc.reencode static/tmp -o zeitraffer.mp4 --quality archive --jobs 8
+"""
+
+import os
+import re
+import glob
+import shutil
+import argparse
+import tempfile
+import subprocess
+from time import monotonic
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from fnc.clips import KEYFRAME_INTERVAL
+from fnc.framestore import FrameReader, find_containers, SUFFIX
+
+# name: (x264 preset, crf)
+QUALITY_PRESETS = {
+    'device': ('ultrafast', 23),  # what the camera itself uses for batch encodes
+    'fast': ('veryfast', 23),
+    'archive': ('slow', 20),
+    'small': ('slower', 26)
+}
+
+FRAME_PATTERN = re.compile(r'timelapse_([0-9-]+)_frame_(\d{6})\.jpg$')
+
+def find_runs(folder: str) -> dict:
+    """ Run timestamp -> sorted frame numbers of all frame sequences and frame containers in folder. """
+    runs = {}
+    for name in os.listdir(folder):
+        m = FRAME_PATTERN.match(name)
+        if m:
+            runs.setdefault(m.group(1), []).append(int(m.group(2)))
+    for run, path in find_containers(folder).items():
+        try:
+            with FrameReader(path) as reader:
+                runs.setdefault(run, []).extend(reader.numbers)
+        except ValueError:
+            continue
+    return {run: sorted(numbers) for run, numbers in runs.items()}
+
+def split_segments(numbers: list, segment_frames: int) -> list:
+    """ (start number, frame count) segments of at most segment_frames contiguous frames. """
+    segments = []
+    start, count = None, 0
+    for n in numbers:
+        if start is not None and n == start + count and count < segment_frames:
+            count += 1
+        else:
+            if start is not None:
+                segments.append((start, count))
+            start, count = n, 1
+    if start is not None:
+        segments.append((start, count))
+    return segments
+
+def _encode_segment(source: str, start: int, count: int, outfile: str, framerate: int, preset: str, crf: int, threads: int) -> None:
+    container = source.endswith(SUFFIX)
+    if container:
+        inputs = ['-f', 'image2pipe', '-framerate', str(framerate), '-c:v', 'mjpeg', '-i', '-']
+    else:
+        inputs = ['-framerate', str(framerate), '-start_number', str(start), '-i', source]
+    cmd = ['ffmpeg', '-loglevel', 'error', '-y'] + inputs + [
+           '-frames:v', str(count), '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p',
+           '-g', str(KEYFRAME_INTERVAL), '-keyint_min', str(KEYFRAME_INTERVAL), '-sc_threshold', '0',
+           '-threads', str(threads), outfile]
+    if not container:
+        subprocess.run(cmd, check = True)
+        return
+    # the segment's frames are read from the container at random and piped into ffmpeg
+    with FrameReader(source) as reader:
+        first = bisect_left(reader.numbers, start)
+        proc = subprocess.Popen(cmd, stdin = subprocess.PIPE)
+        try:
+            for frame in reader.frames(first, first + count):
+                proc.stdin.write(frame)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        if proc.wait():
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+def reencode(folder: str, run: str, outfile: str, quality: str = 'archive', jobs: int = None, segment_frames: int = 20 * KEYFRAME_INTERVAL,
+             framerate: int = 24) -> dict:
+    """ Encode the frames of one run into outfile; returns a report with frame count, duration and throughput. """
+    preset, crf = QUALITY_PRESETS[quality]
+    numbers = find_runs(folder).get(run)
+    if not numbers:
+        raise FileNotFoundError('no frames of run {} in {}'.format(run, folder))
+    jobs = jobs or os.cpu_count() or 1
+    segment_frames = max(segment_frames // KEYFRAME_INTERVAL, 1) * KEYFRAME_INTERVAL # segments start on a keyframe of the full movie
+    segments = split_segments(numbers, segment_frames)
+    # a run stored in a container is read from it, otherwise from the single frame files
+    source = find_containers(folder).get(run) or os.path.join(folder, 'timelapse_' + run + '_frame_%06d.jpg')
+    # spread the cores over the running encoders; more processes than segments gain nothing
+    threads = max((os.cpu_count() or 1) // min(jobs, len(segments)), 1)
+    t_start = monotonic()
+    workdir = tempfile.mkdtemp(prefix = 'reencode_', dir = os.path.dirname(os.path.abspath(outfile)))
+    try:
+        parts = [os.path.join(workdir, 'segment_{:05d}.mp4'.format(i)) for i in range(len(segments))]
+        # each worker only waits for its ffmpeg process, so threads are enough to keep all processes busy
+        with ThreadPoolExecutor(max_workers = jobs) as pool:
+            futures = [pool.submit(_encode_segment, source, start, count, part, framerate, preset, crf, threads)
+                       for (start, count), part in zip(segments, parts)]
+            for f in futures:
+                f.result() # re-raise the first failed segment
+        t_encoded = monotonic()
+        listfile = os.path.join(workdir, 'segments.txt')
+        with open(listfile, 'w') as f:
+            for part in parts:
+                f.write("file '{}'\n".format(part))
+        subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', listfile,
+                        '-c', 'copy', '-movflags', '+faststart', outfile], check = True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors = True)
+    elapsed = monotonic() - t_start
+    return {
+        'run': run,
+        'frames': len(numbers),
+        'segments': len(segments),
+        'jobs': jobs,
+        'quality': quality,
+        'encode_time': round(t_encoded - t_start, 2),
+        'total_time': round(elapsed, 2),
+        'fps': round(len(numbers) / elapsed, 1) if elapsed > 0 else None,
+        'size': os.path.getsize(outfile)
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = 'Parallel re-encode of a timelapse frame sequence.')
+    parser.add_argument('folder', help = 'folder with timelapse_<ts>_frame_%%06d.jpg files or timelapse_<ts>.frames containers (e.g. static/tmp)')
+    parser.add_argument('-o', '--output', help = 'output movie (default: zeitraffer_<ts>.mp4)')
+    parser.add_argument('--run', help = 'run timestamp (default: latest run in folder)')
+    parser.add_argument('--quality', choices = sorted(QUALITY_PRESETS), default = 'archive')
+    parser.add_argument('--jobs', type = int, default = None, help = 'parallel ffmpeg processes (default: CPU count)')
+    parser.add_argument('--segment', type = int, default = 20 * KEYFRAME_INTERVAL, help = 'frames per segment')
+    parser.add_argument('--framerate', type = int, default = 24)
+    args = parser.parse_args()
+
+    runs = find_runs(args.folder)
+    if not runs:
+        parser.error('no timelapse frames in ' + args.folder)
+    run = args.run or max(runs)
+    report = reencode(args.folder, run, args.output or 'zeitraffer_' + run + '.mp4', args.quality, args.jobs, args.segment, args.framerate)
+    print('{run}: {frames} frames in {segments} segments, {jobs} jobs, quality {quality}'.format(**report))
+    print('encode {encode_time} s, total {total_time} s, {fps} frames/s, {size} bytes'.format(**report))
+
+if __name__ == '__main__':
+    main()
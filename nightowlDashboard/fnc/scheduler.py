@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import statistics
+from time import monotonic
+from datetime import datetime
+from threading import Event
+from fnc.metrics import histogram, LATENCY_BUCKETS
+
+CAPTURE_SECONDS = histogram('nightowl_timelapse_capture_seconds', 'Timelapse frame capture duration (capture start to stored frame)', LATENCY_BUCKETS)
+LATENESS_SECONDS = histogram('nightowl_timelapse_lateness_seconds', 'Timelapse capture start after its deadline', LATENCY_BUCKETS)
+
+class CaptureScheduler:
+    """ Absolute capture deadlines on the monotonic clock.
+
+    The wall-clock start and end of a run are converted to monotonic time once, so NTP steps during
+    the night do not move the capture grid. Deadlines are start + n * period; a capture that starts
+    late does not shift the following ones. Frames that are late by a full period or more are handled
+    by the policy: 'skip' drops the missed deadlines (counted as dropped), 'late' captures every missed
+    deadline as soon as possible. Waiting is done on an Event, so stop() wakes the capture loop at once.
+    """
+    POLICIES = ('skip', 'late')
+
+    def __init__(self, period: float, policy: str = 'skip') -> None:
+        self.period = period
+        self.policy = policy if policy in self.POLICIES else 'skip'
+        self._stop = Event()
+        self._start = None
+        self._end = None
+        self._next = None
+        self._wake = None
+        self._deadline = None
+        self._records = [] # (deadline since start, lateness, capture duration)
+        self.dropped = 0
+
+    def wait_start(self, t_start: datetime, t_end: datetime) -> bool:
+        """ Sleep until the wall-clock start of the run; False if stopped before. """
+        now = monotonic()
+        wall = datetime.now()
+        self._start = now + max((t_start - wall).total_seconds(), 0)
+        self._end = now + (t_end - wall).total_seconds()
+        self._next = self._start
+        self._stop.wait(max(self._start - now, 0))
+        return not self._stop.is_set()
+
+    def wait(self, lead: float = 0.0) -> bool:
+        """ Sleep until lead seconds before the next deadline (e.g. IR warm-up); False once stopped or the run is over. """
+        deadline = self._next
+        now = monotonic()
+        if deadline - lead > now:
+            self._stop.wait(deadline - lead - now)
+        return self._arrive(deadline, lead)
+
+    def arrived(self) -> bool:
+        """ Account for a frame paced by someone else (e.g. the frame broker); False once stopped or the run is over. """
+        return self._arrive(self._next)
+
+    def _arrive(self, deadline: float, lead: float = 0.0) -> bool:
+        self._wake = now = monotonic() + lead # capture starts after the lead time
+        if self._stop.is_set() or now >= self._end:
+            self._wake = None
+            return False
+        if now - deadline >= self.period and self.policy == 'skip':
+            missed = int((now - deadline) // self.period)
+            self.dropped += missed
+            deadline += missed * self.period
+        self._deadline = deadline
+        self._next = deadline + self.period
+        return True
+
+    def done(self) -> None:
+        """ Mark the end of the capture started by the last wait(). """
+        if self._wake is not None:
+            now = monotonic()
+            self._records.append((self._deadline - self._start, self._wake - self._deadline, now - self._wake))
+            LATENESS_SECONDS.observe(max(self._wake - self._deadline, 0))
+            CAPTURE_SECONDS.observe(now - self._wake)
+            self._wake = None
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    @property
+    def next_in(self) -> float:
+        # seconds until the next deadline
+        return self._next - monotonic() if self._next is not None else None
+
+    @property
+    def remaining(self) -> float:
+        # seconds until the end of the run
+        return self._end - monotonic() if self._end is not None else None
+
+    @property
+    def stats(self) -> dict:
+        """ Lateness and capture duration of the frames so far (seconds). """
+        if not self._records:
+            return {'frames': 0, 'dropped': self.dropped}
+        lateness = sorted(r[1] for r in self._records)
+        durations = [r[2] for r in self._records]
+        intervals = [b[0] + b[1] - a[0] - a[1] for a, b in zip(self._records, self._records[1:])]
+        return {
+            'frames': len(self._records),
+            'dropped': self.dropped,
+            'late_mean': statistics.mean(lateness),
+            'late_p95': lateness[min(int(len(lateness) * 0.95), len(lateness) - 1)],
+            'late_max': lateness[-1],
+            'capture_mean': statistics.mean(durations),
+            'capture_max': max(durations),
+            'interval_mean': statistics.mean(intervals) if intervals else None,
+            'interval_jitter': statistics.pstdev(intervals) if intervals else None
+        }
+
+    def write_report(self, path: str) -> None:
+        """ Per-frame timing as CSV: deadline (s since start), lateness and capture duration (s). """
+        with open(path, 'w') as f:
+            f.write('frame,deadline,lateness,duration\n')
+            for i, (deadline, late, duration) in enumerate(self._records):
+                f.write('{},{:.3f},{:.4f},{:.4f}\n'.format(i, deadline, late, duration))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import os
+import struct
+from time import time
+from threading import Lock
+from collections import namedtuple
+
+# fixed-width little-endian records; temperatures/humidities are stored in 1/100 units
+RAW_FORMAT = '<Ihh'         # timestamp, temperature, humidity
+ROLLUP_FORMAT = '<IH6h'     # bucket start, sample count, temp min/max/mean, hum min/max/mean
+RAW_SIZE = struct.calcsize(RAW_FORMAT)
+ROLLUP_SIZE = struct.calcsize(ROLLUP_FORMAT)
+
+ROLLUP_LEVELS = (('minute', 60), ('hour', 3600), ('day', 86400))
+
+Sample = namedtuple('Sample', ['timestamp', 'temperature', 'humidity'])
+Rollup = namedtuple('Rollup', ['timestamp', 'count', 'temp_min', 'temp_max', 'temp_mean', 'hum_min', 'hum_max', 'hum_mean'])
+
+class _Bucket:
+    """ Running aggregate of one rollup bucket. """
+    def __init__(self, start: int) -> None:
+        self.start = start
+        self.count = 0
+        self.t = [None, None, 0]
+        self.h = [None, None, 0]
+
+    def add(self, temp: int, hum: int) -> None:
+        for acc, v in ((self.t, temp), (self.h, hum)):
+            acc[0] = v if acc[0] is None else min(acc[0], v)
+            acc[1] = v if acc[1] is None else max(acc[1], v)
+            acc[2] += v
+        self.count += 1
+
+    def pack(self) -> bytes:
+        return struct.pack(ROLLUP_FORMAT, self.start, min(self.count, 0xFFFF),
+                           self.t[0], self.t[1], round(self.t[2] / self.count),
+                           self.h[0], self.h[1], round(self.h[2] / self.count))
+
+class SensorLog:
+    """ Append-only temperature/humidity store with minute, hour and day rollups.
+
+    Every resolution lives in its own file of fixed-width records sorted by time, so a range query
+    is a binary search plus one sequential read, independent of the length of the history.
+    Raw samples are buffered and written in batches to spare the SD card.
+    """
+    def __init__(self, folder: str, flush_every: int = 6) -> None:
+        self._folder = folder
+        self._flush_every = flush_every
+        self._lock = Lock()
+        self._pending = [] # packed raw records not yet on disk
+        self._buckets = {}
+        os.makedirs(folder, exist_ok = True)
+        self._drop_torn_records()
+        self._last_ts = self._last_timestamp('raw')
+        self._recover_rollups()
+
+    def path(self, level: str) -> str:
+        return os.path.join(self._folder, 'aht20_' + level + '.bin')
+
+    def append(self, reading) -> None:
+        """ Store one reading (timestamp, temperature, humidity); usable as SensorSampler listener. """
+        if reading is None:
+            return
+        ts = int(reading[0])
+        with self._lock:
+            if ts <= self._last_ts:
+                return # keep the file sorted; drops samples taken before a backwards clock jump
+            self._last_ts = ts
+            temp, hum = round(reading[1] * 100), round(reading[2] * 100)
+            self._pending.append(struct.pack(RAW_FORMAT, ts, temp, hum))
+            self._aggregate(ts, temp, hum)
+            if len(self._pending) >= self._flush_every:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """ Write pending raw samples (on shutdown); open rollup buckets are rebuilt from them at the next start. """
+        self.flush()
+
+    def query(self, start: float = 0, end: float = None, resolution: str = 'raw') -> list:
+        """ Records with start <= timestamp < end as Sample (raw) or Rollup tuples, values in degC/%. """
+        return list(self.iter_query(start, end, resolution))
+
+    def iter_query(self, start: float = 0, end: float = None, resolution: str = 'raw', chunk: int = 4096):
+        end = time() + 1 if end is None else end
+        if resolution == 'auto':
+            resolution = self.pick_resolution(start, end)
+        fmt, size = (RAW_FORMAT, RAW_SIZE) if resolution == 'raw' else (ROLLUP_FORMAT, ROLLUP_SIZE)
+        with self._lock:
+            # the file length and the bucket still being aggregated are taken together, so a bucket completed
+            # by the sampler while the records are read is neither missed nor returned twice
+            self._flush()
+            bucket = self._buckets.get(resolution)
+            bucket = bucket.pack() if bucket is not None and start <= bucket.start < end else None
+            try:
+                f = open(self.path(resolution), 'rb')
+            except FileNotFoundError:
+                f = None
+            else:
+                n = os.fstat(f.fileno()).st_size // size
+        if f is not None:
+            with f:
+                i = self._bisect(f, fmt, size, n, start)
+                j = self._bisect(f, fmt, size, n, end)
+                f.seek(i * size)
+                while i < j:
+                    k = min(j - i, chunk)
+                    for rec in struct.iter_unpack(fmt, f.read(k * size)):
+                        yield self._decode(rec, resolution)
+                    i += k
+        if bucket is not None:
+            # bucket still being aggregated
+            yield self._decode(struct.unpack(ROLLUP_FORMAT, bucket), resolution)
+
+    def pick_resolution(self, start: float, end: float, max_points: int = 2000) -> str:
+        """ Finest resolution that returns at most max_points records (assuming 10 s sampling). """
+        span = max(end - start, 0)
+        for level, width in (('raw', 10),) + ROLLUP_LEVELS:
+            if span / width <= max_points:
+                return level
+        return 'day'
+
+    def _flush(self) -> None:
+        if self._pending:
+            with open(self.path('raw'), 'ab') as f:
+                f.write(b''.join(self._pending))
+            self._pending = []
+
+    def _aggregate(self, ts: int, temp: int, hum: int) -> None:
+        for level, width in ROLLUP_LEVELS:
+            start = ts - ts % width
+            bucket = self._buckets.get(level)
+            if bucket is not None and bucket.start != start:
+                # bucket complete
+                with open(self.path(level), 'ab') as f:
+                    f.write(bucket.pack())
+                bucket = None
+            if bucket is None:
+                bucket = self._buckets[level] = _Bucket(start)
+            bucket.add(temp, hum)
+
+    def _drop_torn_records(self) -> None:
+        # a write cut short (e.g. power loss during a flush) leaves a partial record at the end; appending
+        # after it would shift every later record off the record boundary
+        for level, size in [('raw', RAW_SIZE)] + [(level, ROLLUP_SIZE) for level, _ in ROLLUP_LEVELS]:
+            try:
+                with open(self.path(level), 'r+b') as f:
+                    excess = os.fstat(f.fileno()).st_size % size
+                    if excess:
+                        f.truncate(os.fstat(f.fileno()).st_size - excess)
+                        print('sensorlog: dropped {} bytes of a torn record in {}'.format(excess, self.path(level)))
+            except FileNotFoundError:
+                continue
+
+    def _recover_rollups(self) -> None:
+        # rebuild open (and any unwritten) buckets from the raw samples after the last stored rollup
+        for level, width in ROLLUP_LEVELS:
+            last = self._last_timestamp(level)
+            since = last + width if last else 0
+            try:
+                f = open(self.path('raw'), 'rb')
+            except FileNotFoundError:
+                return
+            with f:
+                n = os.fstat(f.fileno()).st_size // RAW_SIZE
+                f.seek(self._bisect(f, RAW_FORMAT, RAW_SIZE, n, since) * RAW_SIZE)
+                bucket = None
+                out = []
+                for ts, temp, hum in struct.iter_unpack(RAW_FORMAT, f.read((n * RAW_SIZE) - f.tell())):
+                    start = ts - ts % width
+                    if bucket is not None and bucket.start != start:
+                        out.append(bucket.pack())
+                        bucket = None
+                    if bucket is None:
+                        bucket = _Bucket(start)
+                    bucket.add(temp, hum)
+            if out:
+                with open(self.path(level), 'ab') as f:
+                    f.write(b''.join(out))
+            if bucket is not None:
+                self._buckets[level] = bucket
+
+    def _last_timestamp(self, level: str) -> int:
+        size = RAW_SIZE if level == 'raw' else ROLLUP_SIZE
+        try:
+            with open(self.path(level), 'rb') as f:
+                n = os.fstat(f.fileno()).st_size // size
+                if n == 0:
+                    return 0
+                f.seek((n - 1) * size)
+                return struct.unpack_from('<I', f.read(size))[0]
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def _bisect(f, fmt: str, size: int, n: int, ts: float) -> int:
+        # index of the first record with timestamp >= ts
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid * size)
+            if struct.unpack_from('<I', f.read(4))[0] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    @staticmethod
+    def _decode(rec: tuple, resolution: str):
+        if resolution == 'raw':
+            return Sample(rec[0], rec[1] / 100, rec[2] / 100)
+        return Rollup(rec[0], rec[1], *(v / 100 for v in rec[2:]))
+
+    @staticmethod
+    def fields(resolution: str) -> tuple:
+        return Sample._fields if resolution == 'raw' else Rollup._fields
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+from time import time
+from threading import Thread, Event, Condition
+from collections import namedtuple
+
+SensorReading = namedtuple('SensorReading', ['timestamp', 'temperature', 'humidity'])
+
+class SensorSampler:
+    """ Owns the AHT20 and publishes its latest reading.
+
+    A background thread measures every interval seconds; pages read the cached value instead of
+    touching the I2C bus. Forced refreshes are coalesced: concurrent callers share one measurement.
+    """
+    def __init__(self, sensor, interval: float = 10.0, max_age: float = 30.0) -> None:
+        self._sensor = sensor
+        self.interval = interval
+        self.max_age = max_age
+        self._reading = None
+        self._measuring = False
+        self._generation = 0
+        self._cond = Condition()
+        self._listeners = []
+        self._stop = Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target = self._run, daemon = True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def add_listener(self, callback) -> None:
+        """ callback(reading) is invoked (in the measuring thread) after every new reading. """
+        self._listeners.append(callback)
+
+    def latest(self, max_age: float = None) -> SensorReading:
+        """ Cached reading; refreshed (coalesced) only if older than max_age seconds. """
+        max_age = self.max_age if max_age is None else max_age
+        reading = self._reading
+        if reading is None or (time() - reading.timestamp) > max_age:
+            return self.refresh()
+        return reading
+
+    def refresh(self) -> SensorReading:
+        """ Measure now, or wait for the measurement that is already running. """
+        with self._cond:
+            if self._measuring:
+                generation = self._generation
+                self._cond.wait_for(lambda: self._generation != generation, timeout = 15)
+                return self._reading
+            self._measuring = True
+        reading = None
+        try:
+            self._sensor.measure()
+            reading = SensorReading(time(), self._sensor.temperature, self._sensor.humidity)
+        finally:
+            with self._cond:
+                self._measuring = False
+                self._generation += 1
+                if reading is not None:
+                    self._reading = reading
+                self._cond.notify_all()
+        for callback in self._listeners:
+            callback(reading)
+        return reading
+
+    def _run(self) -> None:
+        error = None
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+                error = None
+            except (OSError, RuntimeError) as e: # includes fnc.hardware.DeviceUnavailable while the sensor is retried
+                if str(e) != error: # log a lasting failure once
+                    print("sensor sampler: measurement failed:", e)
+                error = str(e)
+            self._stop.wait(self.interval)
+
+    @property
+    def reading(self) -> SensorReading:
+        """ Latest reading without any bus access (None before the first measurement). """
+        return self._reading
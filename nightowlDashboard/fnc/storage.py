@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+from time import time
+from queue import Queue
+from threading import Thread, Event, Lock
+
+JPEG_BYTES_PER_PIXEL = 0.2      # typical picamera JPEG (quality 85) of a night scene
+MOVIE_BYTES_PER_PIXEL = 0.05    # per frame, libx264 ultrafast
+
+# lower resolutions tried (in this order) when a run does not fit on the card
+RESOLUTION_LADDER = ('1920x1080', '1440x1080', '1280x720', '1024x768', '960x720', '854x480', '640x480', '480x320', '320x240')
+
+class StorageManager:
+    """ Disk space bookkeeping for the media folders below root (e.g. static/).
+
+    Folders with a quota are ring buffers: when they exceed their quota, or the card runs short of
+    min_free, their oldest files are evicted first. Stale tmp files (frames and previews of earlier
+    runs) are removed by a background janitor instead of on the start path of a run.
+    """
+    def __init__(self, root: str, quotas: dict = None, min_free: int = 200 * 2**20, stale_age: float = 3600.0,
+                 janitor_interval: float = 600.0) -> None:
+        self._root = root
+        self.quotas = dict(quotas or {}) # folder -> max. bytes (None = unlimited, never evicted)
+        self.min_free = min_free
+        self._stale_age = stale_age
+        self._janitor_interval = janitor_interval
+        self._stale_patterns = {} # folder -> file name prefixes removed by the janitor
+        self._protected = set() # name fragments that are never evicted or cleaned (e.g. current run timestamp)
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._janitor = None
+        self.evicted = 0 # files removed so far (quota, low space or stale)
+
+    def _path(self, folder: str) -> str:
+        return os.path.join(self._root, folder)
+
+    def free(self) -> int:
+        return shutil.disk_usage(self._root).free
+
+    def usage(self, folder: str) -> int:
+        return sum(size for _, size, _ in self._files(folder))
+
+    def _files(self, folder: str) -> list:
+        # (path, size, mtime) of all files below folder, oldest first; hidden files (caches) are skipped
+        files = []
+        for dirpath, _, filenames in os.walk(self._path(folder)):
+            for name in filenames:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((path, st.st_size, st.st_mtime))
+        files.sort(key = lambda f: f[2])
+        return files
+
+    def protect(self, fragment: str) -> None:
+        with self._lock:
+            self._protected.add(fragment)
+
+    def unprotect(self, fragment: str) -> None:
+        with self._lock:
+            self._protected.discard(fragment)
+
+    def _is_protected(self, path: str) -> bool:
+        with self._lock:
+            return any(p in path for p in self._protected)
+
+    def _remove(self, path: str, folder: str) -> bool:
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        self.evicted += 1
+        # drop directories emptied by the eviction (e.g. thumbnails of a removed run)
+        parent = os.path.dirname(path)
+        while os.path.normpath(parent) != os.path.normpath(self._path(folder)):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+        return True
+
+    def evictable(self, folder: str) -> int:
+        # bytes that may be evicted from a quota folder
+        if self.quotas.get(folder) is None:
+            return 0
+        return sum(size for path, size, _ in self._files(folder) if not self._is_protected(path))
+
+    def enforce(self, folder: str, need: int = 0) -> int:
+        """ Evict the oldest files of a quota folder until it is within its quota and need bytes are free.
+        Returns the number of bytes freed. """
+        quota = self.quotas.get(folder)
+        if quota is None:
+            return 0
+        files = self._files(folder)
+        used = sum(f[1] for f in files)
+        short = max(need - self.free(), 0)
+        freed = 0
+        for path, size, _ in files:
+            if used - freed <= quota and freed >= short:
+                break
+            if not self._is_protected(path) and self._remove(path, folder):
+                freed += size
+        return freed
+
+    def ensure_free(self, need: int = 0) -> bool:
+        """ Make sure need + min_free bytes are free, evicting from quota folders if necessary. """
+        need += self.min_free
+        for folder in self.quotas:
+            if self.free() >= need:
+                break
+            self.enforce(folder, need)
+        return self.free() >= need
+
+    def plan_run(self, frames: int, resolution: str, keep_frames: bool) -> tuple:
+        """ Check that a run fits on the card before it starts.
+
+        Returns (resolution, message): the requested resolution if it fits (evicting old media if
+        necessary), a lower one from RESOLUTION_LADDER if only that fits, or None if the run should
+        be refused. keep_frames: the JPEG frames are stored in addition to the movie (batch encoding).
+        """
+        # a quota folder inside another one (e.g. mov/clips in mov) is already counted by the outer folder
+        outer = [f for f in self.quotas if not any(f.startswith(o + '/') and self.quotas[o] is not None for o in self.quotas)]
+        available = self.free() + sum(self.evictable(folder) for folder in outer) - self.min_free
+        ladder = [resolution] + [r for r in RESOLUTION_LADDER if _pixels(r) < _pixels(resolution)]
+        for res in ladder:
+            need = self.estimate(frames, res, keep_frames)
+            if need <= available:
+                self.ensure_free(need)
+                if res == resolution:
+                    return res, None
+                return res, 'Speicherplatz reicht nicht für {}, Aufnahme mit {}'.format(resolution, res)
+        return None, 'Zu wenig Speicherplatz: {:.0f} MB benötigt, {:.0f} MB verfügbar'.format(
+            self.estimate(frames, ladder[-1], keep_frames) / 2**20, max(available, 0) / 2**20)
+
+    @staticmethod
+    def estimate(frames: int, resolution: str, keep_frames: bool) -> int:
+        per_frame = MOVIE_BYTES_PER_PIXEL + (JPEG_BYTES_PER_PIXEL if keep_frames else 0)
+        return int(frames * _pixels(resolution) * per_frame)
+
+    def add_stale(self, folder: str, prefixes: tuple) -> None:
+        """ Let the janitor remove files in folder starting with one of prefixes once they are older than stale_age. """
+        self._stale_patterns[folder] = tuple(prefixes)
+
+    def clean_stale(self) -> int:
+        removed = 0
+        limit = time() - self._stale_age
+        for folder, prefixes in list(self._stale_patterns.items()):
+            try:
+                entries = list(os.scandir(self._path(folder)))
+            except FileNotFoundError:
+                continue
+            for e in entries:
+                if e.name.startswith(prefixes) and e.is_file() and not self._is_protected(e.name):
+                    try:
+                        stale = e.stat().st_mtime < limit
+                    except FileNotFoundError:
+                        continue
+                    if stale and self._remove(e.path, folder):
+                        removed += 1
+        return removed
+
+    def start(self) -> None:
+        if self._janitor is None or not self._janitor.is_alive():
+            self._janitor = Thread(target = self._run_janitor, daemon = True)
+            self._janitor.start()
+
+    def request_cleanup(self) -> None:
+        """ Wake the janitor (e.g. at the start of a run) without waiting for it. """
+        self.start()
+        self._wakeup.set()
+
+    def _run_janitor(self) -> None:
+        while True:
+            try:
+                self.clean_stale()
+                for folder in self.quotas:
+                    self.enforce(folder)
+            except OSError as e:
+                print("storage janitor:", e)
+            self._wakeup.wait(self._janitor_interval)
+            self._wakeup.clear()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'free': self.free(),
+            'min_free': self.min_free,
+            'quotas': {folder: {'used': self.usage(folder), 'quota': quota} for folder, quota in self.quotas.items()},
+            'evicted': self.evicted
+        }
+
+class FrameStager:
+    """ Stages captured frames in RAM (tmpfs) and writes them to the card in large sequential batches.
+
+    Frames are written to stage_dir (e.g. /dev/shm/nightowl) as they arrive; once batch_frames or
+    batch_bytes are collected, a background thread copies them to target_dir in capture order and
+    removes them from RAM. Frames left in stage_dir by a crash are moved to the card by recover().
+    """
+    def __init__(self, stage_dir: str, target_dir: str, batch_frames: int = 50, batch_bytes: int = 16 * 2**20) -> None:
+        self._stage_dir = stage_dir
+        self._target_dir = target_dir
+        self._batch_frames = batch_frames
+        self._batch_bytes = batch_bytes
+        self._pending = []
+        self._pending_bytes = 0
+        self._queue = Queue()
+        self._thread = None
+        self.flushed = 0 # batches written to the card
+
+    @staticmethod
+    def default_stage_dir() -> str:
+        # tmpfs mount present on Raspberry Pi OS; None disables staging
+        return '/dev/shm/nightowl' if os.path.isdir('/dev/shm') else None
+
+    def start(self) -> None:
+        os.makedirs(self._stage_dir, exist_ok = True)
+        self._thread = Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+    def put(self, name: str, data: bytes) -> None:
+        with open(os.path.join(self._stage_dir, name), 'wb') as f:
+            f.write(data)
+        self._pending.append(name)
+        self._pending_bytes += len(data)
+        if len(self._pending) >= self._batch_frames or self._pending_bytes >= self._batch_bytes:
+            self.flush()
+
+    def flush(self, wait: bool = False) -> None:
+        if self._pending:
+            self._queue.put(self._pending)
+            self._pending = []
+            self._pending_bytes = 0
+        if wait:
+            self._queue.join()
+
+    def close(self) -> None:
+        """ Write all staged frames to the card and stop the writer thread. """
+        self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def recover(self) -> int:
+        """ Move frames staged by an interrupted run to the card. """
+        try:
+            names = sorted(os.listdir(self._stage_dir))
+        except FileNotFoundError:
+            return 0
+        self._write_batch(names)
+        return len(names)
+
+    def _run(self) -> None:
+        while True:
+            names = self._queue.get()
+            try:
+                if names is None:
+                    break
+                self._write_batch(names)
+            except OSError as e: # card full or removed; frames stay in RAM for recover()
+                print("frame stager:", e)
+            finally:
+                self._queue.task_done()
+
+    def _write_batch(self, names: list) -> None:
+        # read the whole batch from RAM first, so the card sees one sequential burst of writes
+        batch = []
+        for name in names:
+            with open(os.path.join(self._stage_dir, name), 'rb') as f:
+                batch.append((name, f.read()))
+        for name, data in batch:
+            with open(os.path.join(self._target_dir, name), 'wb') as f:
+                f.write(data)
+        for name, _ in batch:
+            os.remove(os.path.join(self._stage_dir, name))
+        self.flushed += 1
+
+def _pixels(resolution: str) -> int:
+    w, h = (int(v) for v in resolution.lower().split('x'))
+    return w * h
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import json
+import math
+from datetime import datetime
+from queue import Queue, Full
+from threading import Thread
+from PIL import Image
+
+class ThumbnailWorker:
+    """ Builds a scrub sprite sheet and a poster image for a timelapse run while it is captured.
+
+    Every Nth stored frame is queued (never blocking the capture loop) and downscaled in a background
+    thread. The sprite sheet, its tile index (index.json) and the poster are rewritten every few tiles,
+    so they are usable during the run and after a crash. If a run produces more tiles than max_tiles,
+    every other tile is dropped and N is doubled.
+    """
+    def __init__(self, outdir: str, every: int = 1, tile_width: int = 160, columns: int = 10, max_tiles: int = 100,
+                 poster_width: int = 640, save_every: int = 10) -> None:
+        self._outdir = outdir
+        self.every = max(int(every), 1)
+        self._tile_width = tile_width
+        self._columns = columns
+        self._max_tiles = max_tiles
+        self._poster_width = poster_width
+        self._save_every = save_every
+        self._tiles = [] # (frame index, capture time, score, PIL image)
+        self._tile_size = None
+        self._poster = None # (score, frame index, jpeg bytes)
+        self._queue = Queue(maxsize = 8)
+        self._thread = None
+
+    def start(self) -> None:
+        os.makedirs(self._outdir, exist_ok = True)
+        self._thread = Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+    def submit(self, index: int, frame: bytes, capture_time: str = None, score: float = None) -> bool:
+        """ Offer a stored frame; returns False if it was not taken (not due or worker busy). """
+        best = self._poster is None or (score is not None and score > (self._poster[0] or 0))
+        if index % self.every and not best:
+            return False
+        try:
+            self._queue.put_nowait((index, frame, capture_time, score))
+        except Full:
+            return False
+        return True
+
+    def close(self, wait: bool = False) -> None:
+        """ Finish outstanding thumbnails and write the final sprite sheet (in the background unless wait). """
+        if self._thread is not None:
+            self._queue.put((None, None, None, None))
+            if wait:
+                self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            index, frame, capture_time, score = self._queue.get()
+            if index is None:
+                break
+            try:
+                self._add(index, frame, capture_time, score)
+            except OSError as e: # undecodable frame
+                print("thumbnail worker:", e)
+        self._save()
+
+    def _add(self, index: int, frame: bytes, capture_time: str, score: float) -> None:
+        if self._poster is None or (score is not None and score > (self._poster[0] or 0)):
+            self._poster = (score, index, frame)
+        if index % self.every:
+            return
+        img = Image.open(io.BytesIO(frame))
+        if self._tile_size is None:
+            self._tile_size = (self._tile_width, max(1, round(img.height * self._tile_width / img.width)))
+        img.draft('RGB', self._tile_size) # let the JPEG decoder do most of the downscaling
+        self._tiles.append((index, capture_time, score, img.convert('RGB').resize(self._tile_size)))
+        if len(self._tiles) > self._max_tiles:
+            self._tiles = self._tiles[::2]
+            self.every *= 2
+        if len(self._tiles) % self._save_every == 0:
+            self._save()
+
+    def _save(self) -> None:
+        if not self._tiles:
+            return
+        tw, th = self._tile_size
+        rows = (len(self._tiles) + self._columns - 1) // self._columns
+        sheet = Image.new('RGB', (tw * min(len(self._tiles), self._columns), th * rows))
+        tiles = []
+        for i, (index, capture_time, score, img) in enumerate(self._tiles):
+            x, y = (i % self._columns) * tw, (i // self._columns) * th
+            sheet.paste(img, (x, y))
+            tiles.append({'frame': index, 'time': capture_time, 'score': score, 'x': x, 'y': y})
+        self._write(os.path.join(self._outdir, 'sprite.jpg'), sheet, quality = 60)
+        if self._poster is not None:
+            poster = Image.open(io.BytesIO(self._poster[2]))
+            poster.draft('RGB', (self._poster_width, self._poster_width))
+            poster = poster.convert('RGB')
+            poster.thumbnail((self._poster_width, self._poster_width))
+            self._write(os.path.join(self._outdir, 'poster.jpg'), poster, quality = 80)
+        with open(os.path.join(self._outdir, 'index.json.tmp'), 'w') as f:
+            json.dump({'tile_width': tw, 'tile_height': th, 'columns': self._columns, 'every': self.every,
+                       'poster_frame': self._poster[1] if self._poster else None, 'tiles': tiles}, f)
+        os.replace(os.path.join(self._outdir, 'index.json.tmp'), os.path.join(self._outdir, 'index.json'))
+
+    @staticmethod
+    def _write(path: str, img, quality: int) -> None:
+        # write next to the target and rename, so readers never see a half-written image
+        img.save(path + '.tmp', format = 'jpeg', quality = quality)
+        os.replace(path + '.tmp', path)
+
+def build_from_container(container: str, outdir: str, tiles: int = 100) -> int:
+    """ Sprite sheet and poster of a finished run read from its frame container (fnc.framestore),
+    e.g. when the run was interrupted before the live worker saved. Returns the number of tiles. """
+    from fnc.framestore import FrameReader
+    with FrameReader(container) as reader:
+        worker = ThumbnailWorker(outdir, max_tiles = tiles)
+        os.makedirs(outdir, exist_ok = True)
+        # random access: only the frames that become tiles are read
+        for i in range(0, len(reader), max(math.ceil(len(reader) / tiles), 1)):
+            number, capture_time, _, _ = reader.index[i]
+            try:
+                worker._add(number, reader.read(i), datetime.fromtimestamp(capture_time).strftime('%Y-%m-%d %H:%M:%S'), None)
+            except OSError as e: # undecodable frame
+                print("thumbnail worker:", e)
+        worker._save()
+        return len(worker._tiles)
@@ -1,36 +1,129 @@
 #!/usr/bin/env python3
 
-from time import sleep
-from picamera import PiCamera
+from time import sleep, monotonic
 from datetime import datetime, timedelta
-from drv.LEDdriver import IReyes
 import os
 import glob
 from threading import Thread
 import subprocess
+import io
+import math
+from fnc.encoder import StreamEncoder, ENCODE_SECONDS, encode_frames
+from fnc.camsession import CameraSession
+from fnc.clips import write_index, KEYFRAME_INTERVAL
+from fnc.storage import FrameStager
+from fnc.scheduler import CaptureScheduler
+from fnc.irlight import ExposureLight
+from fnc.framestore import FrameWriter, FrameReader, find_containers, recover as recover_container
+from livecamera.broker import JPEG_BYTES
 
 class Timelapse:
     def __init__(self) -> None:
         self._running = False
         self._conversion_running = False
         self._movie_framerate = 24
+        self._encoder = None
+        self._frame_counter = 0
+        self._batch_start_number = 0
+        self._session = None
+        self._broker = None
+        self._detector = None
+        self._candidates = 0
+        self._last_score = None
+        self._burst_until = 0
+        self._frame_log = []
+        self._thumbs = None
+        self._storage = None
+        self._stage_dir = None
+        self._stager = None
+        self._container = None
+        self._recovering = set() # runs whose recovered frame container is being encoded
+        self._encoding = set() # runs whose batch encode is running
+        self.storage_message = None
+        self._scheduler = None
+        self._light = None
+        self._power = {'battery_mah': None, 'base_current_ma': 0.0}
+        self._eyes = _ir_leds
+        self._capturing = False
+        self._last_frame = None
+        self._listeners = []
         # initialize defaults
         self.tl_timestamp = datetime.now().strftime('%Y-%m-%d-%H-%M-%S') # timestamp for current timelapse
         self.set_interval()
         self.set_cam_params()
         self._app_cwd = os.getcwd() + '/static/'
     
-    def set_cam_params(self, camresolution: str = '854x480', camiso: int = 0, ir_light: bool = False, tmp_dir: str = 'tmp', mov_dir: str = 'mov') -> None:
+    _burst_factor = 4   # capture rate multiplier while changes are detected (motion mode)
+    _burst_hold = 60    # seconds to stay in burst mode after the last detected change
+    _space_check_every = 50 # stored frames between free space checks
+    _late_policy = 'skip'   # frames late by a full period: 'skip' the missed deadlines or capture them 'late'
+    
+    def set_cam_params(self, camresolution: str = '854x480', camiso: int = 0, ir_light: bool = False, tmp_dir: str = 'tmp', mov_dir: str = 'mov', encode_mode: str = 'stream', frame_store: str = 'container', keep_warm: float = 60.0, shared_camera: bool = False,
+                       capture_mode: str = 'interval', motion_threshold: float = 2.0, motion_keep_every: int = 10) -> None:
         # collect parameters
+        # encode_mode: 'stream' feeds frames to ffmpeg while capturing, 'batch' stores JPEGs and encodes after the run
+        # frame_store: stored JPEGs are appended to one 'container' per run (fnc.framestore) or written as single 'files'
+        # keep_warm: max. frame interval (in seconds) for which the camera stays open between slow captures
+        # shared_camera: capture through the frame broker (video port) so the live stream keeps working during a run
+        # capture_mode: 'interval' stores every frame, 'motion' only frames that changed (score >= motion_threshold, in % of pixels)
+        #               plus every motion_keep_every-th frame, and captures faster while changes are detected
         self._cam_settings = {
             'camresolution': camresolution,
             #'camframerate': camframerate, # not in use
             'camiso': camiso,
             'ir_light': ir_light,
             'tmp_dir': tmp_dir,
-            'mov_dir': mov_dir
+            'mov_dir': mov_dir,
+            'encode_mode': encode_mode if encode_mode in ('stream', 'batch') else 'stream',
+            'frame_store': frame_store if frame_store in ('container', 'files') else 'container',
+            'keep_warm': keep_warm,
+            'shared_camera': shared_camera,
+            'capture_mode': capture_mode if capture_mode in ('interval', 'motion') else 'interval',
+            'motion_threshold': motion_threshold,
+            'motion_keep_every': max(int(motion_keep_every), 1)
         }
     
+    def set_broker(self, broker) -> None:
+        # frame broker (livecamera.broker.FrameBroker) used in shared camera mode
+        self._broker = broker
+    
+    def set_storage(self, storage, stage_dir: str = None) -> None:
+        # storage manager (fnc.storage.StorageManager) for quotas, free space checks and tmp cleanup;
+        # stage_dir: RAM/tmpfs folder in which batch frames are collected before being written to the card
+        self._storage = storage
+        self._stage_dir = stage_dir
+    
+    def set_power(self, battery_mah: float = None, base_current_ma: float = 0.0) -> None:
+        # power bank capacity and constant draw of Pi and camera, for the projected runtime of a run
+        self._power = {'battery_mah': battery_mah, 'base_current_ma': base_current_ma}
+    
+    def add_listener(self, callback) -> None:
+        # callback(kind) is invoked (in the timelapse thread) on run state changes ('state') and stored frames ('frame')
+        self._listeners.append(callback)
+    
+    def _notify(self, kind: str) -> None:
+        for callback in self._listeners:
+            try:
+                callback(kind)
+            except Exception as e: # a failing listener must not end the run
+                print("timelapse listener failed:", e)
+    
+    def set_eyes(self, eyes) -> None:
+        # callable returning the IR LED driver (drv.LEDdriver.IReyes), e.g. from the hardware registry (fnc.hardware)
+        self._eyes = eyes
+    
+    def _get_eyes(self):
+        # IR LED driver, or None if it cannot be set up (the frames are taken without IR light then)
+        try:
+            return self._eyes()
+        except (ImportError, OSError, RuntimeError) as e:
+            print("IR light unavailable, capturing without:", e)
+            return None
+    
+    @property
+    def _shared(self) -> bool:
+        return self._cam_settings['shared_camera'] and self._broker is not None
+    
     def capture_preview(self) -> str:
         if not self._running:
             # Initialize/reset camera variables for fixed exposure settings
@@ -40,62 +133,133 @@ class Timelapse:
             tnow = datetime.now()
             prev_img = self._app_cwd + self._cam_settings['tmp_dir']+'/preview_'+ tnow.strftime('%Y-%m-%d-%H-%M-%S') +'.jpg'
             
-            if self._cam_settings['ir_light']:
-                self._cameyes = IReyes()
+            self._cameyes = self._get_eyes() if self._cam_settings['ir_light'] else None
+            if self._cameyes is not None:
                 self._cameyes.turn_on()
             
-            with PiCamera(resolution = self._cam_settings['camresolution']) as camera:
-                if self._cam_settings['camiso']: # if ISO is set, fix camera exposure
-                    self._fix_cam_exp(camera)
-                else:
-                    camera.start_preview()
-                    sleep(2)
-                camera.capture(prev_img, format = 'jpeg', thumbnail = None, bayer = True)
-            if self._cam_settings['ir_light']:
+            if self._shared:
+                # grab a frame from the running (or briefly started) frame broker
+                frame = self._broker.grab(self._cam_settings['camresolution'])
+                with open(prev_img, 'wb') as f:
+                    f.write(frame or b'')
+            else:
+                from picamera import PiCamera # imported on first use, the dashboard starts without camera
+                with PiCamera(resolution = self._cam_settings['camresolution']) as camera:
+                    if self._cam_settings['camiso']: # if ISO is set, fix camera exposure
+                        self._fix_cam_exp(camera)
+                    else:
+                        camera.start_preview()
+                        sleep(2)
+                    camera.capture(prev_img, format = 'jpeg', thumbnail = None, bayer = True)
+            if self._cameyes is not None:
                 self._cameyes.turn_off()
                 #self._cameyes.cleanup() # will interfere with app.py calls...
             return prev_img.replace(self._app_cwd, '')
     
     def start(self) -> None:
         self._running = True
+        self._scheduler = CaptureScheduler(self._frame_period, self._late_policy)
+        self._notify('state')
         #if camframerate < self._movie_framerate or camframerate > 60:
         #    print("WARNING: camera framerate may not be lower than 24 or greater than 60. Using default of 30.")
         #    camframerate = self._movie_framerate
         
-        # Clear tmp files
-        self.clear_tmp(prefix = 'timelapse')
-        self.clear_tmp(prefix = 'preview')
+        # Keep partial movies and staged frames of interrupted runs, then clear tmp files
+        self._recover_partial_movies()
+        if self._stage_dir:
+            FrameStager(self._stage_dir, self._app_cwd + self._cam_settings['tmp_dir']).recover()
+        self._recover_containers()
+        if self._storage is not None:
+            self._storage.request_cleanup() # stale tmp files are removed in the background
+        else:
+            self.clear_tmp(prefix = 'timelapse')
+            self.clear_tmp(prefix = 'preview')
         
-        # Wait for start
-        while self._running and (self._tinterval[0] - datetime.now()).total_seconds() > 0:
+        # Wait for start (stop() wakes the scheduler at once)
+        if self._tinterval[0] > datetime.now():
             print("waiting for start")
-            sleep(1)
+        self._scheduler.wait_start(self._tinterval[0], self._tinterval[0] + timedelta(hours=self._tinterval[1]))
         
         if self._running:
             # Initialize/reset camera variables for fixed exposure settings
             self._cam_shut_speed = None
             self._cam_awb_gains = None
             
-            if self._cam_settings['ir_light']:
-                self._cameyes = IReyes()
+            self._cameyes = self._get_eyes() if self._cam_settings['ir_light'] else None
+            if self._cameyes is not None:
+                self._light = ExposureLight(self._cameyes) # LEDs on only around exposures
+            else:
+                self._light = None
             
             # update timestamp
             self.tl_timestamp = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
-            
-            # main working area
-            if self._tinterval[2] >= 120:
-                self._slow_capture() # handle large capture intervals individually
+            if not self._plan_storage():
+                self._running = False
+                self._notify('state')
+                return
+            self._frame_counter = 0
+            self._last_frame = None
+            self._batch_start_number = 0
+            self._candidates = 0
+            self._last_score = None
+            self._burst_until = 0
+            self._frame_log = []
+            if self._cam_settings['capture_mode'] == 'motion':
+                from fnc.motion import ChangeDetector # requires numpy and PIL
+                self._detector = ChangeDetector()
             else:
-                self._fast_capture() # intervals less than 5s can be handled by continuous capture
+                self._detector = None
+            self._thumbs = self._start_thumbnails()
+            if self._cam_settings['encode_mode'] == 'stream':
+                self._encoder = StreamEncoder(self._movie_tmpfile(), framerate = self._movie_framerate)
+                try:
+                    self._encoder.open()
+                except OSError as e:
+                    print("stream encoder could not be started ({}); falling back to batch encoding".format(e))
+                    self._encoder = None
             
-            # make timelapse movie
-            t_combine = Thread(target = self._combine_shots_to_movie, args = [])
-            t_combine.start()
+            # main working area
+            self._capturing = True
+            self._notify('state')
+            try:
+                if self._shared:
+                    self._shared_capture() # share the camera with the live stream
+                elif self._tinterval[2] >= 120:
+                    self._slow_capture() # handle large capture intervals individually
+                else:
+                    self._fast_capture() # intervals less than 5s can be handled by continuous capture
+            finally:
+                self.stop()
+                self._capturing = False
+                if self._light is not None:
+                    self._light.off()
+                self._write_frame_log()
+                self._scheduler.write_report(self._movie_outfile().replace('.mp4', '_timing.csv'))
+                if self._thumbs is not None:
+                    self._thumbs.close() # finishes in the background
+                    self._thumbs = None
+                if self._stager is not None:
+                    self._stager.close() # all frames on the card before the batch encode
+                    self._stager = None
+                if self._container is not None:
+                    self._container.close() # appends the frame index
+                    self._container = None
+                # make timelapse movie
+                if self._encoder is not None:
+                    self._finish_stream_encode()
+                    if self._storage is not None:
+                        self._storage.unprotect(self.tl_timestamp)
+                else:
+                    # the frames stay protected from the tmp janitor until the batch encode has read them
+                    self._encoding.add(self.tl_timestamp)
+                    t_combine = Thread(target = self._combine_shots_to_movie, args = [])
+                    t_combine.start()
             #sleep(1)
             
             # cleanup GPIO resources
             #if self._cam_settings['ir_light']:
             #    self.cameyes.cleanup() # will interfere with app.py calls...
+        self._notify('state') # run over (the batch encode may still be running)
     
     def _fix_cam_exp(self, camera):
         if camera:
@@ -115,63 +279,299 @@ class Timelapse:
             return camera
     
     def _slow_capture(self) -> None:
-        counter = 0
         #tl_timestamp = datetime.now().strftime('%Y-%m-%d-%H-%M-%S') # generated/updated for each run only; see self.start()
+        # camera stays open between frames unless the frame interval exceeds keep_warm
+        self._session = CameraSession(self._cam_settings['camresolution'],
+                                      setup = self._fix_cam_exp if self._cam_settings['camiso'] > 0 else None, # if ISO is set, fix camera exposure
+                                      keep_warm = self._cam_settings['keep_warm'])
         # loop capture until stopped
-        while self._running:
-            if self._cam_settings['ir_light']:
-                self._cameyes.turn_on()
-                sleep(1)
-            with PiCamera(resolution = self._cam_settings['camresolution']) as camera:
-                if self._cam_settings['camiso'] > 0: # if ISO is set, fix camera exposure
-                    self._fix_cam_exp(camera)
+        with self._session as session:
+            if self._light is not None:
+                self._light.calibrate(lambda: self._luminance(session.open()))
+            while self._scheduler.wait(self._light.lead_time if self._light else 0):
+                if self._light is not None:
+                    self._light.arm() # returns after the warm-up lead time
                 # Capture image
-                camera.capture(self._app_cwd + self._cam_settings['tmp_dir']+'/timelapse_'+self.tl_timestamp+'_frame_'+str(counter).zfill(6)+'.jpg',
-                                format = 'jpeg', thumbnail = None, bayer = False)
-                counter += 1
-            if self._cam_settings['ir_light']:
-                self._cameyes.turn_off()
-            self._wait()
+                stream = io.BytesIO()
+                session.capture(stream, format = 'jpeg', thumbnail = None, bayer = False)
+                if self._light is not None:
+                    self._light.release() # off until the next exposure
+                self._store_frame(stream.getvalue())
+                self._scheduler.done()
+                self._scheduler.period = self._capture_period
+                session.idle(self._capture_period)
     
     def _fast_capture(self) -> None:
-        if self._cam_settings['ir_light']:
-            self._cameyes.turn_on()
-            sleep(1)
+        lead = 0
+        if self._light is not None:
+            self._light.arm() # exposure is fixed under IR light
         #tl_timestamp = datetime.now().strftime('%Y-%m-%d-%H-%M-%S') # generated/updated for each run only; see self.start()
+        from picamera import PiCamera
         with PiCamera(resolution = self._cam_settings['camresolution']) as camera:
             if self._cam_settings['camiso']: # if ISO is set, fix camera exposure
                 self._fix_cam_exp(camera)
-            # Capture images continuously with small delays
-            for image in camera.capture_continuous(self._app_cwd + self._cam_settings['tmp_dir']+'/timelapse_'+self.tl_timestamp+'_frame_{counter:06d}.jpg',
-                                                    format = 'jpeg', thumbnail = None, bayer = False):
-                self._wait()
-                if not self._running:
-                    break
-        if self._cam_settings['ir_light']:
-            self._cameyes.turn_off()
+            if self._light is not None:
+                lead = self._light.calibrate(lambda: self._luminance(camera))
+            # Capture images continuously, each one on its deadline; the LEDs strobe if the interval allows it
+            stream = io.BytesIO()
+            if self._scheduler.wait(lead):
+                if self._light is not None:
+                    self._light.arm()
+                for _ in camera.capture_continuous(stream, format = 'jpeg', thumbnail = None, bayer = False):
+                    if self._light is not None:
+                        self._light.release(self._scheduler.next_in)
+                    self._store_frame(stream.getvalue())
+                    self._scheduler.done()
+                    stream.seek(0)
+                    stream.truncate()
+                    self._scheduler.period = self._capture_period
+                    if not self._scheduler.wait(lead):
+                        break
+                    if self._light is not None:
+                        self._light.arm()
+    
+    def _shared_capture(self) -> None:
+        # the frame broker paces this subscriber at the frame period; one sensor readout serves all subscribers
+        if self._light is not None:
+            self._light.arm() # the live stream shares the camera, LEDs stay on
+        with self._broker.subscribe(1 / self._frame_period, self._cam_settings['camresolution']) as sub:
+            while not self._scheduler.stopped and self._scheduler.remaining > 0:
+                sub.fps = 1 / self._capture_period # follows motion bursts
+                frame = sub.get_frame(timeout = 1) # short timeout to react on stop()
+                if frame is not None:
+                    if not self._scheduler.arrived():
+                        break
+                    self._store_frame(frame)
+                    self._scheduler.done()
+                    self._scheduler.period = self._capture_period
+        if self._light is not None:
+            self._light.off()
+    
+    @staticmethod
+    def _luminance(camera) -> float:
+        # mean brightness of a small video port frame (Y plane of a YUV capture)
+        stream = io.BytesIO()
+        camera.capture(stream, format = 'yuv', use_video_port = True, resize = (64, 48))
+        y = stream.getvalue()[:64 * 48]
+        return sum(y) / len(y) if y else 0.0
+    
+    def _frame_path(self, counter: int) -> str:
+        return self._app_cwd + self._cam_settings['tmp_dir']+'/timelapse_'+self.tl_timestamp+'_frame_'+str(counter).zfill(6)+'.jpg'
+    
+    def frames_file(self, run: str = None) -> str:
+        # frame container of a run (relative to static/)
+        return self._cam_settings['tmp_dir'] + '/timelapse_' + (run or self.tl_timestamp) + '.frames'
+    
+    def _movie_tmpfile(self) -> str:
+        return self._app_cwd + self._cam_settings['tmp_dir'] + '/ffmpeg_zeitraffer_' + self.tl_timestamp + '.mp4'
+    
+    def _movie_outfile(self) -> str:
+        return self._app_cwd + self._cam_settings['mov_dir'] + '/zeitraffer_' + self.tl_timestamp + '.mp4'
+    
+    def _store_frame(self, frame: bytes) -> None:
+        score = None
+        if self._detector is not None:
+            # motion mode: skip unchanged frames, burst on change
+            score = self._last_score = self._detector.score(frame)
+            self._candidates += 1
+            if score >= self._cam_settings['motion_threshold']:
+                self._burst_until = monotonic() + self._burst_hold
+            elif (self._candidates - 1) % self._cam_settings['motion_keep_every']:
+                return
+        JPEG_BYTES.labels('timelapse').observe(len(frame))
+        capture_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._frame_log.append((self._frame_counter, capture_time, score))
+        if self._thumbs is not None:
+            self._thumbs.submit(self._frame_counter, frame, capture_time, score) # never blocks
+        # hand captured JPEG to the encoder (stream mode) or keep it in tmp for the batch encode
+        if self._encoder is not None:
+            if not self._encoder.write(frame):
+                print("encoder stopped unexpectedly; falling back to batch encoding")
+                self._encoder.close()
+                self._encoder = None
+                self._recover_partial_movies() # keep what has been encoded so far
+                self._batch_start_number = self._frame_counter
+        if self._encoder is None:
+            if self._cam_settings['frame_store'] == 'container':
+                if self._container is None:
+                    self._container = FrameWriter(self._app_cwd + self.frames_file())
+                self._container.append(self._frame_counter, frame)
+            elif self._stage_dir:
+                if self._stager is None:
+                    self._stager = FrameStager(self._stage_dir, self._app_cwd + self._cam_settings['tmp_dir'])
+                    self._stager.start()
+                self._stager.put(os.path.basename(self._frame_path(self._frame_counter)), frame)
+            else:
+                with open(self._frame_path(self._frame_counter), 'wb') as f:
+                    f.write(frame)
+        self._last_frame = frame
+        self._frame_counter += 1
+        self._notify('frame')
+        if self._storage is not None and self._frame_counter % self._space_check_every == 0:
+            if not self._storage.ensure_free():
+                # stop cleanly (movie finalized) instead of failing on a full card later in the night
+                self.storage_message = 'Speicherplatz erschöpft, Aufnahme nach {} Bildern beendet'.format(self._frame_counter)
+                print(self.storage_message)
+                self.stop()
+    
+    def _plan_storage(self) -> bool:
+        # check that the run fits on the card; lower the resolution or refuse the run if it does not
+        self.storage_message = None
+        if self._storage is None:
+            return True
+        expected_frames = int(self._tinterval[1] * 3600 / self._frame_period)
+        resolution, self.storage_message = self._storage.plan_run(expected_frames, self._cam_settings['camresolution'],
+                                                                  keep_frames = self._cam_settings['encode_mode'] == 'batch')
+        if self.storage_message:
+            print(self.storage_message)
+        if resolution is None:
+            return False
+        self._cam_settings['camresolution'] = resolution
+        self._storage.protect(self.tl_timestamp) # never evict files of the running run
+        return True
+    
+    def thumbs_dir(self, run: str = None) -> str:
+        # sprite sheet, tile index and poster of a run (relative to static/)
+        return self._cam_settings['mov_dir'] + '/thumbs/zeitraffer_' + (run or self.tl_timestamp)
+    
+    def _start_thumbnails(self):
+        try:
+            from fnc.thumbnails import ThumbnailWorker # requires PIL
+        except ImportError:
+            return None
+        # aim for about 100 tiles per run
+        expected_frames = self._tinterval[1] * 3600 / self._frame_period
+        worker = ThumbnailWorker(self._app_cwd + self.thumbs_dir(), every = math.ceil(expected_frames / 100))
+        worker.start()
+        return worker
+    
+    def _write_frame_log(self) -> None:
+        # movie frame number, capture time and change score (motion mode) of every stored frame
+        if self._frame_log:
+            with open(self._app_cwd + self._cam_settings['mov_dir'] + '/zeitraffer_' + self.tl_timestamp + '_frames.csv', 'w') as f:
+                f.write('frame,time,score\n')
+                for counter, t, score in self._frame_log:
+                    f.write('{},{},{}\n'.format(counter, t, '' if score is None else round(score, 2)))
+            # keyframe/time index for clip extraction (see fnc.clips)
+            write_index(self._movie_outfile().replace('.mp4', '_index.json'), self._movie_framerate, self._frame_log, self._batch_start_number)
+    
+    def _finish_stream_encode(self) -> None:
+        # close the running encoder; the fragmented mp4 only needs its last fragment flushed
+        self._conversion_running = True
+        self._notify('state')
+        try:
+            if self._encoder.close():
+                os.replace(self._movie_tmpfile(), self._movie_outfile())
+        finally:
+            self._encoder = None
+            self._conversion_running = False
+    
+    def _recover_partial_movies(self) -> None:
+        # fragmented mp4s left in tmp by an interrupted stream encode are playable up to the last fragment
+        if self._encoder is not None:
+            return
+        encoding = set(self._encoding)
+        for f in glob.glob(self._app_cwd + self._cam_settings['tmp_dir'] + '/ffmpeg_zeitraffer_*.mp4'):
+            if any(run in f for run in encoding):
+                continue # still being written by the batch encode of an earlier run
+            if os.path.getsize(f) > 0:
+                os.replace(f, self._app_cwd + self._cam_settings['mov_dir'] + '/' + os.path.basename(f).replace('ffmpeg_zeitraffer_', 'zeitraffer_').replace('.mp4', '_partial.mp4'))
+            else:
+                os.remove(f)
+    
+    def recover_runs(self) -> None:
+        # movies of runs interrupted by a crash or power loss (e.g. at app start)
+        self._recover_partial_movies()
+        self._recover_containers()
+    
+    def _recover_containers(self) -> None:
+        # containers of interrupted runs get their index and are encoded to a partial movie in the background
+        if self._container is not None:
+            return
+        mov = self._app_cwd + self._cam_settings['mov_dir'] + '/zeitraffer_'
+        pending = []
+        for run, path in find_containers(self._app_cwd + self._cam_settings['tmp_dir']).items():
+            if run == self.tl_timestamp or run in self._recovering or run in self._encoding:
+                continue # the last run of this process is encoded by start()
+            try:
+                with FrameReader(path) as reader:
+                    complete = reader.complete
+            except ValueError: # not a container (e.g. truncated before the header was written)
+                continue
+            if not complete:
+                print("frame container of run {} recovered with {} frames".format(run, recover_container(path)))
+            if not (os.path.isfile(mov + run + '.mp4') or os.path.isfile(mov + run + '_partial.mp4')):
+                pending.append((run, path))
+        for run, _ in pending:
+            self._recovering.add(run) # kept by clear_tmp
+            if self._storage is not None:
+                self._storage.protect(run) # and by the tmp janitor until encoded
+        if pending:
+            Thread(target = self._encode_recovered, args = [pending], daemon = True).start()
+    
+    def _encode_recovered(self, pending: list) -> None:
+        for run, path in pending:
+            tmpfile = self._app_cwd + self._cam_settings['tmp_dir'] + '/recover_zeitraffer_' + run + '.mp4'
+            try:
+                with FrameReader(path) as reader:
+                    if encode_frames(reader.frames(), tmpfile, framerate = self._movie_framerate):
+                        os.replace(tmpfile, self._app_cwd + self._cam_settings['mov_dir'] + '/zeitraffer_' + run + '_partial.mp4')
+                        print("movie of interrupted run {} encoded from {} frames".format(run, len(reader)))
+            except (OSError, ValueError) as e:
+                print("encoding interrupted run {} failed: {}".format(run, e))
+            finally:
+                self._recovering.discard(run)
+                if self._storage is not None:
+                    self._storage.unprotect(run)
     
     def _combine_shots_to_movie(self) -> None:
         # combine image captures to movie
-        if not self._conversion_running:
-            self._conversion_running = True
-            #tl_timestamp = datetime.now().strftime('%Y-%m-%d-%H-%M-%S') # generated/updated for each run only; see self.start()
-            tmpfile = self._app_cwd + self._cam_settings['tmp_dir'] + '/ffmpeg_zeitraffer_' + self.tl_timestamp + '.mp4'
-            outfile = self._app_cwd + self._cam_settings['mov_dir'] + '/zeitraffer_' + self.tl_timestamp + '.mp4'
-            # construct command
-            #ffmpeg_cmd = 'ffmpeg -framerate ' + str(self._movie_framerate) + ' -pattern_type glob -i "' + self._app_cwd+self._cam_settings['tmp_dir']+'/timelapse_*.jpg" -c:v libx264 ' + tmpfile
-            ffmpeg_cmd = 'ffmpeg -framerate ' + str(self._movie_framerate) + ' -i "' + self._app_cwd+self._cam_settings['tmp_dir']+ '/timelapse_'+self.tl_timestamp+'_frame_%06d.jpg" -c:v libx264 -preset ultrafast ' + tmpfile
-            epilogue_cmd = 'mv ' + tmpfile + ' ' + outfile
-            final_cmd = ffmpeg_cmd + ' && ' + epilogue_cmd
-            # run frame combination
-            subprocess.run(final_cmd, shell = True)
-            self._conversion_running = False
+        run = self.tl_timestamp
+        try:
+            if not self._conversion_running:
+                self._conversion_running = True
+                self._notify('state')
+                #tl_timestamp = datetime.now().strftime('%Y-%m-%d-%H-%M-%S') # generated/updated for each run only; see self.start()
+                tmpfile = self._movie_tmpfile()
+                outfile = self._movie_outfile()
+                # construct command
+                #ffmpeg_cmd = 'ffmpeg -framerate ' + str(self._movie_framerate) + ' -pattern_type glob -i "' + self._app_cwd+self._cam_settings['tmp_dir']+'/timelapse_*.jpg" -c:v libx264 ' + tmpfile
+                ffmpeg_cmd = 'ffmpeg -framerate ' + str(self._movie_framerate) + ' -start_number ' + str(self._batch_start_number) + ' -i "' + self._app_cwd+self._cam_settings['tmp_dir']+ '/timelapse_'+self.tl_timestamp+'_frame_%06d.jpg" -c:v libx264 -preset ultrafast -g ' + str(KEYFRAME_INTERVAL) + ' -keyint_min ' + str(KEYFRAME_INTERVAL) + ' -sc_threshold 0 ' + tmpfile
+                epilogue_cmd = 'mv ' + tmpfile + ' ' + outfile
+                final_cmd = ffmpeg_cmd + ' && ' + epilogue_cmd
+                # run frame combination
+                t0 = monotonic()
+                container = self._app_cwd + self.frames_file()
+                try:
+                    if os.path.isfile(container):
+                        # frames are streamed from the container into ffmpeg (image2pipe)
+                        with FrameReader(container) as reader:
+                            if encode_frames(reader.frames(), tmpfile, framerate = self._movie_framerate):
+                                os.replace(tmpfile, outfile)
+                    else:
+                        subprocess.run(final_cmd, shell = True)
+                except (OSError, ValueError) as e: # corrupt container, ffmpeg missing
+                    print("encoding run {} failed: {}".format(run, e))
+                finally:
+                    ENCODE_SECONDS.labels('batch').observe(monotonic() - t0)
+                    self._conversion_running = False
+                    self._notify('state')
+        finally:
+            self._encoding.discard(run)
+            if self._storage is not None:
+                self._storage.unprotect(run)
     
     def stop(self) -> None:
-        self._running = False
+        running, self._running = self._running, False
+        if self._scheduler is not None:
+            self._scheduler.stop()
+        if running:
+            self._notify('state')
     
     def clear_tmp(self, prefix: str = 'preview', quant: int = 0) -> None:
         # clear stale tmp images
-        tmp_content = sorted(glob.glob(self._app_cwd + self._cam_settings['tmp_dir'] + '/' + prefix + '*'))
+        tmp_content = sorted(f for f in glob.glob(self._app_cwd + self._cam_settings['tmp_dir'] + '/' + prefix + '*')
+                             if not any(run in f for run in self._recovering | self._encoding))
         if quant > 0:
             for f in tmp_content[:quant]:
                 os.remove(f)
@@ -191,13 +591,46 @@ class Timelapse:
         else:
             print("Timelapse parameter error. Requirements: t_start 0 < x < 24; duration > 0; f_acc > 1")
     
-    def _wait(self) -> None:
-        if (self._tinterval[0] + timedelta(hours=self._tinterval[1])) < datetime.now():
-            self.stop()
-        # wait for next frame
-        #sleep(self._tinterval[2] / self._movie_framerate) # this does not account for any capture delays
-        # calculate wait steps based on acceleration factor and datetime (will account for variable capture delays)
-        sleep( (self._tinterval[2]/self._movie_framerate) - ((datetime.now() - self._tinterval[0]).total_seconds() % (self._tinterval[2]/self._movie_framerate)) )
+    @property
+    def _frame_period(self) -> float:
+        # seconds between two captured frames
+        return self._tinterval[2] / self._movie_framerate
+
+    @property
+    def _capture_period(self) -> float:
+        # seconds until the next candidate frame; shorter during a motion burst
+        if monotonic() < self._burst_until:
+            return self._frame_period / self._burst_factor
+        return self._frame_period
+
+    @property
+    def frame_stats(self) -> dict:
+        # stored vs. candidate frames of the current run (motion mode)
+        return {
+            'stored': self._frame_counter,
+            'candidates': self._candidates,
+            'last_score': self._last_score,
+            'burst': monotonic() < self._burst_until
+        }
+
+    @property
+    def timing_stats(self) -> dict:
+        # lateness against the capture deadlines and dropped frames of the current/last run
+        return self._scheduler.stats if self._scheduler else None
+
+    @property
+    def ir_stats(self) -> dict:
+        # LED-on time, charge and projected runtime of the current/last run with IR light
+        if self._light is None:
+            return None
+        stats = self._light.energy(**self._power)
+        stats['lead_time'] = round(self._light.lead_time, 3)
+        return stats
+
+    @property
+    def capture_stats(self) -> dict:
+        # per-frame capture latency of the slow capture path (None before the first slow run)
+        return self._session.stats if self._session else None
 
     @property
     def current_interval(self) -> tuple:
@@ -207,6 +640,26 @@ class Timelapse:
     def cam_settings(self):
         return self._cam_settings
     
+    @property
+    def phase(self) -> str:
+        # 'waiting' for the start, 'capturing', 'encoding' the movie or 'idle'
+        if self._conversion_running:
+            return 'encoding'
+        if self._running:
+            return 'capturing' if self._capturing else 'waiting'
+        return 'idle'
+    
+    @property
+    def last_frame(self) -> tuple:
+        # (number of stored frames, last stored JPEG) of the current/last run; (0, None) before the first frame
+        return self._frame_counter, self._last_frame
+    
     @property
     def status(self) -> bool:
-        return any([self._running, self._conversion_running])
\ No newline at end of file
+        return any([self._running, self._conversion_running])
+
+
+def _ir_leds():
+    # default IR LED driver, imported on first use (RPi.GPIO is only available on the Pi)
+    from drv.LEDdriver import IReyes
+    return IReyes()
@@ -1,5 +1,6 @@
 import time
 import threading
+from fnc.metrics import histogram, gauge, LATENCY_BUCKETS, FPS_BUCKETS
 try:
     from greenlet import getcurrent as get_ident
 except ImportError:
@@ -8,47 +9,98 @@ except ImportError:
     except ImportError:
         from _thread import get_ident
 
+FRAME_INTERVAL = histogram('nightowl_camera_frame_interval_seconds', 'Time between frames published to live stream clients', LATENCY_BUCKETS)
+VIEWER_FPS = histogram('nightowl_stream_viewer_fps', 'Frame rate delivered to each live stream viewer (5 s windows)', FPS_BUCKETS)
+VIEWERS = gauge('nightowl_stream_viewers', 'Open live stream connections')
+TARGET_FPS = gauge('nightowl_camera_target_fps', 'Capture rate the camera thread currently aims for (highest viewer demand)')
+
 
 class CameraEvent(object):
-    """An Event-like class that signals all active clients when a new frame is
-    available.
+    """A broadcast primitive that signals all active clients when a new frame
+    is available. Every frame gets a monotonically increasing frame id;
+    clients wait for "a frame newer than the one I have" and learn how many
+    frames they skipped. Publishing a frame swaps in a fresh threading.Event
+    and sets the old one, so the camera thread does not walk over the clients.
+
+    It also collects the demand of the clients: the frame rate each one asks
+    for and how many of them are currently waiting for a frame. A client that
+    is not waiting is still busy sending its last frame (e.g. over a slow link).
     """
+    reap_interval = 5  # seconds between bulk removals of gone clients
+
     def __init__(self):
-        self.events = {}
-
-    def wait(self):
-        """Invoked from each client's thread to wait for the next frame."""
-        ident = get_ident()
-        if ident not in self.events:
-            # this is a new client
-            # add an entry for it in the self.events dict
-            # each entry has two elements, a threading.Event() and a timestamp
-            self.events[ident] = [threading.Event(), time.time()]
-        return self.events[ident][0].wait()
-
-    def set(self):
+        self.latest = (0, None)  # (frame_id, frame), replaced atomically
+        self.updated = 0  # epoch time of the latest frame
+        self.clients = {}  # client ident -> (time of last wait(), fps cap or None)
+        self._event = threading.Event()
+        self._last_reap = time.time()
+        self._waiting = 0
+        self._demand = threading.Condition()
+
+    @property
+    def frame_id(self):
+        return self.latest[0]
+
+    def wait(self, after_id=0, timeout=None, fps=None):
+        """Invoked from each client's thread to wait for a frame newer than
+        after_id, at most fps frames per second for this client. Returns
+        (frame_id, frame, skipped), or (after_id, None, 0) on timeout."""
+        self.clients[get_ident()] = (time.time(), fps)
+        event = self._event
+        if self.latest[0] <= after_id:
+            with self._demand:
+                self._waiting += 1
+                self._demand.notify_all()
+            try:
+                # the event was grabbed before checking the frame id, so a
+                # frame published in between sets the event we are waiting on
+                if not event.wait(timeout) and self.latest[0] <= after_id:
+                    return after_id, None, 0
+            finally:
+                with self._demand:
+                    self._waiting -= 1
+        frame_id, frame = self.latest
+        skipped = max(frame_id - after_id - 1, 0) if after_id else 0
+        return frame_id, frame, skipped
+
+    def set(self, frame):
         """Invoked by the camera thread when a new frame is available."""
+        self.latest = (self.latest[0] + 1, frame)
+        self.updated = time.time()
+        event, self._event = self._event, threading.Event()
+        event.set()
+
+        self.reap()
+
+    def reap(self):
         now = time.time()
-        remove = None
-        for ident, event in self.events.items():
-            if not event[0].isSet():
-                # if this client's event is not set, then set it
-                # also update the last set timestamp to now
-                event[0].set()
-                event[1] = now
-            else:
-                # if the client's event is already set, it means the client
-                # did not process a previous frame
-                # if the event stays set for more than 5 seconds, then assume
-                # the client is gone and remove it
-                if now - event[1] > 5:
-                    remove = ident
-        if remove:
-            del self.events[remove]
-
-    def clear(self):
-        """Invoked from each client's thread after a frame was processed."""
-        self.events[get_ident()][0].clear()
+        if now - self._last_reap > self.reap_interval:
+            # remove all clients that have not asked for a frame recently
+            self._last_reap = now
+            self.clients = {ident: c for ident, c in list(self.clients.items())
+                            if now - c[0] < self.reap_interval}
+
+    def leave(self, ident=None):
+        """A client is gone (stream closed); its demand ends at once."""
+        self.clients.pop(ident or get_ident(), None)
+
+    def wait_demand(self, timeout):
+        """Invoked by the camera thread: block until at least one client waits
+        for a frame. Returns False on timeout."""
+        with self._demand:
+            return self._demand.wait_for(lambda: self._waiting > 0, timeout)
+
+    def demand_fps(self, max_fps):
+        """Highest frame rate any client asks for (uncapped clients count as
+        max_fps); None if there are no clients."""
+        caps = [c[1] for c in list(self.clients.values())]
+        if not caps:
+            return None
+        return min(max(cap or max_fps for cap in caps), max_fps)
+
+    @property
+    def viewers(self):
+        return len(self.clients)
 
 
 class BaseCamera(object):
@@ -56,48 +108,112 @@ class BaseCamera(object):
     frame = None  # current frame is stored here by background thread
     last_access = 0  # time of last client access to the camera
     event = CameraEvent()
+    max_fps = 30  # upper bound of the capture rate; the backend may deliver less
+    linger = 2.0  # seconds the camera keeps running after the last client left
+    _start_lock = threading.Lock()
+
+    def __init__(self, fps=None):
+        """Start the background camera thread if it isn't running yet.
+        fps caps the frame rate of this client (None: as fast as the camera
+        delivers); the camera runs at the highest rate its clients ask for."""
+        self.frame_id = 0  # id of the last frame handed to this client
+        self.skipped = 0  # frames this client missed so far
+        self.fps = fps
+        self._next_due = 0
+        self._ident = get_ident()
+        if self._start():
+            # wait until first frame is available
+            BaseCamera.event.wait(BaseCamera.event.frame_id, 10, fps)
 
-    def __init__(self):
-        """Start the background camera thread if it isn't running yet."""
-        if BaseCamera.thread is None:
+    def _start(self):
+        """Start the camera thread unless it runs; True if it was started."""
+        with BaseCamera._start_lock:
+            if BaseCamera.thread is not None:
+                return False
             BaseCamera.last_access = time.time()
 
             # start background frame thread
             BaseCamera.thread = threading.Thread(target=self._thread)
             BaseCamera.thread.start()
+            return True
 
-            # wait until first frame is available
-            BaseCamera.event.wait()
-
-    def get_frame(self):
-        """Return the current camera frame."""
+    def get_frame(self, timeout=None):
+        """Return the next camera frame for this client (None if there is
+        none within timeout seconds)."""
         BaseCamera.last_access = time.time()
-
-        # wait for a signal from the camera thread
-        BaseCamera.event.wait()
-        BaseCamera.event.clear()
-
-        return BaseCamera.frame
+        if self.fps:
+            # per-client rate cap; a client that is not waiting does not make
+            # the camera produce frames
+            delay = self._next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        # wait for a frame newer than the last one this client got; the camera
+        # thread may have idled down in the meantime, then it is restarted
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        frame = None
+        while frame is None:
+            wait = self.linger + 1
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return None
+            self._start()
+            frame_id, frame, skipped = BaseCamera.event.wait(self.frame_id, wait, self.fps)
+        self._ident = get_ident()
+        self.frame_id = frame_id
+        self.skipped += skipped
+        if self.fps:
+            self._next_due = max(self._next_due + 1.0 / self.fps, time.monotonic())
+        return frame
+
+    def close(self):
+        """The client is done (stream closed); the camera idles down soon
+        after the last one."""
+        BaseCamera.event.leave(self._ident)
 
     @staticmethod
-    def frames():
-        """"Generator that returns frames from the camera."""
+    def frames(resolution=None):
+        """"Generator that returns frames from the camera. Backends open the
+        sensor at resolution (a (width, height) tuple) if given, otherwise at
+        their default size."""
         raise RuntimeError('Must be implemented by subclasses.')
 
     @classmethod
     def _thread(cls):
-        """Camera background thread."""
+        """Camera background thread. Reads (and encodes) a frame only when a
+        client is waiting for one, at most at the highest rate the clients ask
+        for; stops when the last client has been gone for linger seconds."""
         print('Starting camera thread.')
+        event = BaseCamera.event
         frames_iterator = cls.frames()
-        for frame in frames_iterator:
-            BaseCamera.frame = frame
-            BaseCamera.event.set()  # send signal to clients
-            time.sleep(0)
-
-            # if there hasn't been any clients asking for frames in
-            # the last 10 seconds then stop the thread
-            if time.time() - BaseCamera.last_access > 10:
-                frames_iterator.close()
-                print('Stopping camera thread due to inactivity.')
-                break
-        BaseCamera.thread = None
+        last = started = time.monotonic()
+        try:
+            while True:
+                event.reap()
+                fps = event.demand_fps(cls.max_fps)
+                if fps is None and time.time() - BaseCamera.last_access > cls.linger:
+                    print('Stopping camera thread, no viewers.')
+                    break
+                TARGET_FPS.set(fps or 0)
+                # pause while every client is still busy with its last frame
+                if not event.wait_demand(cls.linger / 4):
+                    continue
+                # pace the readout starts (backends that pace themselves, like
+                # the dummy camera, are not slowed down further)
+                delay = started + 1.0 / (fps or cls.max_fps) - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                started = time.monotonic()
+                frame = next(frames_iterator, None)
+                if frame is None:
+                    break  # the backend ran out of frames
+                now = time.monotonic()
+                FRAME_INTERVAL.observe(now - last)
+                last = now
+                BaseCamera.frame = frame
+                event.set(frame)  # send signal to clients
+        finally:
+            frames_iterator.close()
+            TARGET_FPS.set(0)
+            BaseCamera.thread = None
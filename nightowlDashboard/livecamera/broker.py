@@ -0,0 +1,179 @@
+import time
+import threading
+from .jpegutil import parse_resolution, scale_jpeg
+from fnc.metrics import histogram, LATENCY_BUCKETS, SIZE_BUCKETS
+
+READOUT_SECONDS = histogram('nightowl_camera_readout_seconds', 'Sensor readout latency of the camera backend (frame broker)', LATENCY_BUCKETS)
+JPEG_BYTES = histogram('nightowl_jpeg_bytes', 'Size of captured JPEG frames', SIZE_BUCKETS, ('source',))
+
+
+class Subscription(object):
+    """A subscriber of the frame broker. Receives frames at (at most) its own
+    rate, scaled down to its own resolution."""
+    def __init__(self, broker, fps, resolution=None):
+        self.broker = broker
+        self.fps = fps
+        self.resolution = parse_resolution(resolution)
+        self.next_due = 0
+        self._frame = None
+        self._seq = 0
+        self._seen = 0
+        self._cond = threading.Condition()
+
+    @property
+    def interval(self):
+        return 1.0 / self.fps if self.fps else 0
+
+    def deliver(self, frame):
+        """Invoked by the broker thread when this subscriber is due."""
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get_frame(self, timeout=None):
+        """Block until a frame newer than the last one returned is available.
+        Returns None on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > self._seen, timeout):
+                return None
+            self._seen = self._seq
+            return self._frame
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameBroker(object):
+    """Single owner of the camera. A background thread reads frames from the
+    source and publishes them to all subscribers, with at most one sensor
+    readout per tick. The source is a callable taking a resolution and
+    returning a frame generator, e.g. the frames() method of a camera backend.
+    The sensor is read at the largest resolution any subscriber asks for;
+    subscribers asking for less get a scaled copy (encoded once per tick and
+    resolution)."""
+    def __init__(self, source, slack=0.02):
+        self.source = source
+        self.slack = slack  # subscribers due within this many seconds share a readout
+        self.subscribers = []
+        self.thread = None
+        self.resolution = None
+        self.readouts = 0
+        self.error = None  # last source failure, cleared by the next frame
+        self.retry = 1.0  # first pause before reopening a failed source (doubled up to max_retry)
+        self.max_retry = 30.0
+        self._lock = threading.Condition()
+
+    def subscribe(self, fps, resolution=None):
+        """Register a subscriber; starts the camera thread if needed."""
+        sub = Subscription(self, fps, resolution)
+        with self._lock:
+            self.subscribers.append(sub)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._thread, daemon=True)
+                self.thread.start()
+            self._lock.notify_all()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub in self.subscribers:
+                self.subscribers.remove(sub)
+            self._lock.notify_all()
+
+    def grab(self, resolution=None, timeout=10):
+        """Return a single frame, e.g. for a preview image."""
+        with self.subscribe(0, resolution) as sub:
+            return sub.get_frame(timeout)
+
+    @property
+    def active(self):
+        return self.thread is not None
+
+    def _wanted_resolution(self):
+        sizes = [s.resolution for s in self.subscribers]
+        if not sizes or None in sizes:
+            return None  # somebody wants the native resolution
+        return max(sizes, key=lambda r: r[0] * r[1])
+
+    def _thread(self):
+        """Camera owner thread."""
+        print('Starting frame broker thread.')
+        frames_iterator = None
+        clean_exit = False
+        failures = 0
+        try:
+            while True:
+                with self._lock:
+                    if not self.subscribers:
+                        break
+                    # sleep until the next subscriber is due (or the
+                    # subscriber list changes)
+                    delay = min(s.next_due for s in self.subscribers) - time.monotonic()
+                    if delay > self.slack:
+                        self._lock.wait(delay)
+                        continue
+                    wanted = self._wanted_resolution()
+                try:
+                    if frames_iterator is None or wanted != self.resolution:
+                        # (re)open the sensor at the largest requested resolution
+                        if frames_iterator is not None:
+                            frames_iterator.close()
+                            frames_iterator = None
+                        self.resolution = wanted
+                        frames_iterator = self.source(self.resolution)
+                    t0 = time.monotonic()
+                    frame = next(frames_iterator)  # one sensor readout
+                except Exception as e:
+                    # camera gone or source ended (StopIteration): reopen after a pause
+                    # instead of leaving the subscribers without frames
+                    if frames_iterator is not None:
+                        frames_iterator.close()
+                        frames_iterator = None
+                    failures += 1
+                    delay = min(self.retry * 2 ** (failures - 1), self.max_retry)
+                    self.error = '{}: {}'.format(type(e).__name__, e)
+                    print('Frame broker: camera source failed ({}), retry in {:.1f} s'.format(self.error, delay))
+                    with self._lock:
+                        # wakes early if the last subscriber leaves
+                        self._lock.wait_for(lambda: not self.subscribers, delay)
+                    continue
+                failures = 0
+                self.error = None
+                READOUT_SECONDS.observe(time.monotonic() - t0)
+                JPEG_BYTES.labels('broker').observe(len(frame))
+                self.readouts += 1
+                self._publish(frame)
+            clean_exit = True
+        finally:
+            if frames_iterator is not None:
+                frames_iterator.close()
+            with self._lock:
+                self.thread = None
+                if clean_exit and self.subscribers:
+                    # subscribed while we were shutting down
+                    self.thread = threading.Thread(target=self._thread, daemon=True)
+                    self.thread.start()
+            print('Stopping frame broker thread.')
+
+    def _publish(self, frame):
+        now = time.monotonic()
+        with self._lock:
+            due = [s for s in self.subscribers if s.next_due - now <= self.slack]
+        scaled = {}
+        for sub in due:
+            if sub.resolution is None or sub.resolution == self.resolution:
+                out = frame
+            else:
+                if sub.resolution not in scaled:
+                    scaled[sub.resolution] = scale_jpeg(frame, sub.resolution)
+                out = scaled[sub.resolution]
+            sub.deliver(out)
+            # keep the cadence, but do not try to catch up on missed ticks
+            sub.next_due = max(sub.next_due + sub.interval, now)
@@ -0,0 +1,24 @@
+from .base_camera import BaseCamera
+
+
+class Camera(BaseCamera):
+    """Live stream camera that does not own the sensor but subscribes to a
+    shared FrameBroker, so the stream can run next to a timelapse. Set
+    Camera.broker before the first client connects. The subscription follows
+    the viewers' demand, up to fps."""
+    broker = None
+    fps = 10
+    resolution = (640, 480)
+
+    @staticmethod
+    def frames(resolution=None):
+        sub = Camera.broker.subscribe(Camera.fps, resolution or Camera.resolution)
+        try:
+            while True:
+                sub.fps = BaseCamera.event.demand_fps(Camera.fps) or Camera.fps
+                frame = sub.get_frame(timeout=10)
+                if frame is None:
+                    raise RuntimeError('Frame broker delivered no frame for 10 seconds.')
+                yield frame
+        finally:
+            sub.close()
@@ -1,14 +1,27 @@
+import os
 import time
 from .base_camera import BaseCamera
 
 
 class Camera(BaseCamera):
     """An emulated camera implementation that streams a repeated sequence of
-    files 1.jpg, 2.jpg and 3.jpg at a rate of one frame per second."""
-    imgs = [open('livecamera/' + f + '.jpg', 'rb').read() for f in ['1', '2', '3']]
+    files 1.jpg, 2.jpg and 3.jpg at a rate of one frame per second (or fps)."""
+    fps = 1
+    imgs = None  # loaded on first use, next to this module (any working directory)
 
     @staticmethod
-    def frames():
+    def load():
+        folder = os.path.dirname(os.path.abspath(__file__))
+        imgs = []
+        for f in ['1', '2', '3']:
+            with open(os.path.join(folder, f + '.jpg'), 'rb') as img:
+                imgs.append(img.read())
+        Camera.imgs = imgs
+
+    @staticmethod
+    def frames(resolution=None):
+        if Camera.imgs is None:
+            Camera.load()
         while True:
-            yield Camera.imgs[int(time.time()) % 3]
-            time.sleep(1)
+            yield Camera.imgs[int(time.time() * Camera.fps) % 3]
+            time.sleep(1 / Camera.fps)
@@ -6,20 +6,23 @@ from .base_camera import BaseCamera
 class Camera(BaseCamera):
     video_source = 0
 
-    def __init__(self):
+    def __init__(self, fps=None):
         if os.environ.get('OPENCV_CAMERA_SOURCE'):
             Camera.set_video_source(int(os.environ['OPENCV_CAMERA_SOURCE']))
-        super(Camera, self).__init__()
+        super(Camera, self).__init__(fps)
 
     @staticmethod
     def set_video_source(source):
         Camera.video_source = source
 
     @staticmethod
-    def frames():
+    def frames(resolution=None):
         camera = cv2.VideoCapture(Camera.video_source)
         if not camera.isOpened():
             raise RuntimeError('Could not start camera.')
+        if resolution:
+            camera.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+            camera.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
 
         while True:
             # read current frame
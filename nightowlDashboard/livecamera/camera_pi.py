@@ -6,8 +6,8 @@ from .base_camera import BaseCamera
 
 class Camera(BaseCamera):
     @staticmethod
-    def frames():
-        with picamera.PiCamera(resolution = (640, 480)) as camera:
+    def frames(resolution=None):
+        with picamera.PiCamera(resolution = resolution or (640, 480)) as camera:
             # let camera warm up
             time.sleep(2)
 
@@ -1,35 +1,117 @@
 import io
-from PIL import Image
+import os
 import select
 import v4l2capture
 from .base_camera import BaseCamera
+from .jpegutil import parse_resolution, is_jpeg, complete_mjpeg
+from fnc.metrics import gauge, counter
+
+PASSTHROUGH = gauge('nightowl_v4l2_passthrough', 'v4l2 backend passes the camera MJPEG through (1) or encodes raw frames (0)')
+DROPPED = counter('nightowl_v4l2_dropped_frames', 'v4l2 frames skipped because a newer one was already captured')
 
 
 class Camera(BaseCamera):
-    """Requires python-v4l2capture module: https://github.com/gebart/python-v4l2capture"""
+    """Requires python-v4l2capture module: https://github.com/gebart/python-v4l2capture
+
+    MJPEG pass-through needs a binding whose set_format() takes a fourcc
+    keyword (e.g. the python3-v4l2capture fork); the original binding only
+    negotiates YUYV/RGB24. With such a binding MJPEG is negotiated if the device
+    supports it, and its frames are passed through without decoding (only
+    missing Huffman tables are added). Otherwise frames are captured as RGB24
+    and encoded here with PIL; the reason is logged and kept in
+    passthrough_unavailable. Frames are captured into a ring of mmap'd driver
+    buffers, so the camera keeps running while the consumer is busy; a consumer
+    that falls behind gets the newest frame and the older ones are dropped.
+    read_and_queue() copies each frame out of its buffer (one memcpy per
+    frame). capture_path reports the active path ('mjpeg' or 'rgb')."""
 
-    video_source = "/dev/video0"
+    video_source = os.environ.get('V4L2_DEVICE', '/dev/video0')
+    default_resolution = parse_resolution(os.environ.get('V4L2_RESOLUTION', '640x480'))
+    ring_buffers = 4
+    jpeg_quality = 85  # raw path only
+    capture_path = None
+    capture_size = None
+    passthrough_unavailable = None  # why MJPEG is not passed through (None while it is)
+    dropped = 0
+
+    @staticmethod
+    def _binding_has_fourcc():
+        """Whether v4l2capture can select a pixel format (set_format(..., fourcc=...)),
+        from the documented signature; None if the binding does not document it."""
+        doc = getattr(v4l2capture.Video_device.set_format, '__doc__', None) or ''
+        if 'fourcc' in doc:
+            return True
+        return False if 'set_format(' in doc else None
 
     @staticmethod
-    def frames():
+    def _open(size, mjpeg):
+        """Open the device in MJPEG or RGB24 mode; returns (device, size, first frame)."""
         video = v4l2capture.Video_device(Camera.video_source)
-        # Suggest an image size. The device may choose and return another if unsupported
-        size_x = 640
-        size_y = 480
-        size_x, size_y = video.set_format(size_x, size_y)
-        video.create_buffers(1)
-        video.queue_all_buffers()
-        video.start()
-        bio = io.BytesIO()
+        try:
+            # Suggest an image size. The device may choose and return another if unsupported
+            if mjpeg:
+                size = video.set_format(size[0], size[1], fourcc='MJPG')
+            else:
+                size = video.set_format(size[0], size[1])
+            video.create_buffers(Camera.ring_buffers)
+            video.queue_all_buffers()
+            video.start()
+            select.select((video,), (), ())
+            return video, size, video.read_and_queue()
+        except BaseException:
+            video.close()
+            raise
+
+    @staticmethod
+    def frames(resolution=None):
+        size = parse_resolution(resolution) or Camera.default_resolution
+        video, mjpeg = None, False
+        if Camera._binding_has_fourcc() is False:
+            Camera.passthrough_unavailable = 'v4l2capture binding cannot select MJPG (set_format has no fourcc)'
+        else:
+            try:
+                video, size, frame = Camera._open(size, mjpeg=True)
+            except TypeError as e:  # documented, but rejected by this build
+                Camera.passthrough_unavailable = 'v4l2capture rejected fourcc: {}'.format(e)
+            else:
+                mjpeg = is_jpeg(frame)
+                if not mjpeg:
+                    Camera.passthrough_unavailable = 'device does not deliver MJPEG'
+        if mjpeg:
+            Camera.passthrough_unavailable = None
+        else:
+            print('v4l2: MJPEG pass-through unavailable ({}), encoding raw frames'.format(Camera.passthrough_unavailable))
+            # reopen in RGB24 and encode here
+            if video is not None:
+                video.close()
+            video, size, frame = Camera._open(size, mjpeg=False)
+        Camera.capture_path = 'mjpeg' if mjpeg else 'rgb'
+        Camera.capture_size = tuple(size)
+        PASSTHROUGH.set(int(mjpeg))
+        print('v4l2: {} {}x{} ({})'.format(Camera.video_source, size[0], size[1],
+                                         'MJPEG pass-through' if mjpeg else 'RGB24, encoded with PIL'))
+        if not mjpeg:
+            from PIL import Image
+            bio = io.BytesIO()
 
         try:
             while True:
-                select.select((video,), (), ())  # Wait for the device to fill the buffer.
-                image_data = video.read_and_queue()
-                image = Image.frombytes("RGB", (size_x, size_y), image_data)
-                image.save(bio, format="jpeg")
-                yield bio.getvalue()
-                bio.seek(0)
-                bio.truncate()
+                if frame is None:
+                    select.select((video,), (), ())  # Wait for the device to fill a buffer.
+                    frame = video.read_and_queue()  # copied out, the buffer goes straight back to the driver
+                    # buffers filled while the consumer was busy: keep only the newest frame
+                    while select.select((video,), (), (), 0)[0]:
+                        frame = video.read_and_queue()
+                        Camera.dropped += 1
+                        DROPPED.inc()
+                if mjpeg:
+                    yield complete_mjpeg(frame)
+                else:
+                    image = Image.frombytes("RGB", size, frame)
+                    image.save(bio, format="jpeg", quality=Camera.jpeg_quality)
+                    yield bio.getvalue()
+                    bio.seek(0)
+                    bio.truncate()
+                frame = None
         finally:
             video.close()
@@ -0,0 +1,62 @@
+import io
+
+
+def parse_resolution(resolution):
+    """Return a (width, height) tuple for '854x480' style strings or tuples;
+    None stays None (native resolution)."""
+    if resolution is None:
+        return None
+    if isinstance(resolution, str):
+        w, h = resolution.lower().split('x')
+        return int(w), int(h)
+    return int(resolution[0]), int(resolution[1])
+
+
+def scale_jpeg(frame, resolution=None, quality=85, width=None):
+    """Re-encode a JPEG frame so it fits into resolution (or the given width,
+    keeping the aspect ratio) at the given quality. Requires PIL."""
+    from PIL import Image
+    img = Image.open(io.BytesIO(frame))
+    if width is not None:
+        resolution = (width, max(1, round(img.height * width / img.width)))
+    if resolution is not None:
+        size = parse_resolution(resolution)
+        if img.width > size[0] or img.height > size[1]:
+            img.draft('RGB', size)  # let the JPEG decoder downscale by 1/2, 1/4, 1/8
+            img.thumbnail(size)
+    out = io.BytesIO()
+    img.convert('RGB').save(out, format='jpeg', quality=quality)
+    return out.getvalue()
+
+
+# standard Huffman tables (JPEG spec K.3) as one DHT segment; UVC cameras
+# leave them out of their MJPEG frames to save bandwidth
+DHT_SEGMENT = bytes.fromhex(
+    'ffc401a2'
+    '00' '00010501010101010100000000000000000102030405060708090a0b'
+    '10' '0002010303020403050504040000017d01020300041105122131410613516107227114328191a1082342b1c11552d1f02433627282090a161718191a25262728292a3435363738393a434445464748494a535455565758595a636465666768696a737475767778797a838485868788898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9fa'
+    '01' '00030101010101010101010000000000000102030405060708090a0b'
+    '11' '00020102040403040705040400010277000102031104052131061241510761711322328108144291a1b1c109233352f0156272d10a162434e125f11718191a262728292a35363738393a434445464748494a535455565758595a636465666768696a737475767778797a82838485868788898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae2e3e4e5e6e7e8e9eaf2f3f4f5f6f7f8f9fa')
+
+
+def is_jpeg(frame):
+    return frame[:2] == b'\xff\xd8'
+
+
+def complete_mjpeg(frame):
+    """Turn a camera MJPEG frame into a standalone JPEG without decoding it:
+    insert the standard Huffman tables if the frame has none and cut off
+    padding after the end-of-image marker. Only the headers are walked."""
+    if not frame.endswith(b'\xff\xd9'):
+        end = frame.rfind(b'\xff\xd9')
+        if end > 0:
+            frame = frame[:end + 2]
+    i = 2
+    while i + 4 <= len(frame) and frame[i] == 0xff:
+        marker = frame[i + 1]
+        if marker == 0xc4:
+            return frame  # has its own tables
+        if marker == 0xda:
+            return frame[:i] + DHT_SEGMENT + frame[i:]  # tables go before the scan
+        i += 2 + int.from_bytes(frame[i + 2:i + 4], 'big')
+    return frame
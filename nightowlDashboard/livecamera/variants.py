@@ -0,0 +1,69 @@
+import threading
+from .jpegutil import scale_jpeg
+
+
+class Variant(object):
+    """One size/quality variant of the live stream."""
+    def __init__(self, width, quality):
+        self.width = width
+        self.quality = quality
+        self.subscribers = 0
+        self.frame_id = None
+        self.frame = None
+        self.encodes = 0
+        self.lock = threading.Lock()
+
+
+class VariantCache(object):
+    """Encode-once cache for scaled versions of the live stream.
+
+    Each (width, quality) variant is encoded at most once per source frame
+    and shared by all clients subscribed to it. A variant is dropped as soon
+    as its last subscriber leaves. Widths are rounded to multiples of 16 and
+    qualities to multiples of 5 so that similar requests share a variant.
+    """
+    min_width = 80
+    max_width = 1920
+
+    def __init__(self):
+        self.variants = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def key(cls, width=None, quality=None):
+        """Normalize request parameters; returns None for the original
+        stream."""
+        if width is None and quality is None:
+            return None
+        if width is not None:
+            width = min(max(int(width) // 16 * 16, cls.min_width), cls.max_width)
+        quality = min(max(int(quality) // 5 * 5, 10), 95) if quality is not None else 75
+        return width, quality
+
+    def subscribe(self, key):
+        with self._lock:
+            if key not in self.variants:
+                self.variants[key] = Variant(*key)
+            self.variants[key].subscribers += 1
+
+    def unsubscribe(self, key):
+        with self._lock:
+            variant = self.variants.get(key)
+            if variant is not None:
+                variant.subscribers -= 1
+                if variant.subscribers <= 0:
+                    del self.variants[key]
+
+    def get(self, key, frame_id, frame):
+        """Return the variant of source frame frame_id, encoding it if this
+        is the first client asking for it."""
+        variant = self.variants.get(key)
+        if variant is None:
+            # not subscribed (or evicted in between); encode uncached
+            return scale_jpeg(frame, quality=key[1], width=key[0])
+        with variant.lock:
+            if variant.frame_id != frame_id:
+                variant.frame = scale_jpeg(frame, quality=variant.quality, width=variant.width)
+                variant.frame_id = frame_id
+                variant.encodes += 1
+            return variant.frame